@@ -0,0 +1,76 @@
+import argparse
+import json
+import os
+import sys
+import time
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+
+from src.db.reranker import BGEReranker
+
+def load_queries(path: str) -> list:
+    """
+    讀取評測集 (JSONL)，每行格式：
+    {"query": "...", "candidates": ["chunk 1", "chunk 2", ...], "relevant": [0, 3]}
+    relevant 為 candidates 中相關 chunk 的索引。
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def evaluate(reranker: BGEReranker, queries: list, top_k: int) -> dict:
+    latencies, recalls, rankings = [], [], []
+    for item in queries:
+        docs = [{"page_content": c, "metadata": {"idx": i}} for i, c in enumerate(item["candidates"])]
+        start = time.perf_counter()
+        ranked = reranker.rerank(item["query"], docs, top_k=top_k)
+        latencies.append(time.perf_counter() - start)
+
+        top = [d["metadata"]["idx"] for d in ranked]
+        rankings.append(top)
+        relevant = set(item.get("relevant", []))
+        if relevant:
+            recalls.append(len(relevant.intersection(top)) / len(relevant))
+
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "mean_ms": float(latencies_ms.mean()),
+        "p95_ms": float(np.percentile(latencies_ms, 95)),
+        "recall": float(np.mean(recalls)) if recalls else float("nan"),
+        "rankings": rankings,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="比較 fp32 與動態 int8 量化 Reranker 的延遲與召回率")
+    parser.add_argument("queries", help="評測集 JSONL 路徑 (需與調參用的資料分開)")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--max-length", type=int, default=512)
+    parser.add_argument("--warmup", type=int, default=2, help="正式量測前的暖機查詢數")
+    args = parser.parse_args()
+
+    queries = load_queries(args.queries)
+    print(f"Loaded {len(queries)} queries from {args.queries}")
+
+    results = {}
+    for label, quantize in (("fp32", False), ("int8", True)):
+        # 關閉分數快取，確保每次都實際執行模型
+        reranker = BGEReranker(quantize=quantize, max_length=args.max_length, cache_size=0)
+        for item in queries[:args.warmup]:
+            reranker.rerank(item["query"], [{"page_content": c} for c in item["candidates"]], top_k=args.top_k)
+        results[label] = evaluate(reranker, queries, args.top_k)
+        reranker.batcher.close()
+
+    # int8 與 fp32 的 top-k 重疊率 (衡量量化造成的排序變動)
+    overlap = np.mean([
+        len(set(a).intersection(b)) / max(len(a), 1)
+        for a, b in zip(results["fp32"]["rankings"], results["int8"]["rankings"])
+    ])
+
+    print(f"\n{'mode':<6}{'mean (ms)':>12}{'p95 (ms)':>12}{'recall@' + str(args.top_k):>12}")
+    for label, r in results.items():
+        print(f"{label:<6}{r['mean_ms']:>12.1f}{r['p95_ms']:>12.1f}{r['recall']:>12.3f}")
+    print(f"\nSpeedup (mean): {results['fp32']['mean_ms'] / results['int8']['mean_ms']:.2f}x")
+    print(f"Top-{args.top_k} overlap int8 vs fp32: {overlap:.3f}")
+
+if __name__ == "__main__":
+    main()
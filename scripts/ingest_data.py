@@ -2,95 +2,176 @@ import os
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from glob import glob
+import json
+import time
+from collections import Counter
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Set
 from dotenv import load_dotenv
 
 from langchain_community.document_loaders import DirectoryLoader, TextLoader, PyPDFLoader, CSVLoader, JSONLoader
+from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
 from src.db.qdrant_store import QdrantStore
 from src.db.neo4j_store import Neo4jStore
 from src.db.bm25_store import BM25Store
+from src.db.base import document_id
+from src.db.corpus_version import bump_corpus_version
 from src.orchestration.nodes.researcher import get_embeddings
 
 load_dotenv()
 
-def main():
-    project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
-    raw_dir = os.path.join(project_root, "data", "raw")
-    
-    # 建立 Loaders
-    txt_loader = DirectoryLoader(raw_dir, glob="**/*.txt", loader_cls=TextLoader)
-    pdf_loader = DirectoryLoader(raw_dir, glob="**/*.pdf", loader_cls=PyPDFLoader)
-    csv_loader = DirectoryLoader(raw_dir, glob="**/*.csv", loader_cls=CSVLoader)
-    # JSONLoader 需要指定 jq schema，這裡用最簡單的 '.' 取出所有內容，並設定 text_content=False 將 dict 轉成文字
-    json_loader = DirectoryLoader(raw_dir, glob="**/*.json", loader_cls=JSONLoader, loader_kwargs={'jq_schema': '.', 'text_content': False})
-
-    docs = []
-    print("正在載入 TXT 檔案...")
-    docs.extend(txt_loader.load())
-    
-    print("正在載入 PDF 檔案...")
-    docs.extend(pdf_loader.load())
-    
-    print("正在載入 CSV 檔案...")
-    docs.extend(csv_loader.load())
-    
-    print("正在載入 JSON 檔案...")
-    docs.extend(json_loader.load())
-
-    print(f"總共載入 {len(docs)} 份文件。")
-
-    # 分塊 (Split)
-    print("開始分割文本...")
-    splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
-    split_docs = splitter.split_documents(docs)
-    
-    # 轉換成 Store 規範的格式
-    formatted_docs = []
-    for d in split_docs:
-        formatted_docs.append({
-            "page_content": d.page_content,
-            "metadata": d.metadata
-        })
-
-    print(f"分割完畢，產生 {len(formatted_docs)} 個文本區塊 (Chunks)。")
-
-    # 連線設定
+# 每批寫入各資料庫的 chunk 數：載入、切塊與寫入以批次串流進行，峰值記憶體只與批次大小有關
+INGEST_BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", "500"))
+# 上次匯入的 chunk ID 清單：本次匯入未再出現的 ID (來源檔被刪除或變短) 會從各資料庫刪除
+INGEST_MANIFEST_PATH = os.environ.get("INGEST_MANIFEST_PATH", "data/processed/ingest_manifest.json")
+STORE_NAMES = ("Qdrant", "Neo4j", "BM25")
+
+def iter_raw_documents(raw_dir: str) -> Iterator[Document]:
+    """逐一產生原始文件 (各 Loader 以 lazy_load 逐檔讀取，不一次載入整個目錄)"""
+    loaders = [
+        ("TXT", DirectoryLoader(raw_dir, glob="**/*.txt", loader_cls=TextLoader)),
+        ("PDF", DirectoryLoader(raw_dir, glob="**/*.pdf", loader_cls=PyPDFLoader)),
+        ("CSV", DirectoryLoader(raw_dir, glob="**/*.csv", loader_cls=CSVLoader)),
+        # JSONLoader 需要指定 jq schema，這裡用最簡單的 '.' 取出所有內容，並設定 text_content=False 將 dict 轉成文字
+        ("JSON", DirectoryLoader(raw_dir, glob="**/*.json", loader_cls=JSONLoader, loader_kwargs={'jq_schema': '.', 'text_content': False})),
+    ]
+    for kind, loader in loaders:
+        print(f"正在載入 {kind} 檔案...")
+        yield from loader.lazy_load()
+
+def iter_chunks(documents: Iterable[Document], splitter: RecursiveCharacterTextSplitter) -> Iterator[Dict[str, Any]]:
+    """
+    逐份文件切塊並轉換成 Store 規範的格式。
+    metadata['chunk_index'] 為 chunk 在來源檔中的位置 (PDF 跨頁連續編號)，
+    document_id 以 (來源, 位置) 決定 ID，內容修改後仍覆寫同一筆資料。
+    """
+    positions: Counter = Counter()
+    for doc in documents:
+        for chunk in splitter.split_documents([doc]):
+            source = chunk.metadata.get("source", "unknown")
+            chunk.metadata["chunk_index"] = positions[source]
+            positions[source] += 1
+            yield {
+                "page_content": chunk.page_content,
+                "metadata": chunk.metadata
+            }
+
+def batched(items: Iterable[Dict[str, Any]], batch_size: int) -> Iterator[List[Dict[str, Any]]]:
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+def _open_stores() -> Dict[str, Any]:
+    """建立各資料庫連線；連線失敗的資料庫不參與本次匯入"""
     qdrant_path = os.environ.get("QDRANT_PATH", "data/qdrant_db")
     neo4j_uri = os.environ.get("NEO4J_URI", "bolt://localhost:7687")
-
-    try:
-        print(f"正在連線至 Qdrant (Path: {qdrant_path})...")
-        qdrant_store = QdrantStore(
+    factories = [
+        ("Qdrant", f"Path: {qdrant_path}", lambda: QdrantStore(
             collection_name="deep_research_rag_bge",
             embedding_model=get_embeddings(),
             vector_size=768,
             qdrant_path=qdrant_path
-        )
-        print("將 Chunk 寫入 Qdrant...")
-        qdrant_store.add_documents(formatted_docs)
-        print("Qdrant 寫入成功！")
-    except Exception as e:
-        print(f"[錯誤] Qdrant 寫入失敗: {e}")
+        )),
+        ("Neo4j", f"URI: {neo4j_uri}", lambda: Neo4jStore(uri=neo4j_uri)),
+        ("BM25", "本地索引", BM25Store),
+    ]
+    stores = {}
+    for name, target, factory in factories:
+        try:
+            print(f"正在連線至 {name} ({target})...")
+            stores[name] = factory()
+        except Exception as e:
+            print(f"[錯誤] {name} 連線失敗: {e}")
+    return stores
 
-    try:
-        print(f"正在連線至 Neo4j (URI: {neo4j_uri})...")
-        neo4j_store = Neo4jStore(uri=neo4j_uri)
-        print("將 Entity 與 Chunk 關聯寫入 Neo4j...")
-        neo4j_store.add_documents(formatted_docs)
-        neo4j_store.close()
-        print("Neo4j 寫入成功！")
-    except Exception as e:
-        print(f"[錯誤] Neo4j 寫入失敗: {e}")
+def _load_manifest(path: str) -> Set[str]:
+    if not os.path.exists(path):
+        return set()
+    with open(path, "r", encoding="utf-8") as f:
+        return set(json.load(f)["ids"])
 
+def _save_manifest(path: str, ids: Set[str]) -> None:
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"ids": sorted(ids)}, f)
+    os.replace(tmp_path, path)
+
+def _delete_stale(stores: Dict[str, Any], stale: List[str]) -> bool:
+    """
+    從各資料庫刪除本次匯入未再出現的 chunk。
+    :return: 是否所有資料庫都已刪除 (否則保留在清單中，下次匯入重試)
+    """
+    complete = set(stores) == set(STORE_NAMES)
+    for name, store in stores.items():
+        try:
+            removed = store.delete_documents(stale)
+            print(f"{name} 已刪除 {removed} 個過期區塊")
+        except Exception as e:
+            print(f"[錯誤] {name} 刪除過期區塊失敗: {e}")
+            complete = False
+    return complete
+
+def _close(name: str, store: Any) -> None:
     try:
-        print("正在建立並寫入 BM25 索引...")
-        bm25_store = BM25Store()
-        bm25_store.add_documents(formatted_docs)
-        print("BM25 寫入成功！")
+        store.close()
     except Exception as e:
-        print(f"[錯誤] BM25 寫入失敗: {e}")
+        print(f"[錯誤] {name} 關閉失敗: {e}")
+
+def main():
+    project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+    raw_dir = os.path.join(project_root, "data", "raw")
+    splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
+
+    stores = _open_stores()
+    written = {name: 0 for name in stores}
+    start = time.perf_counter()
+    total = 0
+    current_ids: Set[str] = set()
+
+    # 載入 -> 切塊 -> 分批寫入各資料庫 (Qdrant 於批次內仍以嵌入 / 上傳重疊的方式串流寫入)
+    for batch in batched(iter_chunks(iter_raw_documents(raw_dir), splitter), INGEST_BATCH_SIZE):
+        total += len(batch)
+        current_ids.update(document_id(doc) for doc in batch)
+        for name, store in list(stores.items()):
+            try:
+                if name == "Qdrant":
+                    stats = store.add_documents_stream(batch)
+                    written[name] += stats["documents"] - stats["skipped"]
+                else:
+                    written[name] += store.add_documents(batch)
+            except Exception as e:
+                # 單一資料庫失敗不影響其他資料庫，之後的批次也不再寫入該資料庫
+                print(f"[錯誤] {name} 寫入失敗: {e}")
+                stores.pop(name)
+                _close(name, store)
+        print(f"已處理 {total} 個文本區塊 (Chunks)...")
+
+    # 來源檔被刪除或變短而消失的 chunk；有資料庫未完成刪除時保留在清單中，下次匯入重試
+    stale = sorted(_load_manifest(INGEST_MANIFEST_PATH) - current_ids)
+    if stale and not _delete_stale(stores, stale):
+        current_ids.update(stale)
+    _save_manifest(INGEST_MANIFEST_PATH, current_ids)
+
+    for name, store in stores.items():
+        # BM25 關閉時會等待分段合併完成並清除舊分段，否則程序結束時背景合併會被中斷
+        _close(name, store)
+        print(f"{name} 寫入成功！新增 / 更新 {written[name]} 個區塊，{total - written[name]} 個未變動而略過")
+
+    elapsed = time.perf_counter() - start
+    rate = total / elapsed if elapsed > 0 else 0.0
+    print(f"總共產生 {total} 個文本區塊，耗時 {elapsed:.1f}s ({rate:.1f} chunks/s)")
+
+    # 語料已變動，讓 API 端的答案快取失效
+    version = bump_corpus_version()
+    print(f"語料版本已更新: {version}")
 
     print("=== 資料匯入匯入管線 (Ingestion Pipeline) 執行完畢 ===")
 
@@ -1,15 +1,50 @@
+import asyncio
+import json
+import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 import uuid
 
 # 如果需要跨域請求，這在容器化架構也有用
 from fastapi.middleware.cors import CORSMiddleware
 
-from langchain_core.messages import HumanMessage
-from src.orchestration.graph import graph
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
+from src.db.answer_cache import SemanticAnswerCache
+from src.db.corpus_version import get_corpus_version
+from src.orchestration.graph import graph, memory
+from src.orchestration.llm import aclose_llm_clients, get_response_cache
+from src.orchestration.nodes.planner import get_rewrite_cache_stats
+from src.orchestration.nodes.researcher import close_retriever_registry, get_cache_stats, get_embeddings
+from src.orchestration.state import reset_docs
 
-app = FastAPI(title="Deep Research Agent API", description="Agentic RAG Backend Server", version="1.0.0")
+# 語意答案快取 (僅用於第一輪問題)
+ANSWER_CACHE_ENABLED = os.environ.get("ANSWER_CACHE_ENABLED", "true").strip().lower() in ("1", "true", "yes", "on")
+_answer_cache: Optional[SemanticAnswerCache] = None
+
+def get_answer_cache() -> Optional[SemanticAnswerCache]:
+    global _answer_cache
+    if not ANSWER_CACHE_ENABLED:
+        return None
+    if _answer_cache is None:
+        _answer_cache = SemanticAnswerCache(
+            get_embeddings(),
+            threshold=float(os.environ.get("ANSWER_CACHE_THRESHOLD", "0.92")),
+            max_entries=int(os.environ.get("ANSWER_CACHE_SIZE", "512")),
+            ttl=float(os.environ.get("ANSWER_CACHE_TTL", "3600")) or None
+        )
+    return _answer_cache
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # 關閉長駐的資料庫連線 (Qdrant / Neo4j / BM25) 與 LLM HTTP 連線池
+    close_retriever_registry()
+    await aclose_llm_clients()
+
+app = FastAPI(title="Deep Research Agent API", description="Agentic RAG Backend Server", version="1.0.0", lifespan=lifespan)
 
 # 允許 CORS
 app.add_middleware(
@@ -33,54 +68,215 @@ class ChatResponse(BaseModel):
     sources: List[SourceDoc]
     reasoning_logs: List[str]
 
-@app.post("/chat", response_model=ChatResponse)
-async def chat_endpoint(request: ChatRequest):
-    if not request.message.strip():
-        raise HTTPException(status_code=400, detail="Message cannot be empty.")
-    
-    # 建立 LangGraph 初始狀態
-    thread_id = request.thread_id or str(uuid.uuid4())
-    inputs = {
+def _initial_inputs(request: ChatRequest) -> dict:
+    """建立 LangGraph 初始狀態"""
+    return {
         "messages": [HumanMessage(content=request.message)],
         "current_plan": "",
         "retrieved_docs": [],
         "search_count": 0
     }
+
+def _to_sources(docs: list) -> List[SourceDoc]:
+    return [
+        SourceDoc(content=doc.get("page_content", ""), metadata=doc.get("metadata", {}))
+        for doc in docs
+    ]
+
+def _build_response(final_state: dict) -> ChatResponse:
+    """將圖的最終狀態整理成 API 回應 (答案、來源與推論軌跡)"""
+    # 解析返回狀態
+    final_messages = final_state.get("messages", [])
+    answer = final_messages[-1].content if final_messages else "No answer generated."
     
+    docs = final_state.get("retrieved_docs", [])
+    
+    # 準備 Reasoning Logs 供前端展示
+    plan = final_state.get("current_plan", "")
+    search_count = final_state.get("search_count", 0)
+    timed_out = final_state.get("timed_out_engines", [])
+    logs = [
+        f"🎯 意圖分析與計畫 (Planner): {plan}",
+        f"🔍 檢索執行次數 (Researcher): 進行了 {search_count} 次 Multi-hop 檢索",
+    ]
+    if timed_out:
+        logs.append(f"⏱️ 逾時捨棄的檢索引擎 (Researcher): {', '.join(timed_out)}")
+    logs += [
+        f"📄 收集到文件總數 (Reviewer): {len(docs)} 份指引",
+        f"🤖 答案綜合生成 (Generator): 完成生成"
+    ]
+    
+    return ChatResponse(
+        answer=answer,
+        sources=_to_sources(docs),
+        reasoning_logs=logs
+    )
+
+async def _lookup_answer_cache(request: ChatRequest, config: dict) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """
+    第一輪問題先查詢語意答案快取。
+    :return: (命中的快取項目, 查詢時的語料版本)；非第一輪或未啟用快取時版本為 None，代表不寫回快取
+    """
+    if not ANSWER_CACHE_ENABLED:
+        return None, None
+    # 後續輪次的答案取決於對話上下文，不使用快取
+    snapshot = await graph.aget_state(config)
+    if snapshot.values.get("messages"):
+        return None, None
+
+    version = get_corpus_version()
     try:
-        final_state = graph.invoke(inputs, config={"configurable": {"thread_id": thread_id}})
-        
-        # 解析返回狀態
-        final_messages = final_state.get("messages", [])
-        answer = final_messages[-1].content if final_messages else "No answer generated."
-        
-        docs = final_state.get("retrieved_docs", [])
-        sources = [
-            SourceDoc(content=doc.get("page_content", ""), metadata=doc.get("metadata", {}))
-            for doc in docs
-        ]
-        
-        # 準備 Reasoning Logs 供前端展示
-        plan = final_state.get("current_plan", "")
-        search_count = final_state.get("search_count", 0)
-        logs = [
-            f"🎯 意圖分析與計畫 (Planner): {plan}",
-            f"🔍 檢索執行次數 (Researcher): 進行了 {search_count} 次 Multi-hop 檢索",
-            f"📄 收集到文件總數 (Reviewer): {len(docs)} 份指引",
-            f"🤖 答案綜合生成 (Generator): 完成生成"
+        # 建立快取與計算問題向量皆屬於模型推論，於執行緒池中執行
+        loop = asyncio.get_running_loop()
+        cache = await loop.run_in_executor(None, get_answer_cache)
+        hit = await loop.run_in_executor(None, cache.lookup, request.message)
+    except Exception as e:
+        print(f"[AnswerCache] Lookup error: {e}")
+        return None, None
+    return hit, version
+
+async def _apply_cache_hit(request: ChatRequest, config: dict, hit: Dict[str, Any]) -> ChatResponse:
+    """將快取答案寫入對話狀態 (後續追問才有上下文)，並組成回應"""
+    docs = [{"page_content": s["content"], "metadata": s["metadata"]} for s in hit["sources"]]
+    await graph.aupdate_state(
+        config,
+        {
+            "messages": [HumanMessage(content=request.message), AIMessage(content=hit["answer"])],
+            "current_plan": "",
+            "retrieved_docs": reset_docs(docs),
+            "search_count": 0
+        },
+        as_node="generator"
+    )
+    return ChatResponse(
+        answer=hit["answer"],
+        sources=[SourceDoc(**s) for s in hit["sources"]],
+        reasoning_logs=[
+            f"⚡ 語意快取命中 (Answer Cache): 與先前問題「{hit['question']}」相似度 {hit['similarity']:.3f}，略過檢索與生成"
         ]
-        
-        return ChatResponse(
-            answer=answer,
-            sources=sources,
-            reasoning_logs=logs
+    )
+
+async def _store_answer_cache(request: ChatRequest, response: ChatResponse, version: Optional[str], final_state: dict) -> None:
+    """
+    將第一輪問題的答案寫入快取。
+    有引擎逾時 (結果不完整) 或沒有任何來源的降級答案不寫入，避免之後相似的問題都拿到這個答案。
+    """
+    if version is None:
+        return
+    if final_state.get("timed_out_engines") or not response.sources:
+        print("[AnswerCache] Skip storing degraded answer (timed-out engines or no sources)")
+        return
+    sources = [source.model_dump() for source in response.sources]
+    try:
+        await asyncio.get_running_loop().run_in_executor(
+            None, get_answer_cache().store, request.message, response.answer, sources, version
         )
+    except Exception as e:
+        print(f"[AnswerCache] Store error: {e}")
+
+@app.post("/chat", response_model=ChatResponse)
+async def chat_endpoint(request: ChatRequest):
+    if not request.message.strip():
+        raise HTTPException(status_code=400, detail="Message cannot be empty.")
+    
+    thread_id = request.thread_id or str(uuid.uuid4())
+    config = {"configurable": {"thread_id": thread_id}}
+    inputs = _initial_inputs(request)
+    
+    try:
+        # 第一輪問題若與先前問題語意相近，直接回傳快取答案
+        hit, version = await _lookup_answer_cache(request, config)
+        if hit is not None:
+            return await _apply_cache_hit(request, config, hit)
+
+        # 以 async 執行整個圖，模型推論與資料庫查詢皆在執行緒池中進行，不阻塞其他連線
+        final_state = await graph.ainvoke(inputs, config=config)
+        response = _build_response(final_state)
+        await _store_answer_cache(request, response, version, final_state)
+        return response
         
     except Exception as e:
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Agent Execution Error: {str(e)}")
 
+def _sse(event: str, data: dict) -> str:
+    """格式化一筆 Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest):
+    """
+    串流版本的 /chat (Server-Sent Events)，事件依序為：
+    - start: 對話 thread_id
+    - node: 每個節點完成時送出 (planner / researcher / reviewer / generator)
+    - sources: 每次 Researcher 重排序完成後送出該輪新增的文件
+    - token: Generator 產生的 LLM token
+    - done: 與 /chat 相同格式的完整回應
+    - error: 執行失敗
+    """
+    if not request.message.strip():
+        raise HTTPException(status_code=400, detail="Message cannot be empty.")
+
+    thread_id = request.thread_id or str(uuid.uuid4())
+    config = {"configurable": {"thread_id": thread_id}}
+    inputs = _initial_inputs(request)
+
+    async def event_stream():
+        yield _sse("start", {"thread_id": thread_id})
+        try:
+            hit, version = await _lookup_answer_cache(request, config)
+            if hit is not None:
+                response = await _apply_cache_hit(request, config, hit)
+                yield _sse("sources", {"sources": [source.model_dump() for source in response.sources]})
+                yield _sse("token", {"content": response.answer})
+                yield _sse("done", response.model_dump())
+                return
+
+            async for mode, chunk in graph.astream(inputs, config=config, stream_mode=["updates", "messages"]):
+                if mode == "updates":
+                    for node, update in chunk.items():
+                        yield _sse("node", {"node": node})
+                        docs = (update or {}).get("retrieved_docs")
+                        if node == "researcher" and docs:
+                            yield _sse("sources", {"sources": [doc.model_dump() for doc in _to_sources(docs)]})
+                elif mode == "messages":
+                    # 只轉送 Generator 串流中的 token (Planner 的 Query Rewriting 與節點最後寫回狀態的完整訊息不重複輸出)
+                    message_chunk, metadata = chunk
+                    if (metadata.get("langgraph_node") == "generator"
+                            and isinstance(message_chunk, AIMessageChunk) and message_chunk.content):
+                        yield _sse("token", {"content": message_chunk.content})
+
+            snapshot = await graph.aget_state(config)
+            response = _build_response(snapshot.values)
+            yield _sse("done", response.model_dump())
+            await _store_answer_cache(request, response, version, snapshot.values)
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            yield _sse("error", {"detail": f"Agent Execution Error: {str(e)}"})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        # 避免反向代理緩衝，事件才能即時送達
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/metrics")
+def metrics():
+    """各層快取命中率與對話狀態佔用量"""
+    stats = get_cache_stats()
+    stats["rewrites"] = get_rewrite_cache_stats()
+    if _answer_cache is not None:
+        stats["answers"] = _answer_cache.stats
+    llm_cache = get_response_cache()
+    if llm_cache is not None:
+        stats["llm_responses"] = llm_cache.stats
+    if hasattr(memory, "stats"):
+        stats["checkpointer"] = memory.stats
+    return stats
+
 @app.get("/health")
 def health_check():
     return {"status": "ok"}
@@ -0,0 +1,93 @@
+import re
+import unicodedata
+from abc import ABC, abstractmethod
+from typing import List, Dict, Any, Iterable, Optional, Tuple
+
+# CJK 統一表意文字 (含擴充 A、相容字)、日文假名、韓文音節
+_CJK_CHARS = r"\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\u3040-\u30ff\uac00-\ud7af"
+_TOKEN_PATTERN = re.compile(rf"([{_CJK_CHARS}]+)|([0-9A-Za-z\u00c0-\u024f]+)")
+_CJK_WORD = re.compile(rf"[{_CJK_CHARS}]+")
+
+# 常見的英文虛詞與中文功能詞：英文作用於完整 token；中文功能詞在產生 n-gram 前視為分隔符號
+# (「機車的罰鍰」切為 機車 / 罰鍰，不產生 車的、的罰)
+DEFAULT_STOPWORDS = frozenset([
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "is", "it",
+    "of", "on", "or", "that", "the", "this", "to", "was", "were", "with",
+    "的", "了", "著", "之", "及", "與", "和", "或", "而", "並", "其", "也",
+    "我們", "你們", "他們", "以及", "或者", "因為", "所以", "但是",
+])
+
+class BaseAnalyzer(ABC):
+    """
+    稀疏檢索用的斷詞器介面。
+    (內容未變的 chunk 在寫入索引前即以內容雜湊略過，不需另外快取 token)
+    """
+
+    @abstractmethod
+    def tokenize(self, text: str) -> List[str]:
+        """將單一文字切成 token 列表"""
+        pass
+
+    @property
+    def config(self) -> Dict[str, Any]:
+        """斷詞設定，寫入索引 metadata 以確認查詢與建索引使用相同斷詞方式"""
+        return {"name": type(self).__name__}
+
+    def tokenize_batch(self, texts: Iterable[str]) -> List[List[str]]:
+        """批次斷詞，子類別可覆寫以批次處理"""
+        return [self.tokenize(text) for text in texts]
+
+class WhitespaceAnalyzer(BaseAnalyzer):
+    """以空白切分 (與 LangChain BM25Retriever 的預設前處理一致)"""
+
+    def tokenize(self, text: str) -> List[str]:
+        return text.split()
+
+class CJKAnalyzer(BaseAnalyzer):
+    """
+    CJK 感知的斷詞器：
+    - 連續的中日韓文字切成字元 n-gram (預設 bigram，可設定至 trigram)，單字則保留 unigram
+    - 拉丁字母 / 數字以詞為單位並轉小寫
+    - 先做 NFKC 正規化 (全形轉半形)，標點與空白皆視為分隔
+    - 可選擇移除停用詞：CJK 停用詞在產生 n-gram 前切開連續文字，其餘停用詞移除完整 token
+    """
+
+    # 斷詞規則變更時遞增，使既有索引在下一次寫入前重建
+    VERSION = 2
+
+    def __init__(self, ngram_range: Tuple[int, int] = (2, 2), stopwords: Optional[Iterable[str]] = None):
+        """
+        :param ngram_range: CJK 字元 n-gram 的 (最小, 最大) 長度
+        :param stopwords: 要移除的停用詞，None 表示不移除
+        """
+        self.ngram_range = ngram_range
+        self.stopwords = frozenset(stopwords) if stopwords else frozenset()
+        cjk_stopwords = sorted((word for word in self.stopwords if _CJK_WORD.fullmatch(word)), key=len, reverse=True)
+        self._stopword_pattern = re.compile("|".join(map(re.escape, cjk_stopwords))) if cjk_stopwords else None
+
+    @property
+    def config(self) -> Dict[str, Any]:
+        return {
+            "name": type(self).__name__,
+            "version": self.VERSION,
+            "ngram_range": list(self.ngram_range),
+            "stopwords": sorted(self.stopwords),
+        }
+
+    def tokenize(self, text: str) -> List[str]:
+        min_n, max_n = self.ngram_range
+        tokens = []
+        for cjk_run, latin_word in _TOKEN_PATTERN.findall(unicodedata.normalize("NFKC", text)):
+            if latin_word:
+                tokens.append(latin_word.lower())
+                continue
+            pieces = self._stopword_pattern.split(cjk_run) if self._stopword_pattern else [cjk_run]
+            for piece in filter(None, pieces):
+                if len(piece) < min_n:
+                    tokens.append(piece)
+                    continue
+                for n in range(min_n, min(max_n, len(piece)) + 1):
+                    tokens.extend(piece[i:i + n] for i in range(len(piece) - n + 1))
+        if self.stopwords:
+            tokens = [token for token in tokens if token not in self.stopwords]
+        return tokens
@@ -0,0 +1,129 @@
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from src.db.corpus_version import get_corpus_version
+from src.db.embeddings import normalize_query
+
+class SemanticAnswerCache:
+    """
+    語意答案快取：以問題向量在扁平的 NumPy 矩陣中做 cosine 相似度比對，
+    相似度達 threshold 即直接回傳先前的答案與來源，跳過整個 LangGraph 流程。
+    - 容量固定 (max_entries)，滿了優先覆寫已過期的項目，否則以 LRU 淘汰
+    - 每筆答案在 ttl 秒後過期，語料版本 (corpus_version) 變動時整個清空
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        threshold: float = 0.92,
+        max_entries: int = 512,
+        version_fn: Callable[[], str] = get_corpus_version,
+        ttl: Optional[float] = None,
+    ):
+        """
+        :param embeddings: 問題向量模型 (與檢索共用，查詢向量亦會命中 embedding 快取)
+        :param threshold: 命中所需的最低 cosine 相似度
+        :param max_entries: 最多快取的問題數
+        :param version_fn: 取得目前語料版本的函式
+        :param ttl: 每筆答案的存活秒數，None 表示只依語料版本失效
+        """
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.version_fn = version_fn
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._vectors: Optional[np.ndarray] = None
+        self._entries: List[Optional[Dict[str, Any]]] = []
+        self._last_used = np.zeros(max_entries, dtype=np.float64)
+        self._expires_at = np.full(max_entries, np.inf, dtype=np.float64)
+        self._version = version_fn()
+        self.hits = 0
+        self.misses = 0
+
+    def _embed(self, question: str) -> np.ndarray:
+        vector = np.asarray(self.embeddings.embed_query(normalize_query(question)), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _check_version(self) -> str:
+        """語料版本變動時清空快取 (需持有鎖)"""
+        version = self.version_fn()
+        if version != self._version:
+            self._vectors = None
+            self._entries = []
+            self._last_used[:] = 0
+            self._expires_at[:] = np.inf
+            self._version = version
+        return version
+
+    def lookup(self, question: str) -> Optional[Dict[str, Any]]:
+        """
+        查詢語意相近的已快取問題。
+        :return: 命中時回傳 {"question", "answer", "sources", "similarity"}，否則 None
+        """
+        vector = self._embed(question)
+        with self._lock:
+            self._check_version()
+            if not self._entries:
+                self.misses += 1
+                return None
+            similarities = self._vectors[:len(self._entries)] @ vector
+            similarities[self._expires_at[:len(self._entries)] <= time.monotonic()] = -np.inf
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+            self._last_used[best] = time.monotonic()
+            self.hits += 1
+            return {**self._entries[best], "similarity": float(similarities[best])}
+
+    def store(self, question: str, answer: str, sources: List[Dict[str, Any]], version: Optional[str] = None) -> bool:
+        """
+        寫入快取。
+        :param version: 產生答案時的語料版本；若期間語料已更新則不寫入，避免快取過期答案
+        :return: 是否寫入
+        """
+        vector = self._embed(question)
+        with self._lock:
+            current = self._check_version()
+            if version is not None and version != current:
+                return False
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+
+            now = time.monotonic()
+            expired = np.flatnonzero(self._expires_at[:len(self._entries)] <= now)
+            if expired.size:
+                slot = int(expired[0])
+            elif len(self._entries) < self.max_entries:
+                slot = len(self._entries)
+                self._entries.append(None)
+            else:
+                slot = int(np.argmin(self._last_used))
+            self._vectors[slot] = vector
+            self._entries[slot] = {"question": question, "answer": answer, "sources": sources}
+            self._last_used[slot] = now
+            self._expires_at[slot] = now + self.ttl if self.ttl is not None else np.inf
+            return True
+
+    def clear(self) -> None:
+        with self._lock:
+            self._vectors = None
+            self._entries = []
+            self._last_used[:] = 0
+            self._expires_at[:] = np.inf
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._entries),
+        }
@@ -1,5 +1,31 @@
+import hashlib
+import uuid
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+
+def content_hash(text: str) -> str:
+    """計算文字內容的 SHA-1 雜湊，用於判斷 chunk 是否變動"""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def document_id(doc: Dict[str, Any]) -> str:
+    """
+    取得文件 (chunk) 的穩定 ID，供所有資料庫共用，使重複匯入具冪等性。
+    優先使用 'id' 或 metadata['id']；其次由來源與 chunk 在來源中的位置 (metadata['chunk_index']) 衍生，
+    內容修改後 ID 不變，各資料庫以 content_hash 判斷是否需要更新，舊版本不會殘留；
+    兩者皆無時才由來源與內容的雜湊衍生。ID 皆為 UUID 格式。
+    :param doc: 包含 'page_content' 與 'metadata' 的字典
+    """
+    metadata = doc.get("metadata", {}) or {}
+    explicit = doc.get("id") or metadata.get("id")
+    if explicit:
+        return str(explicit)
+    source = metadata.get("source", "unknown")
+    if metadata.get("chunk_index") is not None:
+        key = f"{source}\x00#{metadata['chunk_index']}"
+    else:
+        key = f"{source}\x00{doc.get('page_content', '')}"
+    digest = hashlib.sha256(key.encode("utf-8")).digest()
+    return str(uuid.UUID(bytes=digest[:16]))
 
 class BaseRetriever(ABC):
     """
@@ -8,10 +34,11 @@ class BaseRetriever(ABC):
     """
 
     @abstractmethod
-    def add_documents(self, documents: List[Dict[str, Any]]) -> None:
+    def add_documents(self, documents: List[Dict[str, Any]]) -> Optional[int]:
         """
         將文件新增至資料庫
         :param documents: 包含 'page_content' 和 'metadata' 的字典列表
+        :return: 實際寫入 (新增或更新) 的文件數；無法得知時回傳 None
         """
         pass
 
@@ -26,6 +53,26 @@ class BaseRetriever(ABC):
         """
         pass
 
+    def delete_documents(self, ids: List[str]) -> int:
+        """
+        依文件 ID (見 document_id) 刪除文件，不存在的 ID 直接略過。
+        :return: 實際刪除的文件數
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support deletion")
+
+    def health_check(self) -> bool:
+        """
+        檢查底層連線是否仍可用，供長駐的 RetrieverRegistry 判斷是否需重建。
+        子類別可覆寫，預設視為健康。
+        """
+        return True
+
+    def close(self) -> None:
+        """
+        釋放底層連線資源。子類別可覆寫，預設不做任何事。
+        """
+        pass
+
     def rerank(self, query: str, results: List[Dict[str, Any]], top_k: int = 3) -> List[Dict[str, Any]]:
         """
         預留的 Cross-Encoder Reranking 模組呼叫位置
@@ -0,0 +1,95 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional, Sequence
+
+class MicroBatcher:
+    """
+    程序內的動態微批次排程器。
+    多個並行請求各自送出少量輸入 (例如單一查詢的 embedding、數個 reranker 配對)，
+    背景 worker 最多等待 max_wait_ms 或湊滿 max_batch 筆後，依長度排序 (減少 padding)
+    一次呼叫 batch_fn 完成前向運算，再把結果依序回填到各呼叫者的 Future。
+    """
+
+    def __init__(
+        self,
+        batch_fn: Callable[[List[Any]], Sequence[Any]],
+        max_batch: int = 32,
+        max_wait_ms: float = 5.0,
+        sort_key: Optional[Callable[[Any], int]] = len,
+        name: str = "micro-batcher",
+    ):
+        """
+        :param batch_fn: 接收一批輸入、回傳等長結果序列的函式
+        :param max_batch: 單次前向運算的最大筆數
+        :param max_wait_ms: 第一筆輸入到達後最多等待多久以湊批次
+        :param sort_key: 批次內排序依據 (通常為文字長度)，None 表示不排序
+        """
+        self.batch_fn = batch_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.sort_key = sort_key
+        self._queue: "queue.Queue" = queue.Queue()
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name=name, daemon=True)
+        self._worker.start()
+
+    def submit(self, item: Any) -> Future:
+        """送出單筆輸入，回傳對應結果的 Future"""
+        return self.submit_many([item])[0]
+
+    def submit_many(self, items: Sequence[Any]) -> List[Future]:
+        """送出多筆輸入 (可能與其他請求的輸入併入同一批次)"""
+        if self._closed:
+            raise RuntimeError("MicroBatcher is closed")
+        futures = []
+        for item in items:
+            future: Future = Future()
+            self._queue.put((item, future))
+            futures.append(future)
+        return futures
+
+    def __call__(self, items: Sequence[Any]) -> List[Any]:
+        """同步介面：送出並等待所有結果"""
+        return [future.result() for future in self.submit_many(items)]
+
+    def _collect(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                entry = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(entry)
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            collected = self._collect()
+            stop = any(entry is None for entry in collected)
+            batch = [(item, future) for item, future in filter(None, collected) if future.set_running_or_notify_cancel()]
+            if batch:
+                self._process(batch)
+            if stop:
+                return
+
+    def _process(self, batch: list) -> None:
+        if self.sort_key is not None:
+            batch.sort(key=lambda entry: self.sort_key(entry[0]))
+        try:
+            results = self.batch_fn([item for item, _ in batch])
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+
+    def close(self) -> None:
+        """停止 worker (已送出的輸入會先處理完)"""
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._worker.join(timeout=5)
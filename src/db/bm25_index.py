@@ -0,0 +1,532 @@
+import json
+import os
+import shutil
+import threading
+from collections import Counter
+from typing import List, Dict, Any, Tuple, Optional, Set
+
+import numpy as np
+
+def _atomic_write_json(path: str, obj: Any) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def _atomic_save_npy(path: str, array: np.ndarray) -> None:
+    tmp_path = f"{path}.tmp.npy"
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+
+class BM25Segment:
+    """
+    BM25 索引的一個分段 (segment)。
+    postings 以 CSR 格式儲存：term t 的倒排清單位於 indptr[t]:indptr[t+1]，term id 為全域 vocab 的編號。
+    分段建立後不再變動，刪除文件只會在 deleted 遮罩上標記 (tombstone)，實際移除在合併時進行。
+    """
+
+    ARRAY_NAMES = ("indptr", "postings_doc", "postings_tf", "doc_len")
+
+    def __init__(
+        self,
+        name: str,
+        path: str,
+        indptr: np.ndarray,
+        postings_doc: np.ndarray,
+        postings_tf: np.ndarray,
+        doc_len: np.ndarray,
+        doc_ids: List[str],
+        doc_hashes: List[str],
+        doc_offsets: np.ndarray,
+        deleted: Optional[np.ndarray] = None,
+    ):
+        self.name = name
+        self.path = path
+        self.indptr = indptr
+        self.postings_doc = postings_doc
+        self.postings_tf = postings_tf
+        self.doc_len = doc_len
+        self.doc_ids = doc_ids
+        self.doc_hashes = doc_hashes
+        self.doc_offsets = doc_offsets
+        self.deleted = deleted if deleted is not None else np.zeros(len(doc_ids), dtype=bool)
+        self._posting_terms: Optional[np.ndarray] = None
+
+    @property
+    def n_docs(self) -> int:
+        return len(self.doc_ids)
+
+    @property
+    def n_live(self) -> int:
+        return int(self.n_docs - self.deleted.sum())
+
+    @property
+    def n_terms(self) -> int:
+        return int(self.indptr.shape[0] - 1)
+
+    @property
+    def posting_terms(self) -> np.ndarray:
+        """每個 posting 所屬的 term id (由 indptr 展開，延遲計算)"""
+        if self._posting_terms is None:
+            self._posting_terms = np.repeat(np.arange(self.n_terms, dtype=np.int64), np.diff(self.indptr))
+        return self._posting_terms
+
+    @classmethod
+    def build(cls, name: str, path: str, docs: List[Dict[str, Any]], vocab: Dict[str, int]) -> "BM25Segment":
+        """
+        由已斷詞的文件建立分段並寫入硬碟。新出現的詞彙會加入 (並修改) 全域 vocab。
+        :param docs: 每筆包含 'id', 'hash', 'tokens', 'page_content', 'metadata'
+        """
+        term_ids: List[int] = []
+        doc_idx: List[int] = []
+        tfs: List[int] = []
+        for i, doc in enumerate(docs):
+            for term, tf in Counter(doc["tokens"]).items():
+                term_ids.append(vocab.setdefault(term, len(vocab)))
+                doc_idx.append(i)
+                tfs.append(tf)
+
+        term_arr = np.asarray(term_ids, dtype=np.int64)
+        # 依 term id 排序 (同 term 內維持 doc 順序) 形成 CSR
+        order = np.argsort(term_arr, kind="stable")
+        indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_arr, minlength=len(vocab)), out=indptr[1:])
+
+        os.makedirs(path, exist_ok=True)
+        offsets = []
+        with open(os.path.join(path, "docs.jsonl"), "wb") as f:
+            for doc in docs:
+                offsets.append(f.tell())
+                line = json.dumps({"page_content": doc["page_content"], "metadata": doc["metadata"]}, ensure_ascii=False)
+                f.write(line.encode("utf-8") + b"\n")
+
+        segment = cls(
+            name,
+            path,
+            indptr=indptr,
+            postings_doc=np.asarray(doc_idx, dtype=np.int32)[order],
+            postings_tf=np.asarray(tfs, dtype=np.float32)[order],
+            doc_len=np.asarray([len(doc["tokens"]) for doc in docs], dtype=np.int32),
+            doc_ids=[doc["id"] for doc in docs],
+            doc_hashes=[doc["hash"] for doc in docs],
+            doc_offsets=np.asarray(offsets, dtype=np.int64),
+        )
+        segment.save()
+        return segment
+
+    @classmethod
+    def merge(cls, name: str, path: str, segments: List["BM25Segment"], deleted_snapshots: List[np.ndarray]) -> Tuple["BM25Segment", List[np.ndarray]]:
+        """
+        將多個分段合併為一個，並實際移除已標記刪除的文件 (直接操作 postings，不需重新斷詞)。
+        :param deleted_snapshots: 各分段在合併開始時的 deleted 遮罩
+        :return: (新分段, 各舊分段 local index -> 新 local index 的對照表，已刪除者為 -1)
+        """
+        n_terms = max(seg.n_terms for seg in segments)
+        remaps, terms, docs, tfs, doc_len = [], [], [], [], []
+        doc_ids: List[str] = []
+        doc_hashes: List[str] = []
+        offsets: List[int] = []
+        base = 0
+
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, "docs.jsonl"), "wb") as out:
+            for seg, deleted in zip(segments, deleted_snapshots):
+                live = ~deleted
+                remap = np.full(seg.n_docs, -1, dtype=np.int64)
+                remap[live] = base + np.arange(int(live.sum()))
+                remaps.append(remap)
+
+                keep = live[seg.postings_doc]
+                terms.append(seg.posting_terms[keep])
+                docs.append(remap[seg.postings_doc[keep]])
+                tfs.append(np.asarray(seg.postings_tf)[keep])
+                doc_len.append(np.asarray(seg.doc_len)[live])
+
+                with open(os.path.join(seg.path, "docs.jsonl"), "rb") as f:
+                    for local in np.flatnonzero(live):
+                        f.seek(int(seg.doc_offsets[local]))
+                        offsets.append(out.tell())
+                        out.write(f.readline())
+                        doc_ids.append(seg.doc_ids[local])
+                        doc_hashes.append(seg.doc_hashes[local])
+                base += int(live.sum())
+
+        term_arr = np.concatenate(terms)
+        doc_arr = np.concatenate(docs)
+        order = np.lexsort((doc_arr, term_arr))
+        indptr = np.zeros(n_terms + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_arr, minlength=n_terms), out=indptr[1:])
+
+        merged = cls(
+            name,
+            path,
+            indptr=indptr,
+            postings_doc=doc_arr[order].astype(np.int32),
+            postings_tf=np.concatenate(tfs)[order].astype(np.float32),
+            doc_len=np.concatenate(doc_len).astype(np.int32),
+            doc_ids=doc_ids,
+            doc_hashes=doc_hashes,
+            doc_offsets=np.asarray(offsets, dtype=np.int64),
+        )
+        merged.save()
+        return merged, remaps
+
+    def term_doc_counts(self, local_indices: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        計算每個 term 出現在幾篇文件中 (df 的貢獻)。
+        :param local_indices: 只計算這些文件；None 表示所有未刪除的文件
+        """
+        if local_indices is None:
+            mask = ~self.deleted[self.postings_doc]
+        else:
+            mask = np.isin(self.postings_doc, local_indices)
+        return np.bincount(self.posting_terms[mask], minlength=self.n_terms)
+
+    def score(self, query_terms: Dict[int, int], idf: np.ndarray, avgdl: float, k1: float, b: float) -> np.ndarray:
+        """
+        計算此分段內所有文件的 BM25 分數 (已刪除文件為 0)。
+        :param query_terms: term id -> 查詢中出現次數
+        """
+        scores = np.zeros(self.n_docs, dtype=np.float32)
+        if avgdl <= 0:
+            return scores
+        doc_norm = None
+        for term_id, qtf in query_terms.items():
+            if term_id >= self.n_terms:
+                continue
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            if start == end:
+                continue
+            if doc_norm is None:
+                doc_norm = k1 * (1 - b + b * np.asarray(self.doc_len, dtype=np.float32) / avgdl)
+            docs = self.postings_doc[start:end]
+            tf = self.postings_tf[start:end]
+            # 同一 term 的 postings 中 doc 不重複，可直接以 fancy index 累加
+            scores[docs] += qtf * idf[term_id] * tf * (k1 + 1) / (tf + doc_norm[docs])
+        scores[self.deleted] = 0.0
+        return scores
+
+    def read_docs(self, local_indices: List[int]) -> List[Dict[str, Any]]:
+        """依 offset 從 docs.jsonl 讀取指定文件"""
+        docs = []
+        with open(os.path.join(self.path, "docs.jsonl"), "rb") as f:
+            for idx in local_indices:
+                f.seek(int(self.doc_offsets[idx]))
+                docs.append(json.loads(f.readline()))
+        return docs
+
+    def mark_deleted(self, local_indices: np.ndarray) -> None:
+        self.deleted[local_indices] = True
+        _atomic_save_npy(os.path.join(self.path, "deleted.npy"), self.deleted)
+
+    def save(self) -> None:
+        for name in self.ARRAY_NAMES:
+            np.save(os.path.join(self.path, f"{name}.npy"), np.asarray(getattr(self, name)))
+        np.save(os.path.join(self.path, "doc_offsets.npy"), self.doc_offsets)
+        _atomic_save_npy(os.path.join(self.path, "deleted.npy"), self.deleted)
+        _atomic_write_json(os.path.join(self.path, "ids.json"), {"ids": self.doc_ids, "hashes": self.doc_hashes})
+
+    @classmethod
+    def load(cls, name: str, path: str) -> "BM25Segment":
+        """從目錄載入分段，postings 陣列以唯讀 memory map 方式開啟"""
+        arrays = {n: np.load(os.path.join(path, f"{n}.npy"), mmap_mode="r") for n in cls.ARRAY_NAMES}
+        with open(os.path.join(path, "ids.json"), "r", encoding="utf-8") as f:
+            ids = json.load(f)
+        return cls(
+            name,
+            path,
+            doc_ids=ids["ids"],
+            doc_hashes=ids["hashes"],
+            doc_offsets=np.load(os.path.join(path, "doc_offsets.npy"), mmap_mode="r"),
+            # deleted 遮罩需可寫入，完整載入記憶體
+            deleted=np.load(os.path.join(path, "deleted.npy")),
+            **arrays
+        )
+
+class BM25Index:
+    """
+    由多個分段組成、支援增量更新的 Okapi BM25 索引。
+    - 全域 vocab (term -> term id) 只增不減
+    - 語料統計量 (df、文件數、總長度) 隨新增 / 刪除增量維護，查詢時即時計算 IDF 與 avgdl
+    - 每次新增產生一個小的 delta 分段，分段過多時於背景合併
+    目錄結構：manifest.json、vocab.json、df.npy 與各分段子目錄 seg_xxxxxx/
+    """
+
+    def __init__(self, path: str, k1: float = 1.5, b: float = 0.75, max_segments: int = 8, meta: Optional[Dict[str, Any]] = None):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.max_segments = max_segments
+        self.meta: Dict[str, Any] = meta or {}
+        self.vocab: Dict[str, int] = {}
+        self.df = np.zeros(0, dtype=np.int64)
+        self.n_docs = 0
+        self.total_len = 0
+        self.segments: List[BM25Segment] = []
+        # doc id -> (分段名稱, 分段內 index)
+        self.id_map: Dict[str, Tuple[str, int]] = {}
+        self._next_segment = 0
+        self._retired: List[str] = []
+        # 建立中的合併分段名稱 (於 seg_xxxxxx.tmp 建立，完成後才改名)，清理時不可刪除
+        self._building: Set[str] = set()
+        self._lock = threading.RLock()
+        self._merge_thread: Optional[threading.Thread] = None
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.path, "manifest.json")
+
+    @property
+    def avgdl(self) -> float:
+        return self.total_len / self.n_docs if self.n_docs else 0.0
+
+    @staticmethod
+    def compute_idf(df: np.ndarray, n_docs: int) -> np.ndarray:
+        """BM25 IDF (Lucene 版本，恆為正值)"""
+        df = np.asarray(df, dtype=np.float64)
+        return np.log1p((n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+
+    def _new_segment_name(self) -> str:
+        self._next_segment += 1
+        return f"seg_{self._next_segment:06d}"
+
+    def _segment(self, name: str) -> BM25Segment:
+        return next(seg for seg in self.segments if seg.name == name)
+
+    def get_hash(self, doc_id: str) -> Optional[str]:
+        """取得已索引文件的內容雜湊，不存在則回傳 None"""
+        location = self.id_map.get(doc_id)
+        if location is None:
+            return None
+        seg_name, local = location
+        return self._segment(seg_name).doc_hashes[local]
+
+    def add(self, docs: List[Dict[str, Any]]) -> int:
+        """
+        新增或更新文件 (以 'id' 為鍵)。內容雜湊未變的文件直接略過。
+        :param docs: 每筆包含 'id', 'hash', 'tokens', 'page_content', 'metadata'
+        :return: 實際寫入的文件數
+        """
+        with self._lock:
+            # 同一批次內相同 id 只保留最後一筆
+            latest = {doc["id"]: doc for doc in docs}
+            changed = [doc for doc in latest.values() if self.get_hash(doc["id"]) != doc["hash"]]
+            if not changed:
+                return 0
+
+            self._delete_locked([doc["id"] for doc in changed if doc["id"] in self.id_map])
+
+            name = self._new_segment_name()
+            segment = BM25Segment.build(name, os.path.join(self.path, name), changed, self.vocab)
+
+            # 增量更新語料統計量
+            if len(self.df) < len(self.vocab):
+                self.df = np.concatenate([self.df, np.zeros(len(self.vocab) - len(self.df), dtype=np.int64)])
+            self.df[:segment.n_terms] += segment.term_doc_counts()
+            self.n_docs += segment.n_docs
+            self.total_len += int(np.asarray(segment.doc_len).sum())
+
+            for local, doc_id in enumerate(segment.doc_ids):
+                self.id_map[doc_id] = (name, local)
+            self.segments = self.segments + [segment]
+            self.save_state()
+            return len(changed)
+
+    def delete(self, doc_ids: List[str]) -> int:
+        """
+        刪除文件 (tombstone)，並同步扣除語料統計量。
+        :return: 實際刪除的文件數
+        """
+        with self._lock:
+            removed = self._delete_locked(doc_ids)
+            if removed:
+                self.save_state()
+            return removed
+
+    def _delete_locked(self, doc_ids: List[str]) -> int:
+        by_segment: Dict[str, List[int]] = {}
+        for doc_id in doc_ids:
+            location = self.id_map.pop(doc_id, None)
+            if location is not None:
+                by_segment.setdefault(location[0], []).append(location[1])
+
+        removed = 0
+        for seg_name, locals_ in by_segment.items():
+            segment = self._segment(seg_name)
+            idx = np.asarray(locals_, dtype=np.int64)
+            self.df[:segment.n_terms] -= segment.term_doc_counts(idx)
+            self.n_docs -= len(idx)
+            self.total_len -= int(np.asarray(segment.doc_len)[idx].sum())
+            segment.mark_deleted(idx)
+            removed += len(idx)
+        return removed
+
+    def search(self, query_tokens: List[str], k: int = 4) -> List[Tuple[BM25Segment, int, float]]:
+        """
+        跨分段計算 BM25 分數並以 argpartition 取前 k 名。
+        :return: (分段, 分段內 index, 分數) 列表，依分數由高至低排序
+        """
+        segments = self.segments
+        query_terms: Dict[int, int] = {}
+        for term, qtf in Counter(query_tokens).items():
+            term_id = self.vocab.get(term)
+            if term_id is not None:
+                query_terms[term_id] = qtf
+        if not query_terms or self.n_docs == 0:
+            return []
+
+        term_ids = np.fromiter(query_terms, dtype=np.int64)
+        idf = np.zeros(len(self.df), dtype=np.float32)
+        idf[term_ids] = self.compute_idf(self.df[term_ids], self.n_docs)
+        avgdl = self.avgdl
+
+        hits: List[Tuple[BM25Segment, int, float]] = []
+        for segment in segments:
+            scores = segment.score(query_terms, idf, avgdl, self.k1, self.b)
+            candidates = np.flatnonzero(scores)
+            if candidates.size > k:
+                candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+            hits.extend((segment, int(i), float(scores[i])) for i in candidates)
+
+        hits.sort(key=lambda hit: hit[2], reverse=True)
+        return hits[:k]
+
+    def plan_merge(self) -> List[BM25Segment]:
+        """
+        分段數超過上限時，合併除了最大分段以外的所有小分段；
+        否則只挑出刪除比例過半的分段進行壓實 (compaction)。
+        """
+        segments = self.segments
+        if len(segments) > self.max_segments:
+            largest = max(segments, key=lambda seg: seg.n_live)
+            return [seg for seg in segments if seg is not largest]
+        return [seg for seg in segments if seg.n_docs and seg.n_live * 2 < seg.n_docs]
+
+    def merge(self, segments: Optional[List[BM25Segment]] = None) -> None:
+        """
+        合併分段。新分段在鎖外建立，只有最後的置換步驟持有鎖，
+        因此合併期間仍可正常查詢與更新。
+        新分段先建立在 seg_xxxxxx.tmp，置換時才改名，建立中的目錄不會被視為孤兒分段清除。
+        """
+        with self._lock:
+            segments = segments if segments is not None else self.plan_merge()
+            if not segments:
+                return
+            self._remove_retired()
+            name = self._new_segment_name()
+            self._building.add(name)
+            snapshots = [seg.deleted.copy() for seg in segments]
+
+        try:
+            merged, remaps = BM25Segment.merge(name, os.path.join(self.path, f"{name}.tmp"), segments, snapshots)
+        except BaseException:
+            with self._lock:
+                self._building.discard(name)
+            raise
+
+        with self._lock:
+            self._building.discard(name)
+            final_path = os.path.join(self.path, name)
+            os.replace(merged.path, final_path)
+            merged.path = final_path
+
+            # 合併期間新增的刪除需同步至新分段
+            newly_deleted = []
+            for seg, snapshot, remap in zip(segments, snapshots, remaps):
+                newly_deleted.extend(remap[seg.deleted & ~snapshot].tolist())
+            if newly_deleted:
+                merged.mark_deleted(np.asarray(newly_deleted, dtype=np.int64))
+
+            merged_names = {seg.name for seg in segments}
+            for local, doc_id in enumerate(merged.doc_ids):
+                location = self.id_map.get(doc_id)
+                if location is not None and location[0] in merged_names and not merged.deleted[local]:
+                    self.id_map[doc_id] = (name, local)
+
+            self.segments = [seg for seg in self.segments if seg.name not in merged_names] + [merged]
+            self.save_state()
+            # 舊分段延後到下次合併才刪除，避免進行中的查詢讀到被移除的檔案
+            self._retired.extend(os.path.join(self.path, seg_name) for seg_name in merged_names)
+            print(f"[BM25Index] Merged {len(segments)} segments into {name} ({merged.n_live} docs)")
+
+    def merge_in_background(self) -> None:
+        """若需要合併且目前沒有合併在進行，啟動背景執行緒合併小分段"""
+        with self._lock:
+            if self._merge_thread is not None and self._merge_thread.is_alive():
+                return
+            if not self.plan_merge():
+                return
+            self._merge_thread = threading.Thread(target=self.merge, name="bm25-merge", daemon=True)
+            self._merge_thread.start()
+
+    def wait_for_merge(self, timeout: Optional[float] = None) -> None:
+        thread = self._merge_thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def flush(self) -> None:
+        """
+        等待背景合併完成，仍超過分段上限時同步再合併一次，最後刪除已退役的分段與孤兒分段目錄。
+        背景合併執行緒為 daemon，寫入端 (例如 ingestion) 需在程序結束前呼叫，否則合併不會完成。
+        只有寫入端可以呼叫：讀取端 (API) 的載入不刪除任何檔案。
+        """
+        self.wait_for_merge()
+        if self.plan_merge():
+            self.merge()
+        with self._lock:
+            self._remove_retired()
+            self._remove_orphans()
+
+    def _remove_retired(self) -> None:
+        for path in self._retired:
+            shutil.rmtree(path, ignore_errors=True)
+        self._retired = []
+
+    def save_state(self) -> None:
+        """寫入 vocab、df 與 manifest (manifest 最後寫入，作為索引版本的依據)"""
+        os.makedirs(self.path, exist_ok=True)
+        _atomic_write_json(os.path.join(self.path, "vocab.json"), self.vocab)
+        _atomic_save_npy(os.path.join(self.path, "df.npy"), self.df)
+        _atomic_write_json(self.manifest_path, {
+            "segments": [seg.name for seg in self.segments],
+            "next_segment": self._next_segment,
+            "k1": self.k1,
+            "b": self.b,
+            "n_docs": self.n_docs,
+            "total_len": self.total_len,
+            "meta": self.meta,
+        })
+
+    @classmethod
+    def load(cls, path: str, max_segments: int = 8) -> Optional["BM25Index"]:
+        """從目錄載入索引，若不存在則回傳 None"""
+        manifest_path = os.path.join(path, "manifest.json")
+        if not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+
+        index = cls(path, k1=manifest["k1"], b=manifest["b"], max_segments=max_segments, meta=manifest.get("meta"))
+        with open(os.path.join(path, "vocab.json"), "r", encoding="utf-8") as f:
+            index.vocab = json.load(f)
+        index.df = np.load(os.path.join(path, "df.npy"))
+        index.n_docs = manifest["n_docs"]
+        index.total_len = manifest["total_len"]
+        index._next_segment = manifest["next_segment"]
+        index.segments = [BM25Segment.load(name, os.path.join(path, name)) for name in manifest["segments"]]
+        for segment in index.segments:
+            for local in np.flatnonzero(~segment.deleted):
+                index.id_map[segment.doc_ids[local]] = (segment.name, int(local))
+        return index
+
+    def _remove_orphans(self) -> None:
+        """
+        刪除 manifest 未列出的分段目錄：先前程序合併後未及刪除的舊分段，以及中斷的合併留下的 .tmp 目錄。
+        建立中的合併分段 (_building) 予以保留。需持有鎖。
+        """
+        live = {seg.name for seg in self.segments}
+        for entry in os.listdir(self.path):
+            name = entry[:-len(".tmp")] if entry.endswith(".tmp") else entry
+            if not name.startswith("seg_") or entry in live or name in self._building:
+                continue
+            shutil.rmtree(os.path.join(self.path, entry), ignore_errors=True)
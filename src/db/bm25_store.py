@@ -1,84 +1,226 @@
 import os
-import pickle
+import shutil
 from typing import List, Dict, Any, Optional
-from langchain_core.documents import Document
-from langchain_community.retrievers import BM25Retriever
 
-from src.db.base import BaseRetriever
+import numpy as np
+
+from src.db.base import BaseRetriever, document_id, content_hash
+from src.db.bm25_index import BM25Index
+from src.db.analyzer import BaseAnalyzer, CJKAnalyzer, DEFAULT_STOPWORDS
 
 class BM25Store(BaseRetriever):
     """
     BM25 關鍵字檢索實作，繼承統一的 BaseRetriever 介面。
-    使用 pickle 將 LangChain 的 BM25Retriever 暫存於本地端。
+    底層為分段式 (segment) 的 NumPy BM25 索引，支援以穩定的文件 ID (見 base.document_id) 增量新增、更新與刪除：
+    每次寫入只建立一個小的 delta 分段，分段過多時於背景合併，語料統計量 (df / avgdl) 亦增量維護。
+    斷詞器可抽換，預設為 CJK 字元 bigram 的 CJKAnalyzer；
+    既有索引的斷詞設定與目前不同時，下一次寫入前會以新斷詞器完整重建索引 (見 rebuild)。
     """
-    def __init__(self, index_path: str = "data/processed/bm25_index.pkl"):
+    def __init__(self, index_path: str = "data/processed/bm25_index", analyzer: Optional[BaseAnalyzer] = None, max_segments: int = 8):
         self.index_path = index_path
-        self.retriever: Optional[BM25Retriever] = None
+        self.analyzer = analyzer or CJKAnalyzer(stopwords=DEFAULT_STOPWORDS)
+        self.max_segments = max_segments
+        self.index: Optional[BM25Index] = None
+        self._loaded_mtime: Optional[int] = None
+        # 此實例是否寫入過索引 (只有寫入端需要在關閉時完成合併)
+        self._written = False
         self._load_index()
 
+    @property
+    def _manifest_path(self) -> str:
+        return os.path.join(self.index_path, "manifest.json")
+
     def _load_index(self):
         """嘗試從硬碟載入已建立的 BM25 索引"""
-        if os.path.exists(self.index_path):
+        if os.path.exists(self._manifest_path):
             try:
-                with open(self.index_path, "rb") as f:
-                    self.retriever = pickle.load(f)
+                self.index = BM25Index.load(self.index_path, max_segments=self.max_segments)
+                self._loaded_mtime = self._current_mtime()
                 print(f"[BM25Store] Loaded index from {self.index_path}")
+                if self.needs_rebuild:
+                    print(f"[BM25Store] Warning: index was built with analyzer {self.index.meta.get('analyzer')}, "
+                          f"but this store uses {self.analyzer.config}. The index will be rebuilt before the next write.")
             except Exception as e:
                 print(f"[BM25Store] Failed to load index: {e}")
-                self.retriever = None
+                self.index = None
+
+    def _current_mtime(self) -> Optional[int]:
+        try:
+            return os.stat(self._manifest_path).st_mtime_ns
+        except OSError:
+            return None
+
+    @property
+    def needs_rebuild(self) -> bool:
+        """既有索引的斷詞設定與目前的斷詞器不同"""
+        return self.index is not None and self.index.meta.get("analyzer") != self.analyzer.config
+
+    def rebuild(self, batch_size: int = 1000) -> int:
+        """
+        以目前的斷詞器重新斷詞索引中所有未刪除的文件 (內容取自各分段的 docs.jsonl)，寫成全新的索引。
+        新索引先建立在暫存目錄，完成後才置換原目錄，重建期間讀取端仍使用舊索引；
+        文件依 batch_size 分批讀取，記憶體用量不隨語料大小成長。
+        :return: 重建的文件數
+        """
+        if self.index is None:
+            return 0
+        old = self.index
+        old.wait_for_merge()
 
-    def add_documents(self, documents: List[Dict[str, Any]]) -> None:
+        tmp_path = f"{self.index_path}.rebuild"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        fresh = BM25Index(tmp_path, k1=old.k1, b=old.b, max_segments=self.max_segments,
+                          meta={**old.meta, "analyzer": self.analyzer.config})
+        # 分段編號接續舊索引，讀取端仍持有的舊分段不會與新分段同名
+        fresh._next_segment = old._next_segment
+        total = 0
+        for segment in old.segments:
+            live = np.flatnonzero(~segment.deleted)
+            for start in range(0, len(live), batch_size):
+                locals_ = live[start:start + batch_size].tolist()
+                entries = [
+                    {
+                        "id": segment.doc_ids[local],
+                        "hash": segment.doc_hashes[local],
+                        "page_content": doc["page_content"],
+                        "metadata": doc["metadata"],
+                    }
+                    for local, doc in zip(locals_, segment.read_docs(locals_))
+                ]
+                for entry, tokens in zip(entries, self.analyzer.tokenize_batch(entry["page_content"] for entry in entries)):
+                    entry["tokens"] = tokens
+                total += fresh.add(entries)
+                fresh.merge_in_background()
+        fresh.flush()
+        fresh.save_state()
+
+        # 置換目錄：舊索引先移開再刪除
+        retired_path = f"{self.index_path}.old"
+        shutil.rmtree(retired_path, ignore_errors=True)
+        os.replace(self.index_path, retired_path)
+        os.replace(tmp_path, self.index_path)
+        shutil.rmtree(retired_path, ignore_errors=True)
+
+        self.index = BM25Index.load(self.index_path, max_segments=self.max_segments)
+        self._after_write()
+        print(f"[BM25Store] Rebuilt {total} documents with analyzer {self.analyzer.config}")
+        return total
+
+    def health_check(self) -> bool:
+        """
+        若硬碟上的索引在載入後被其他程序更新 (例如重新執行 ingestion)，
+        視為過期，交由 RetrieverRegistry 重新載入。
+        (similarity_search 每次查詢前也會比對 manifest，不必等到下一次健康檢查)
         """
-        將文件加入 BM25 索引並序列化儲存。
+        return self._current_mtime() == self._loaded_mtime
+
+    def add_documents(self, documents: List[Dict[str, Any]]) -> int:
+        """
+        增量新增文件；相同 ID 的既有文件會被更新，內容未變者直接略過。
         :param documents: 包含 'page_content' 與 'metadata' 的字典列表
+        :return: 實際寫入 (新增或更新) 的文件數
         """
         if not documents:
-            return
+            return 0
 
-        # 轉換回 LangChain Document 格式供 BM25Retriever 使用
-        lc_docs = [
-            Document(page_content=doc.get("page_content", ""), metadata=doc.get("metadata", {}))
-            for doc in documents
-        ]
+        # 斷詞設定變更：內容雜湊未變的 chunk 也必須重新斷詞，先完整重建索引
+        if self.needs_rebuild:
+            self.rebuild()
 
-        # 重新建立整個索引 (BM25 通常是靜態建立，若需增量需特別處理，此處採重建)
-        self.retriever = BM25Retriever.from_documents(lc_docs)
+        if self.index is None:
+            self.index = BM25Index(self.index_path, max_segments=self.max_segments, meta={"analyzer": self.analyzer.config})
 
-        # 確保目錄存在
-        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
-        
-        # 存檔
-        with open(self.index_path, "wb") as f:
-            pickle.dump(self.retriever, f)
-        print(f"[BM25Store] Saved index with {len(lc_docs)} documents to {self.index_path}")
+        entries = []
+        for doc in documents:
+            content = doc.get("page_content", "")
+            doc_id = document_id(doc)
+            doc_hash = content_hash(content)
+            # 內容未變的 chunk 不需重新斷詞
+            if self.index.get_hash(doc_id) == doc_hash:
+                continue
+            entries.append({
+                "id": doc_id,
+                "hash": doc_hash,
+                "page_content": content,
+                "metadata": doc.get("metadata", {}),
+            })
+
+        for entry, tokens in zip(entries, self.analyzer.tokenize_batch(entry["page_content"] for entry in entries)):
+            entry["tokens"] = tokens
+
+        written = self.index.add(entries) if entries else 0
+        self._after_write()
+        print(f"[BM25Store] Indexed {written} new/updated documents ({len(documents) - written} unchanged) in {self.index_path}")
+        return written
+
+    def update_documents(self, documents: List[Dict[str, Any]]) -> int:
+        """更新文件 (等同以相同 ID 重新寫入)"""
+        return self.add_documents(documents)
+
+    def delete_documents(self, ids: List[str]) -> int:
+        """
+        依文件 ID 刪除文件。
+        :return: 實際刪除的文件數
+        """
+        if self.index is None or not ids:
+            return 0
+        removed = self.index.delete(ids)
+        self._after_write()
+        return removed
+
+    def _after_write(self) -> None:
+        # 自身的寫入不應讓 health_check 誤判為過期
+        self._loaded_mtime = self._current_mtime()
+        self._written = True
+        self.index.merge_in_background()
+
+    def flush(self) -> None:
+        """等待分段合併完成並刪除退役與孤兒分段目錄 (只由寫入端在結束前呼叫，例如 ingestion 最後)"""
+        if self.index is None or not self._written:
+            return
+        self.index.flush()
+        self._loaded_mtime = self._current_mtime()
+
+    def close(self) -> None:
+        self.flush()
 
     def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Dict[str, Any]]:
         """
         BM25 關鍵字搜尋。
         :param query: 檢索關鍵字
         :param k: 返回數量限制
-        :return: 格式化的結果列表
+        :return: 格式化的結果列表，'score' 為真實的 BM25 分數
         """
-        if not self.retriever:
+        # 其他程序 (ingestion 的合併 / 重建) 更新了索引：先重新載入，避免讀到已被刪除或置換的分段
+        if not self._written and self._current_mtime() != self._loaded_mtime:
+            self._load_index()
+        if self.index is None:
             print("[BM25Store] Index not initialized. Return empty.")
             return []
 
-        # 設定單次檢索數量
-        self.retriever.k = k
         try:
-            lc_docs = self.retriever.invoke(query)
+            return self._search(query, k)
+        except OSError as e:
+            # 檢查 manifest 與讀取分段之間，分段檔案被其他程序移除：重新載入後重試一次
+            print(f"[BM25Store] Segment read failed ({e}), reloading index")
+            self._load_index()
+        except Exception as e:
+            print(f"[BM25Store] Search error: {e}")
+            return []
+
+        try:
+            return self._search(query, k) if self.index is not None else []
         except Exception as e:
             print(f"[BM25Store] Search error: {e}")
             return []
 
+    def _search(self, query: str, k: int) -> List[Dict[str, Any]]:
         results = []
-        # LangChain 的 BM25Retriever 回傳的結果預設沒有明確曝露內部 score 屬性
-        # 若需要精確分數量化，需要深入底層或直接回傳順序當作參考。此處先給予預設值。
-        for i, doc in enumerate(lc_docs):
+        for segment, local, score in self.index.search(self.analyzer.tokenize(query), k=k):
+            doc = segment.read_docs([local])[0]
             results.append({
-                "page_content": doc.page_content,
-                "metadata": doc.metadata,
-                "score": 1.0 / (i + 1) # 暫以倒數排名當作偽分數
+                "page_content": doc["page_content"],
+                "metadata": doc["metadata"],
+                "score": score
             })
-            
         return results
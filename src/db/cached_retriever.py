@@ -0,0 +1,102 @@
+import copy
+import json
+from typing import Any, Callable, Dict, List, Optional
+
+from src.db.base import BaseRetriever
+from src.db.cache import LRUCache
+from src.db.corpus_version import bump_corpus_version, get_corpus_version
+from src.db.embeddings import normalize_query
+
+def _result_bytes(results: List[Dict[str, Any]]) -> int:
+    """估算一組檢索結果佔用的位元組數"""
+    return sum(
+        len(r.get("page_content", "").encode("utf-8")) + len(json.dumps(r.get("metadata", {}), default=str, ensure_ascii=False))
+        for r in results
+    )
+
+class CachedRetriever(BaseRetriever):
+    """
+    為任意 BaseRetriever 加上檢索結果快取。
+    以 (引擎名稱, 正規化查詢, k, 過濾條件) 為鍵，受筆數與位元組數限制；
+    語料版本 (corpus_version) 變動時整個清空，而經由此包裝寫入文件時會更新語料版本。
+    回傳的結果為複本，呼叫端可自由修改 metadata。
+    """
+
+    # 會改變語料的方法，經由 __getattr__ 轉呼叫後需更新語料版本
+    _WRITE_METHODS = frozenset(["update_documents", "add_documents_stream"])
+
+    def __init__(
+        self,
+        name: str,
+        retriever: BaseRetriever,
+        max_entries: int = 1024,
+        max_bytes: Optional[int] = 64 * 1024 * 1024,
+        ttl: Optional[float] = None,
+        version_fn: Callable[[], str] = get_corpus_version,
+    ):
+        """
+        :param name: 引擎名稱 (快取鍵的一部分)
+        :param retriever: 實際的檢索器
+        :param max_entries: 最多快取的查詢數
+        :param max_bytes: 快取結果的總大小上限
+        :param ttl: 快取存活秒數，None 表示只依語料版本失效
+        :param version_fn: 取得目前語料版本的函式
+        """
+        self.name = name
+        self.retriever = retriever
+        self.version_fn = version_fn
+        self.cache = LRUCache(max_entries=max_entries, max_bytes=max_bytes, ttl=ttl, sizeof=_result_bytes)
+        self._version = version_fn()
+
+    def __getattr__(self, attr: str) -> Any:
+        # 只有在自身找不到屬性時才會被呼叫，其餘方法 (例如 update_documents) 轉交底層檢索器
+        if attr == "retriever":
+            raise AttributeError(attr)
+        value = getattr(self.retriever, attr)
+        if attr in self._WRITE_METHODS and callable(value):
+            def write(*args, **kwargs):
+                result = value(*args, **kwargs)
+                self._invalidate()
+                return result
+            return write
+        return value
+
+    def _invalidate(self) -> None:
+        self._version = bump_corpus_version()
+        self.cache.clear()
+
+    def add_documents(self, documents: List[Dict[str, Any]]) -> Optional[int]:
+        written = self.retriever.add_documents(documents)
+        self._invalidate()
+        return written
+
+    def delete_documents(self, ids: List[str]) -> int:
+        removed = self.retriever.delete_documents(ids)
+        self._invalidate()
+        return removed
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Dict[str, Any]]:
+        version = self.version_fn()
+        if version != self._version:
+            self.cache.clear()
+            self._version = version
+
+        key = (self.name, normalize_query(query), k, json.dumps(kwargs, sort_keys=True, default=str))
+        cached = self.cache.get(key)
+        if cached is not None:
+            return copy.deepcopy(cached)
+
+        results = self.retriever.similarity_search(query, k=k, **kwargs)
+        self.cache.set(key, copy.deepcopy(results))
+        return results
+
+    def health_check(self) -> bool:
+        return self.retriever.health_check()
+
+    def close(self) -> None:
+        self.retriever.close()
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        """快取命中率與佔用量"""
+        return self.cache.stats
@@ -0,0 +1,53 @@
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Optional, Tuple
+
+# 語料版本檔：每次 ingestion 寫入後更新，跨程序 (API / ingestion script) 共用
+CORPUS_VERSION_PATH = os.environ.get("CORPUS_VERSION_PATH", "data/processed/corpus_version.json")
+
+_lock = threading.Lock()
+# (路徑, mtime) -> 版本，避免每次查詢都讀檔
+_cached: Tuple[Optional[str], Optional[int], str] = (None, None, "0")
+
+def get_corpus_version(path: Optional[str] = None) -> str:
+    """
+    取得目前的語料版本。檔案不存在時回傳 "0"。
+    只在版本檔 mtime 變動時才重新讀取，可於每個請求呼叫。
+    """
+    global _cached
+    path = path or CORPUS_VERSION_PATH
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return "0"
+
+    cached_path, cached_mtime, version = _cached
+    if cached_path == path and cached_mtime == mtime:
+        return version
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            version = str(json.load(f)["version"])
+    except (OSError, ValueError, KeyError):
+        return "0"
+    with _lock:
+        _cached = (path, mtime, version)
+    return version
+
+def bump_corpus_version(path: Optional[str] = None) -> str:
+    """
+    語料變動後更新版本，讓依賴語料的快取 (答案快取 / 檢索結果快取) 失效。
+    :return: 新的版本字串
+    """
+    path = path or CORPUS_VERSION_PATH
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    version = uuid.uuid4().hex
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": version, "updated_at": time.time()}, f)
+    os.replace(tmp_path, path)
+    return version
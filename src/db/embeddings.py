@@ -0,0 +1,64 @@
+import re
+import unicodedata
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from src.db.batching import MicroBatcher
+from src.db.cache import LRUCache
+
+def normalize_query(text: str) -> str:
+    """查詢正規化：NFKC (全形轉半形)、去除頭尾空白並合併連續空白"""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip()
+
+class BatchedEmbeddings(Embeddings):
+    """
+    將並行請求的 embed_query 經由 MicroBatcher 合併成一次 embed_documents 前向運算。
+    僅適用於查詢與文件使用相同編碼設定的模型 (例如未設定 query instruction 的 BGE)。
+    """
+
+    def __init__(self, embeddings: Embeddings, max_batch: int = 32, max_wait_ms: float = 5.0):
+        self.embeddings = embeddings
+        self.batcher = MicroBatcher(embeddings.embed_documents, max_batch=max_batch, max_wait_ms=max_wait_ms, name="embedding-batcher")
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return list(self.batcher.submit(text).result())
+
+class CachedEmbeddings(Embeddings):
+    """
+    在既有 Embeddings 前加上查詢向量快取 (LRU + TTL)。
+    以 (模型名稱, 正規化後查詢) 為鍵，向量以 float32 陣列儲存，
+    重複的查詢與 Multi-hop 的多次檢索都不會再執行 encoder。
+    embed_documents 不快取，直接交給底層模型。
+    """
+
+    def __init__(self, embeddings: Embeddings, model_name: str, max_entries: int = 4096, ttl: Optional[float] = None):
+        """
+        :param embeddings: 實際計算向量的 Embeddings 實例
+        :param model_name: 模型名稱 (作為快取鍵的一部分，避免不同模型的向量混用)
+        :param max_entries: 最多快取的查詢數 (記憶體上限約為 max_entries x 維度 x 4 bytes)
+        :param ttl: 快取存活秒數，None 表示不過期
+        """
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.cache = LRUCache(max_entries=max_entries, ttl=ttl, sizeof=lambda vector: vector.nbytes)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = (self.model_name, normalize_query(text))
+        vector = self.cache.get(key)
+        if vector is None:
+            vector = np.asarray(self.embeddings.embed_query(text), dtype=np.float32)
+            self.cache.set(key, vector)
+        return vector.tolist()
+
+    @property
+    def stats(self) -> dict:
+        """快取命中 / 未命中次數"""
+        return self.cache.stats
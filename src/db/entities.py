@@ -0,0 +1,56 @@
+import os
+import re
+from typing import Iterable, List, Optional
+
+from src.db.gazetteer import Gazetteer
+
+_CJK = r"\u4e00-\u9fff"
+
+# 英文：大寫開頭的單字 (專有名詞)
+_LATIN_ENTITY = re.compile(r"\b[A-Z][a-zA-Z]+\b")
+# 法規名稱：以條例 / 細則 / 規則 / 辦法 / 法結尾，前面不接其他中文字 (句首、標點或引號之後)
+_REGULATION = re.compile(rf"(?<![{_CJK}])([{_CJK}]{{2,18}}(?:條例|細則|規則|辦法|法))(?=第|[^{_CJK}]|$)")
+# 條號：第31條、第31-1條、第三十一條
+_ARTICLE = re.compile(r"第\s*([0-9]+(?:-[0-9]+)?|[一二三四五六七八九十百零〇]+)\s*條")
+# 切分中文片段用的功能詞 (連接詞、介詞、助詞與常見的法條套語)
+_FUNCTION_WORDS = re.compile(rf"規定|或|及|與|和|並|之|的|於|以|者|時|未|依|為|在|將|對|由|其|而|被|則|若|且|處|等|[^{_CJK}]+")
+# 角色名詞：以「人」結尾的短片段，例如 駕駛人、機車駕駛人、附載座人
+_ROLE = re.compile(rf"^[{_CJK}]{{1,5}}人$")
+
+class EntityExtractor:
+    """
+    寫入圖譜時使用的規則式實體擷取 (不依賴斷詞模型)：
+    - 英文：大寫開頭的專有名詞
+    - 中文：法規名稱、條號、以「人」結尾的角色名詞
+    - 領域詞典 (每行一個詞) 中出現在文本裡的詞彙，以 Aho-Corasick 比對
+    未來的深度識別應由 Agent (Orchestration Layer) 處理後寫入 metadata，此處僅為底層保底邏輯。
+    """
+
+    def __init__(self, lexicon: Iterable[str] = ()):
+        self.lexicon = Gazetteer(lexicon)
+
+    @classmethod
+    def from_file(cls, path: Optional[str]) -> "EntityExtractor":
+        """由詞典檔建立，檔案不存在時只使用規則"""
+        terms: List[str] = []
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                terms = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+        return cls(terms)
+
+    def extract(self, text: str) -> List[str]:
+        """擷取文本中的實體名稱 (去重並維持首次出現順序)"""
+        entities = list(_LATIN_ENTITY.findall(text))
+
+        regulations = _REGULATION.findall(text)
+        entities.extend(regulations)
+        entities.extend(f"第{number}條" for number in _ARTICLE.findall(text))
+
+        # 移除已擷取的法規名稱與條號後，以功能詞切成短片段找角色名詞
+        remainder = _ARTICLE.sub(" ", text)
+        for regulation in regulations:
+            remainder = remainder.replace(regulation, " ")
+        entities.extend(piece for piece in _FUNCTION_WORDS.split(remainder) if _ROLE.match(piece))
+
+        entities.extend(self.lexicon.find(text))
+        return list(dict.fromkeys(entities))
@@ -0,0 +1,97 @@
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+def normalize_scores(scores: np.ndarray, method: str = "minmax") -> np.ndarray:
+    """
+    將單一引擎的原始分數正規化到可比較的尺度。
+    :param scores: 一維分數陣列，缺值以 NaN 表示
+    :param method: 'minmax' (縮放至 [0, 1]) 或 'zscore' (平均 0、標準差 1)
+    :return: 與輸入同形狀的陣列，缺值仍為 NaN
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    present = ~np.isnan(scores)
+    if not present.any():
+        return scores
+
+    values = scores[present]
+    if method == "minmax":
+        span = values.max() - values.min()
+        normalized = (values - values.min()) / span if span > 0 else np.ones_like(values)
+    elif method == "zscore":
+        std = values.std()
+        normalized = (values - values.mean()) / std if std > 0 else np.zeros_like(values)
+    else:
+        raise ValueError(f"Unknown normalization method: {method}")
+
+    result = np.full_like(scores, np.nan)
+    result[present] = normalized
+    return result
+
+def reciprocal_rank_fusion(
+    engine_results: Dict[str, List[Dict[str, Any]]],
+    weights: Optional[Dict[str, float]] = None,
+    k: int = 60,
+    normalization: Optional[str] = None,
+    top_n: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """
+    將多個檢索引擎的結果融合為單一排序 (以 page_content 去重)。
+    預設使用加權 RRF：score(d) = Σ_e w_e / (k + rank_e(d))，只依賴名次，不受各引擎分數尺度影響。
+    若指定 normalization ('minmax' / 'zscore')，則改以各引擎正規化後分數的加權和融合。
+    :param engine_results: 引擎名稱 -> 該引擎依分數排序的結果列表
+    :param weights: 引擎名稱 -> 權重，未指定者為 1.0
+    :param k: RRF 平滑常數
+    :param normalization: 分數正規化方式，None 表示使用 RRF
+    :param top_n: 只回傳融合後的前 N 筆
+    :return: 融合後的文件列表，metadata 內附 'fusion_score'、命中的 'engines' 與各引擎中最好的名次 'best_rank'
+    """
+    weights = weights or {}
+    engines = [name for name, results in engine_results.items() if results]
+    if not engines:
+        return []
+
+    # 建立候選文件索引 (保留第一個引擎回傳的版本)
+    candidates: List[Dict[str, Any]] = []
+    index_of: Dict[str, int] = {}
+    for name in engines:
+        for doc in engine_results[name]:
+            content = doc.get("page_content", "")
+            if content not in index_of:
+                index_of[content] = len(candidates)
+                candidates.append(doc)
+
+    # 名次矩陣與分數矩陣 (候選文件 x 引擎)，未命中以 inf / NaN 表示
+    ranks = np.full((len(candidates), len(engines)), np.inf)
+    raw_scores = np.full((len(candidates), len(engines)), np.nan)
+    hits: Dict[int, List[str]] = {}
+    for col, name in enumerate(engines):
+        for rank, doc in enumerate(engine_results[name], start=1):
+            row = index_of[doc.get("page_content", "")]
+            if np.isinf(ranks[row, col]):
+                ranks[row, col] = rank
+                raw_scores[row, col] = float(doc.get("score", 0.0) or 0.0)
+                hits.setdefault(row, []).append(name)
+
+    engine_weights = np.array([weights.get(name, 1.0) for name in engines], dtype=np.float64)
+
+    if normalization:
+        normalized = np.column_stack([normalize_scores(raw_scores[:, col], normalization) for col in range(len(engines))])
+        fused = np.nansum(normalized * engine_weights, axis=1)
+    else:
+        fused = (engine_weights / (k + ranks)).sum(axis=1)
+
+    # 穩定排序：分數相同時保留原本出現順序
+    order = np.argsort(-fused, kind="stable")
+    if top_n is not None:
+        order = order[:top_n]
+
+    fused_docs = []
+    for row in order:
+        doc = candidates[row].copy()
+        doc["metadata"] = dict(doc.get("metadata") or {})
+        doc["metadata"]["fusion_score"] = float(fused[row])
+        doc["metadata"]["engines"] = hits[row]
+        doc["metadata"]["best_rank"] = int(ranks[row].min())
+        fused_docs.append(doc)
+    return fused_docs
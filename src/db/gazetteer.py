@@ -0,0 +1,116 @@
+import threading
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Set
+
+class Gazetteer:
+    """
+    以 Aho-Corasick 自動機實作的實體字典比對器。
+    查詢時只需掃描一次字串即可找出所有出現的實體名稱 (與字典大小無關)，
+    中文名稱可出現在任意位置；英數名稱則要求前後為詞界，避免 'Agent' 命中 'Agents'。
+    比對不分大小寫，回傳字典中的原始名稱。
+    """
+
+    def __init__(self, names: Iterable[str] = ()):
+        # trie：每個狀態的轉移表、失敗連結、恰好在此結束的名稱，以及沿失敗連結合併後的輸出
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._terminal: List[Optional[str]] = [None]
+        self._output: List[List[str]] = [[]]
+        # 正規化名稱 -> 原始名稱集合 (大小寫不同的實體會被視為同一個 key)
+        self._canonical: Dict[str, Set[str]] = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+        self.add(names)
+
+    def __len__(self) -> int:
+        return sum(len(names) for names in self._canonical.values())
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._canonical.get(name.casefold(), set())
+
+    def add(self, names: Iterable[str]) -> int:
+        """
+        增量加入實體名稱 (已存在者略過)，失敗連結延後到下一次查詢時重建。
+        :return: 新加入的名稱數
+        """
+        added = 0
+        with self._lock:
+            for name in names:
+                if not name or not name.strip():
+                    continue
+                key = name.casefold()
+                canonical = self._canonical.setdefault(key, set())
+                if name in canonical:
+                    continue
+                if not canonical:
+                    self._insert(key)
+                canonical.add(name)
+                added += 1
+            if added:
+                self._dirty = True
+        return added
+
+    def _insert(self, key: str) -> None:
+        state = 0
+        for char in key:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._terminal.append(None)
+                self._output.append([])
+                self._goto[state][char] = next_state
+            state = next_state
+        self._terminal[state] = key
+
+    def _build_failure_links(self) -> None:
+        """以 BFS 重新計算所有狀態的失敗連結與輸出集合"""
+        queue = deque()
+        self._output[0] = []
+        for next_state in self._goto[0].values():
+            self._fail[next_state] = 0
+            self._output[next_state] = [self._terminal[next_state]] if self._terminal[next_state] else []
+            queue.append(next_state)
+
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                own = [self._terminal[next_state]] if self._terminal[next_state] else []
+                self._output[next_state] = own + self._output[self._fail[next_state]]
+        self._dirty = False
+
+    @staticmethod
+    def _is_word_char(char: str) -> bool:
+        return char.isascii() and char.isalnum()
+
+    def find(self, text: str) -> List[str]:
+        """
+        找出文字中出現的所有實體名稱 (依首次出現位置排序、不重複)。
+        """
+        with self._lock:
+            if self._dirty:
+                self._build_failure_links()
+
+            folded = text.casefold()
+            found: Dict[str, None] = {}
+            state = 0
+            for end, char in enumerate(folded):
+                while state and char not in self._goto[state]:
+                    state = self._fail[state]
+                state = self._goto[state].get(char, 0)
+                for key in self._output[state]:
+                    start = end - len(key) + 1
+                    # 英數開頭 / 結尾的名稱需落在詞界上
+                    if self._is_word_char(key[0]) and start > 0 and self._is_word_char(folded[start - 1]):
+                        continue
+                    if self._is_word_char(key[-1]) and end + 1 < len(folded) and self._is_word_char(folded[end + 1]):
+                        continue
+                    for name in sorted(self._canonical[key]):
+                        found.setdefault(name, None)
+            return list(found)
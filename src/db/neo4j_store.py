@@ -1,11 +1,12 @@
 import os
-import re
-import uuid
-from typing import List, Dict, Any, Optional
+import time
+from typing import List, Dict, Any, Optional, Tuple
 from dotenv import load_dotenv
 
 from neo4j import GraphDatabase
-from src.db.base import BaseRetriever
+from src.db.base import BaseRetriever, document_id, content_hash
+from src.db.entities import EntityExtractor
+from src.db.gazetteer import Gazetteer
 
 load_dotenv()
 
@@ -15,95 +16,279 @@ class Neo4jStore(BaseRetriever):
     主要職責為將文件與提取出的簡單實體寫入圖譜中，並提供基於 Cypher 的關鍵字相似度/關聯檢索。
     """
 
-    def __init__(self, uri: Optional[str] = None, user: Optional[str] = None, password: Optional[str] = None):
+    def __init__(self, uri: Optional[str] = None, user: Optional[str] = None, password: Optional[str] = None, batch_size: Optional[int] = None):
         """
-        初始化 Neo4j Driver 連線。
+        初始化 Neo4j Driver 連線，並確保唯一性約束存在。
         支援顯式傳入以利測試或手動覆寫。
+        :param batch_size: 匯入時每個 UNWIND 交易包含的文件數，預設讀取環境變數 NEO4J_INGEST_BATCH_SIZE
         """
         self.uri = uri or os.environ.get("NEO4J_URI", "bolt://localhost:7687")
         self.user = user or os.environ.get("NEO4J_USERNAME", "neo4j")
         self.password = password or os.environ.get("NEO4J_PASSWORD", "password")
+        self.batch_size = batch_size or int(os.environ.get("NEO4J_INGEST_BATCH_SIZE", "500"))
+
+        # Multi-hop 擴展設定：最大跳數、每跳保留的實體數上限、每跳的分數衰減
+        self.max_hops = int(os.environ.get("NEO4J_EXPANSION_HOPS", "1"))
+        self.fanout = int(os.environ.get("NEO4J_EXPANSION_FANOUT", "10"))
+        self.decay = float(os.environ.get("NEO4J_EXPANSION_DECAY", "0.5"))
+
+        # 寫入端的實體擷取：規則 (英文專有名詞 / 法規名稱 / 條號 / 角色名詞) + 領域詞典
+        self.entity_extractor = EntityExtractor.from_file(os.environ.get("ENTITY_LEXICON_PATH", "data/entity_lexicon.txt"))
+
+        # 查詢端的實體連結字典：由圖中的 Entity 節點建立，首次查詢時載入，之後增量更新
+        self.gazetteer = Gazetteer()
+        self.gazetteer_refresh_interval = float(os.environ.get("GAZETTEER_REFRESH_INTERVAL", "60"))
+        self._gazetteer_loaded = False
+        self._gazetteer_since = 0
+        self._gazetteer_refreshed_at = 0.0
 
         # 使用 driver 管理連線池
         self.driver = GraphDatabase.driver(self.uri, auth=(self.user, self.password))
+        self._ensure_schema()
+
+    def _ensure_schema(self) -> None:
+        """
+        建立 Document.id 與 Entity.name 的唯一性約束 (同時會建立對應索引)，
+        讓 MERGE / MATCH 以索引查找取代整個 Label 的掃描。
+        """
+        try:
+            with self.driver.session() as session:
+                session.run("CREATE CONSTRAINT document_id IF NOT EXISTS FOR (d:Document) REQUIRE d.id IS UNIQUE")
+                session.run("CREATE CONSTRAINT entity_name IF NOT EXISTS FOR (e:Entity) REQUIRE e.name IS UNIQUE")
+        except Exception as e:
+            print(f"[Neo4jStore] Failed to ensure constraints: {e}")
 
     def close(self):
         """關閉連線"""
         self.driver.close()
 
+    def health_check(self) -> bool:
+        """透過 driver 驗證與 Neo4j 的連線"""
+        self.driver.verify_connectivity()
+        return True
+
     def _extract_entities(self, text: str) -> List[str]:
         """
-        簡單的 Entity Extraction：擷取文本中連續的英文字母大寫詞彙或中文詞彙(這裡以簡單 Regex 處理大寫英文字)。
-        未來的深度識別應由 Agent (Orchestration Layer) 處理後寫入 metadata，此處僅為底層保底邏輯。
+        Entity Extraction：英文大寫專有名詞，以及中文的法規名稱、條號、角色名詞與領域詞典詞彙 (見 EntityExtractor)。
+        """
+        return self.entity_extractor.extract(text)
+
+    @staticmethod
+    def _existing_hashes(tx, ids: List[str]) -> Dict[str, Optional[str]]:
+        """交易函式：查出已存在的 Document ID 與其內容雜湊"""
+        query = """
+        UNWIND $ids AS id
+        MATCH (d:Document {id: id})
+        RETURN d.id AS id, d.content_hash AS content_hash
+        """
+        return {record["id"]: record["content_hash"] for record in tx.run(query, ids=ids)}
+
+    @staticmethod
+    def _write_rows(tx, rows: List[Dict[str, Any]]) -> None:
+        """
+        交易函式：以單一 UNWIND 查詢寫入一整批文件與其實體關聯。
+        內容已變動的既有文件會先移除舊的 :MENTIONS 關聯，再依新內容重建。
+        :param rows: 每筆包含 'id', 'content', 'hash', 'source', 'entities'
+        """
+        query = """
+        UNWIND $rows AS row
+        MERGE (d:Document {id: row.id})
+        SET d.content = row.content, d.source = row.source, d.content_hash = row.hash
+        WITH d, row
+        OPTIONAL MATCH (d)-[old:MENTIONS]->()
+        DELETE old
+        WITH DISTINCT d, row
+        UNWIND row.entities AS entity_name
+        MERGE (e:Entity {name: entity_name})
+        ON CREATE SET e.created_at = timestamp()
+        MERGE (d)-[:MENTIONS]->(e)
+        """
+        tx.run(query, rows=rows)
+
+    @staticmethod
+    def _entity_names(tx, since: int) -> Tuple[List[tuple], int]:
+        """
+        交易函式：取得 created_at 不早於 since 的實體名稱 (since=0 時包含沒有時間戳記的舊實體)，
+        以及資料庫目前的時間戳記 (與 created_at 同一個時鐘)。
+        """
+        query = """
+        MATCH (e:Entity)
+        WHERE $since = 0 OR e.created_at >= $since
+        RETURN e.name AS name, coalesce(e.created_at, 0) AS created_at
+        """
+        rows = [(record["name"], record["created_at"]) for record in tx.run(query, since=since)]
+        now = tx.run("RETURN timestamp() AS now").single()["now"]
+        return rows, now
+
+    def refresh_gazetteer(self) -> None:
+        """
+        增量更新實體字典：第一次載入所有 Entity，之後只抓取上次更新後新建立的實體
+        (涵蓋由其他程序，例如 ingestion 腳本寫入的實體)。
+        舊版圖譜的實體沒有 created_at，載入後以資料庫目前時間作為下次的起點，避免每次刷新都重新載入全部實體。
+        """
+        with self.driver.session() as session:
+            rows, now = session.execute_read(self._entity_names, self._gazetteer_since)
+        added = self.gazetteer.add(name for name, _ in rows)
+        for _, created_at in rows:
+            self._gazetteer_since = max(self._gazetteer_since, created_at)
+        if self._gazetteer_since == 0:
+            self._gazetteer_since = now
+        self._gazetteer_loaded = True
+        self._gazetteer_refreshed_at = time.monotonic()
+        if added:
+            print(f"[Neo4jStore] Gazetteer refreshed: +{added} entities ({len(self.gazetteer)} total)")
+
+    def _link_entities(self, query: str) -> List[str]:
+        """
+        以 Aho-Corasick 字典進行查詢端的實體連結，只會回傳圖中確實存在的實體。
+        字典無法載入 (例如資料庫暫時無法連線) 時，退回 Regex 擷取。
         """
-        # 簡單擷取: 大寫開頭的英文單字，長度 >= 2
-        entities = set(re.findall(r'\b[A-Z][a-zA-Z]+\b', text))
-        return list(entities)
+        if not self._gazetteer_loaded or time.monotonic() - self._gazetteer_refreshed_at >= self.gazetteer_refresh_interval:
+            try:
+                self.refresh_gazetteer()
+            except Exception as e:
+                print(f"[Neo4jStore] Failed to refresh gazetteer: {e}")
+        if not self._gazetteer_loaded:
+            return self._extract_entities(query)
+        return self.gazetteer.find(query)
 
-    def add_documents(self, documents: List[Dict[str, Any]]) -> None:
+    def add_documents(self, documents: List[Dict[str, Any]]) -> int:
         """
         將文件以 Node 形式寫入 Neo4j，並將擷取出的 Entity 也建立 Node，以 :MENTIONS 關聯。
+        Document.id 與其他資料庫共用 document_id，內容雜湊未變的文件直接略過，已變動者覆寫內容並重建實體關聯。
+        寫入以 batch_size 為單位，每批在一個明確的交易中以 UNWIND 一次送出，
+        網路往返次數由「文件數 x 實體數」降為「批次數」。
+        :return: 實際寫入 (新增或更新) 的文件數
         """
         if not documents:
-            return
+            return 0
 
+        # 同一次匯入中相同 ID 只保留第一筆
+        unique_docs = {}
+        for doc in documents:
+            unique_docs.setdefault(document_id(doc), doc)
+        items = list(unique_docs.items())
+
+        written = 0
         with self.driver.session() as session:
-            for doc in documents:
-                content = doc.get("page_content", "")
-                metadata = doc.get("metadata", {})
-                doc_id = str(uuid.uuid4())
-                source = metadata.get("source", "unknown")
-
-                # 提取實體
-                entities = self._extract_entities(content)
-
-                # Cypher: 建立 Document 節點
-                create_doc_query = """
-                MERGE (d:Document {id: $doc_id})
-                SET d.content = $content, d.source = $source
-                RETURN d
-                """
-                session.run(create_doc_query, doc_id=doc_id, content=content, source=source)
-
-                # Cypher: 建立 Entity 節點並與 Document 建立關聯
-                for entity in entities:
-                    # 使用 MERGE 避免實體重複
-                    create_entity_query = """
-                    MATCH (d:Document {id: $doc_id})
-                    MERGE (e:Entity {name: $entity_name})
-                    MERGE (d)-[:MENTIONS]->(e)
-                    """
-                    session.run(create_entity_query, doc_id=doc_id, entity_name=entity)
+            for start in range(0, len(items), self.batch_size):
+                batch = items[start:start + self.batch_size]
+                # 重複匯入時，內容未變的文件不重新擷取實體與寫入
+                existing_hashes = session.execute_read(self._existing_hashes, [doc_id for doc_id, _ in batch])
+
+                rows = []
+                for doc_id, doc in batch:
+                    content = doc.get("page_content", "")
+                    doc_hash = content_hash(content)
+                    if existing_hashes.get(doc_id) == doc_hash:
+                        continue
+                    rows.append({
+                        "id": doc_id,
+                        "content": content,
+                        "hash": doc_hash,
+                        "source": doc.get("metadata", {}).get("source", "unknown"),
+                        "entities": self._extract_entities(content),
+                    })
+
+                if rows:
+                    session.execute_write(self._write_rows, rows)
+                    written += len(rows)
+                    # 本程序寫入的實體立即加入字典，不必等待下一次刷新
+                    self.gazetteer.add(entity for row in rows for entity in row["entities"])
+
+        print(f"[Neo4jStore] Wrote {written} new/updated documents ({len(items) - written} unchanged)")
+        return written
+
+    @staticmethod
+    def _delete_rows(tx, ids: List[str]) -> int:
+        """交易函式：刪除文件與其 :MENTIONS 關聯，回傳刪除數"""
+        query = """
+        MATCH (d:Document)
+        WHERE d.id IN $ids
+        DETACH DELETE d
+        RETURN count(*) AS removed
+        """
+        return tx.run(query, ids=ids).single()["removed"]
+
+    def delete_documents(self, ids: List[str]) -> int:
+        """
+        依文件 ID 刪除 Document 節點 (實體節點保留，供其他文件共用)。
+        :return: 實際刪除的文件數
+        """
+        if not ids:
+            return 0
+        removed = 0
+        with self.driver.session() as session:
+            for start in range(0, len(ids), self.batch_size):
+                removed += session.execute_write(self._delete_rows, ids[start:start + self.batch_size])
+        print(f"[Neo4jStore] Deleted {removed} documents")
+        return removed
+
+    @staticmethod
+    def _build_search_query(max_hops: int) -> str:
+        """
+        產生單次往返的 Multi-hop 檢索 Cypher：
+        hop0 為查詢實體；第 h 跳從 hop(h-1) 經由共同被提及 (co-mention) 擴展到新的實體，
+        依共同出現次數排序後只保留 $fanout 個。每個實體的權重為 $decay^h，
+        文件分數為其提及的所有擴展實體權重總和，最後取前 $k 名。
+        """
+        parts = [
+            "MATCH (seed:Entity) WHERE seed.name IN $entities",
+            "WITH collect(DISTINCT seed) AS hop0",
+        ]
+        frontiers = ["hop0"]
+        for hop in range(1, max_hops + 1):
+            parts.append(f"""CALL {{
+                WITH {", ".join(frontiers)}
+                UNWIND hop{hop - 1} AS e
+                MATCH (e)<-[:MENTIONS]-(:Document)-[:MENTIONS]->(n:Entity)
+                WHERE NOT n IN {" + ".join(frontiers)}
+                WITH n, count(*) AS co_mentions
+                ORDER BY co_mentions DESC
+                LIMIT $fanout
+                RETURN collect(n) AS hop{hop}
+            }}""")
+            frontiers.append(f"hop{hop}")
+
+        weighted = " + ".join(f"[x IN hop{hop} | {{entity: x, weight: $decay ^ {hop}}}]" for hop in range(max_hops + 1))
+        parts.append(f"""WITH {weighted} AS frontier
+            UNWIND frontier AS item
+            WITH item.entity AS entity, item.weight AS weight
+            MATCH (d:Document)-[:MENTIONS]->(entity)
+            WITH d, sum(weight) AS score
+            ORDER BY score DESC
+            LIMIT $k
+            RETURN d.content AS content, d.source AS source, score""")
+        return "\n            ".join(parts)
 
     def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Dict[str, Any]]:
         """
         執行圖譜檢索。
-        基本策略：根據 Query 提取實體，找出包含這些實體的 Document。
+        基本策略：以實體字典連結 Query 中的實體，沿共同提及關係擴展至 max_hops 跳，
+        以衰減後的路徑權重為 Document 評分，整個流程只需一次資料庫往返。
+        :param kwargs: 可覆寫 max_hops / fanout / decay
         """
-        query_entities = self._extract_entities(query)
+        query_entities = self._link_entities(query)
         
-        # 若無實體，直接回傳空 (這裡可後續擴充全文檢索或向量擴充)
+        # 若沒有任何圖中已知的實體，直接回傳空，完全不打 Neo4j
         if not query_entities:
             return []
 
+        max_hops = int(kwargs.get("max_hops", self.max_hops))
         results = []
         with self.driver.session() as session:
-            # Cypher: 尋找符合任一實體的 Document，並依照符合的實體數量(關聯度)排序
-            search_query = """
-            MATCH (d:Document)-[:MENTIONS]->(e:Entity)
-            WHERE e.name IN $entities
-            WITH d, count(e) as score
-            ORDER BY score DESC
-            LIMIT $k
-            RETURN d.content AS content, d.source AS source, score
-            """
-            
-            records = session.run(search_query, entities=query_entities, k=k)
+            records = session.run(
+                self._build_search_query(max_hops),
+                entities=query_entities,
+                k=k,
+                fanout=int(kwargs.get("fanout", self.fanout)),
+                decay=float(kwargs.get("decay", self.decay))
+            )
             for record in records:
                 results.append({
                     "page_content": record["content"],
                     "metadata": {"source": record["source"]},
-                    "score": record["score"]  # 在這裡 score 是命中的實體數
+                    "score": record["score"]  # 直接命中的實體權重為 1，每多一跳乘上 decay
                 })
         
         return results
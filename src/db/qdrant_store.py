@@ -1,13 +1,16 @@
 import os
+import time
 import uuid
-from typing import List, Dict, Any, Optional
+from concurrent.futures import ThreadPoolExecutor, Future
+from itertools import islice
+from typing import List, Dict, Any, Optional, Iterable, Iterator
 from dotenv import load_dotenv
 
 from qdrant_client import QdrantClient
-from qdrant_client.models import VectorParams, Distance, PointStruct
+from qdrant_client.models import VectorParams, Distance, PointStruct, PointIdsList
 from langchain_core.embeddings import Embeddings
 
-from src.db.base import BaseRetriever
+from src.db.base import BaseRetriever, document_id, content_hash
 
 # 確保讀取環境變數 (不硬編碼憑證)
 load_dotenv()
@@ -62,33 +65,144 @@ class QdrantStore(BaseRetriever):
         except Exception as e:
             raise RuntimeError(f"Failed to ensure Qdrant collection: {e}")
 
-    def add_documents(self, documents: List[Dict[str, Any]]) -> None:
+    def health_check(self) -> bool:
+        """確認 Qdrant 服務可連線且 Collection 仍存在"""
+        return self.client.collection_exists(self.collection_name)
+
+    def close(self) -> None:
+        """關閉 Qdrant Client 連線"""
+        self.client.close()
+
+    def add_documents(self, documents: List[Dict[str, Any]]) -> int:
         """
-        將文件加入向量資料庫。
+        將文件加入向量資料庫 (內部以串流批次方式寫入)。
         :param documents: 包含 'page_content' (str) 與 'metadata' (dict) 鍵的字典列表。
+        :return: 實際寫入 (新增或更新) 的文件數
         """
         if not documents:
-            return
+            return 0
+
+        stats = self.add_documents_stream(documents)
+        return stats["documents"] - stats["skipped"]
+
+    @staticmethod
+    def _batched(documents: Iterable[Dict[str, Any]], batch_size: int) -> Iterator[List[Dict[str, Any]]]:
+        iterator = iter(documents)
+        while True:
+            batch = list(islice(iterator, batch_size))
+            if not batch:
+                return
+            yield batch
 
-        texts = [doc.get("page_content", "") for doc in documents]
-        metadatas = [doc.get("metadata", {}) for doc in documents]
+    @staticmethod
+    def _to_point_id(doc_id: str) -> str:
+        """
+        Qdrant Point ID 只接受 UUID 或整數：沿用共用的 document_id，
+        若呼叫端給的是任意字串 ID，則以 uuid5 決定性地轉換。
+        """
+        try:
+            return str(uuid.UUID(doc_id))
+        except ValueError:
+            return str(uuid.uuid5(uuid.NAMESPACE_URL, doc_id))
 
-        # 批次取得嵌入向量
+    @classmethod
+    def _point_id(cls, doc: Dict[str, Any]) -> str:
+        return cls._to_point_id(document_id(doc))
+
+    def _filter_new(self, batch: List[Dict[str, Any]]) -> List[tuple]:
+        """
+        以決定性 ID 過濾出尚未寫入或內容已變動的文件 (同一批次內亦去重)，
+        內容雜湊未變的 chunk 不會再送進嵌入模型；已變動者以相同 ID 覆寫。
+        :return: (point_id, doc) 列表
+        """
+        unique = {}
+        for doc in batch:
+            unique.setdefault(self._point_id(doc), doc)
+
+        existing = self.client.retrieve(
+            collection_name=self.collection_name,
+            ids=list(unique),
+            with_payload=["content_hash"],
+            with_vectors=False
+        )
+        existing_hashes = {str(point.id): (point.payload or {}).get("content_hash") for point in existing}
+        return [
+            (point_id, doc) for point_id, doc in unique.items()
+            if existing_hashes.get(point_id) != content_hash(doc.get("page_content", ""))
+        ]
+
+    def _embed_batch(self, batch: List[tuple]) -> List[PointStruct]:
+        """對單一批次計算嵌入向量並轉成 PointStruct"""
+        texts = [doc.get("page_content", "") for _, doc in batch]
         vectors = self.embedding_model.embed_documents(texts)
 
         points = []
-        for i, vector in enumerate(vectors):
-            point_id = str(uuid.uuid4())
+        for (point_id, doc), text, vector in zip(batch, texts, vectors):
             payload = {
-                "page_content": texts[i],
-                "metadata": metadatas[i]
+                "page_content": text,
+                "metadata": doc.get("metadata", {}),
+                "content_hash": content_hash(text)
             }
             points.append(PointStruct(id=point_id, vector=vector, payload=payload))
+        return points
 
-        self.client.upsert(
-            collection_name=self.collection_name,
-            points=points
-        )
+    def add_documents_stream(self, documents: Iterable[Dict[str, Any]], batch_size: Optional[int] = None) -> Dict[str, float]:
+        """
+        串流寫入：逐批計算嵌入並以 wait=False 上傳，上傳的同時計算下一批的嵌入。
+        任何時刻最多只有「正在嵌入的一批 + 上傳中的一批」在記憶體中，峰值記憶體與語料大小無關。
+        Point ID 由 document_id 決定，內容未變的 chunk 會在嵌入前被略過，重複匯入不會產生重複向量；
+        內容已變動的 chunk 以相同 ID 覆寫舊向量。
+        :param documents: 文件的可迭代物件 (可為 generator)
+        :param batch_size: 每批文件數，預設讀取環境變數 QDRANT_INGEST_BATCH_SIZE
+        :return: 寫入統計 (documents, skipped, seconds, docs_per_second)
+        """
+        batch_size = batch_size or int(os.environ.get("QDRANT_INGEST_BATCH_SIZE", "64"))
+        start = time.perf_counter()
+        total = 0
+        skipped = 0
+        pending: Optional[Future] = None
+
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="qdrant-upsert") as executor:
+            for batch in self._batched(documents, batch_size):
+                new_docs = self._filter_new(batch)
+                skipped += len(batch) - len(new_docs)
+                total += len(batch)
+                if not new_docs:
+                    continue
+                points = self._embed_batch(new_docs)
+                # 等待上一批上傳完成後才送出下一批，確保同時只有一批在傳輸中
+                if pending is not None:
+                    pending.result()
+                pending = executor.submit(
+                    self.client.upsert,
+                    collection_name=self.collection_name,
+                    points=points,
+                    wait=False
+                )
+            if pending is not None:
+                pending.result()
+
+        elapsed = time.perf_counter() - start
+        rate = total / elapsed if elapsed > 0 else 0.0
+        print(f"[QdrantStore] Ingested {total} documents ({skipped} unchanged, skipped) in {elapsed:.2f}s ({rate:.1f} docs/s)")
+        return {"documents": total, "skipped": skipped, "seconds": elapsed, "docs_per_second": rate}
+
+    def delete_documents(self, ids: List[str]) -> int:
+        """
+        依文件 ID 刪除向量 (不存在的 ID 直接略過)。
+        :return: 實際刪除的文件數
+        """
+        if not ids:
+            return 0
+        point_ids = list(dict.fromkeys(self._to_point_id(doc_id) for doc_id in ids))
+        existing = self.client.retrieve(collection_name=self.collection_name, ids=point_ids, with_payload=False, with_vectors=False)
+        if existing:
+            self.client.delete(
+                collection_name=self.collection_name,
+                points_selector=PointIdsList(points=[point.id for point in existing]),
+                wait=True
+            )
+        return len(existing)
 
     def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Dict[str, Any]]:
         """
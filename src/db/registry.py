@@ -0,0 +1,129 @@
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from src.db.base import BaseRetriever
+
+class RetrieverRegistry:
+    """
+    Process 層級的檢索器註冊表。
+    每個檢索器只會被建立一次並長期持有 (沿用其連線池)，
+    健康檢查採 lazy 方式：僅在取用時且距離上次檢查超過 health_check_interval 秒才執行，
+    檢查失敗則關閉舊實例並重新建立。
+    註冊時可指定 idle_timeout：閒置超過該秒數的實例由背景執行緒關閉，下次取用時再重建
+    (例如本地模式的 Qdrant client 會鎖住儲存目錄，閒置時釋放才能讓 ingestion 寫入)。
+    """
+
+    def __init__(self, health_check_interval: float = 30.0):
+        """
+        :param health_check_interval: 兩次健康檢查之間的最短間隔 (秒)
+        """
+        self.health_check_interval = health_check_interval
+        self._factories: Dict[str, Callable[[], BaseRetriever]] = {}
+        self._instances: Dict[str, BaseRetriever] = {}
+        self._last_checked: Dict[str, float] = {}
+        self._last_used: Dict[str, float] = {}
+        self._idle_timeouts: Dict[str, float] = {}
+        # 每個檢索器各自一把鎖，避免慢速引擎的建立過程卡住其他引擎
+        self._locks: Dict[str, threading.Lock] = {}
+        self._reaper: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def register(self, name: str, factory: Callable[[], BaseRetriever], idle_timeout: Optional[float] = None) -> None:
+        """
+        註冊檢索器的建構函式 (不會立即建立連線)。
+        :param name: 檢索器名稱，例如 'qdrant'
+        :param factory: 無參數、回傳 BaseRetriever 實例的函式
+        :param idle_timeout: 閒置多少秒後關閉實例，None 表示長期持有
+        """
+        self._factories[name] = factory
+        self._locks.setdefault(name, threading.Lock())
+        if idle_timeout:
+            self._idle_timeouts[name] = idle_timeout
+            self._start_reaper()
+
+    def _start_reaper(self) -> None:
+        if self._reaper is not None:
+            return
+        interval = max(min(self._idle_timeouts.values()) / 2, 0.05)
+
+        def reap():
+            while not self._stopped.wait(interval):
+                self.release_idle()
+
+        self._reaper = threading.Thread(target=reap, name="retriever-reaper", daemon=True)
+        self._reaper.start()
+
+    def release_idle(self) -> None:
+        """
+        關閉閒置超過 idle_timeout 的實例。
+        取用後的單次檢索遠短於 idle_timeout (受引擎截止時間限制)，不會關閉仍在使用中的實例。
+        """
+        now = time.monotonic()
+        for name, timeout in self._idle_timeouts.items():
+            with self._locks[name]:
+                instance = self._instances.get(name)
+                if instance is not None and now - self._last_used.get(name, now) >= timeout:
+                    print(f"[RetrieverRegistry] '{name}' idle for {timeout:.0f}s, releasing.")
+                    self._close_instance(name, instance)
+
+    @property
+    def names(self) -> List[str]:
+        return list(self._factories)
+
+    def peek(self, name: str) -> Optional[BaseRetriever]:
+        """取得已建立的實例 (不建立連線、不做健康檢查)，尚未建立時回傳 None"""
+        return self._instances.get(name)
+
+    def get(self, name: str) -> BaseRetriever:
+        """
+        取得長駐的檢索器實例，必要時建立或重建。
+        :param name: 已註冊的檢索器名稱
+        """
+        if name not in self._factories:
+            raise KeyError(f"Retriever '{name}' is not registered.")
+
+        with self._locks[name]:
+            instance = self._instances.get(name)
+            now = time.monotonic()
+
+            if instance is not None and now - self._last_checked.get(name, 0.0) >= self.health_check_interval:
+                if not self._is_healthy(name, instance):
+                    print(f"[RetrieverRegistry] '{name}' failed health check, rebuilding.")
+                    self._close_instance(name, instance)
+                    instance = None
+                else:
+                    self._last_checked[name] = now
+
+            if instance is None:
+                instance = self._factories[name]()
+                self._instances[name] = instance
+                self._last_checked[name] = now
+
+            self._last_used[name] = now
+            return instance
+
+    def _is_healthy(self, name: str, instance: BaseRetriever) -> bool:
+        try:
+            return bool(instance.health_check())
+        except Exception as e:
+            print(f"[RetrieverRegistry] Health check error for '{name}': {e}")
+            return False
+
+    def _close_instance(self, name: str, instance: BaseRetriever) -> None:
+        try:
+            instance.close()
+        except Exception as e:
+            print(f"[RetrieverRegistry] Failed to close '{name}': {e}")
+        self._instances.pop(name, None)
+        self._last_checked.pop(name, None)
+        self._last_used.pop(name, None)
+
+    def close(self) -> None:
+        """關閉所有已建立的檢索器連線 (例如於 FastAPI shutdown 時呼叫)"""
+        self._stopped.set()
+        for name in list(self._instances):
+            with self._locks[name]:
+                instance = self._instances.get(name)
+                if instance is not None:
+                    self._close_instance(name, instance)
@@ -1,43 +1,174 @@
+import hashlib
+import os
+
+import numpy as np
 from sentence_transformers import CrossEncoder
 
+from src.db.batching import MicroBatcher
+from src.db.cache import LRUCache
+
+def _env_flag(name: str) -> bool:
+    return os.environ.get(name, "").strip().lower() in ("1", "true", "yes", "on")
+
+def quantize_dynamic_int8(model) -> None:
+    """
+    對 Cross-Encoder 的所有 Linear 層做 PyTorch 動態 int8 量化 (權重 int8、activation 執行期量化)，
+    僅適用於 CPU 推論。
+    """
+    import torch
+
+    module = model if isinstance(model, torch.nn.Module) else model.model
+    torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
 class BGEReranker:
-    def __init__(self, model_name: str = "BAAI/bge-reranker-base", device: str = "cpu"):
+    def __init__(
+        self,
+        model_name: str = "BAAI/bge-reranker-base",
+        device: str = "cpu",
+        cache_size: int = None,
+        quantize: bool = None,
+        max_length: int = None,
+        token_budget: int = None,
+    ):
         """
         初始化交叉注意力模型。
         為了保持中文精準度，選用智源研究院開源的 BGE Reranker。
+        :param cache_size: (query, chunk) 分數快取的筆數上限，None 時讀取 RERANK_SCORE_CACHE_SIZE
+        :param quantize: 是否啟用 CPU 動態 int8 量化的低延遲模式，None 時讀取 RERANKER_QUANTIZE
+        :param max_length: 每個配對截斷的 token 數，None 時讀取 RERANKER_MAX_LENGTH
+        :param token_budget: 單次前向運算的 token 預算 (用來依輸入長度決定 batch size)，None 時讀取 RERANKER_TOKEN_BUDGET
         """
         print(f"Loading Cross-Encoder Reranker: {model_name}...")
-        self.model = CrossEncoder(model_name, max_length=512, device=device)
+        self.model_name = model_name
+        self.max_length = max_length or int(os.environ.get("RERANKER_MAX_LENGTH", "512"))
+        self.token_budget = token_budget or int(os.environ.get("RERANKER_TOKEN_BUDGET", "8192"))
+        self.model = CrossEncoder(model_name, max_length=self.max_length, device=device)
+
+        self.quantized = _env_flag("RERANKER_QUANTIZE") if quantize is None else quantize
+        if self.quantized:
+            if device != "cpu":
+                print(f"[BGEReranker] int8 dynamic quantization only supports CPU, ignored on {device}")
+                self.quantized = False
+            else:
+                quantize_dynamic_int8(self.model)
+                print("[BGEReranker] Using int8 dynamically quantized model")
+        # 量化與 fp32 的分數不同，快取鍵需區分
+        self.cache_namespace = f"{model_name}:{'int8' if self.quantized else 'fp32'}:{self.max_length}"
+
+        # 同一個問題在 Multi-hop 中會重複打分相同的 (query, chunk)，以內容雜湊快取分數
+        if cache_size is None:
+            cache_size = int(os.environ.get("RERANK_SCORE_CACHE_SIZE", "20000"))
+        self.score_cache = LRUCache(max_entries=cache_size)
+        # 並行請求的配對由微批次排程合併後一次送進模型，依長度排序以減少 padding
+        self.batcher = MicroBatcher(
+            self._predict,
+            max_batch=int(os.environ.get("RERANK_BATCH_MAX_SIZE", "64")),
+            max_wait_ms=float(os.environ.get("RERANK_BATCH_WAIT_MS", "5")),
+            sort_key=lambda pair: len(pair[0]) + len(pair[1]),
+            name="rerank-batcher",
+        )
+
+    def _batch_size(self, pairs: list) -> int:
+        """
+        依輸入長度決定 batch size：短配對用大批次，長配對用小批次，讓每次前向運算的 token 數接近 token_budget。
+        以字元數估計 token 數 (中文約一字一 token)，並以 max_length 為上限。
+        """
+        longest = max(min(len(query) + len(content), self.max_length) for query, content in pairs)
+        return max(1, min(len(pairs), self.token_budget // max(longest, 1)))
+
+    def _predict(self, pairs: list) -> np.ndarray:
+        return np.asarray(self.model.predict(pairs, batch_size=self._batch_size(pairs)), dtype=np.float32)
+
+    def _pair_key(self, query: str, content: str) -> str:
+        raw = f"{self.cache_namespace}\x00{query}\x00{content}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
 
-    def rerank(self, query: str, docs: list, top_k: int = 3) -> list:
+    def score(self, query: str, contents: list) -> np.ndarray:
         """
-        對已經檢索出來的文件 (docs) 進行重新打分排序
+        計算 query 與每段內容的相關分數；命中快取者直接取用，只有未命中的配對送進 Cross-Encoder。
+        """
+        keys = [self._pair_key(query, content) for content in contents]
+        cached = [self.score_cache.get(key) for key in keys]
+        scores = np.array([np.nan if s is None else s for s in cached], dtype=np.float32)
+
+        missing = np.flatnonzero(np.isnan(scores))
+        if missing.size:
+            fresh = np.asarray(self.batcher([[query, contents[i]] for i in missing]), dtype=np.float32)
+            scores[missing] = fresh
+            for i, value in zip(missing, fresh):
+                self.score_cache.set(keys[i], float(value))
+        return scores
+
+    @staticmethod
+    def _first_stage_score(doc: dict) -> float:
+        """第一階段分數：優先使用融合分數，其次為單一引擎的原始分數"""
+        score = (doc.get("metadata") or {}).get("fusion_score", doc.get("score"))
+        return float("nan") if score is None else float(score)
+
+    def _prune(self, docs: list, top_k: int, max_pairs: int = None, max_rank: int = None) -> list:
+        """
+        Cascade 第一關：依第一階段分數排序，捨棄在每個引擎中名次都落後 max_rank 的候選
+        (RRF 分數只由名次決定，各候選的分數差距很小，不適合以分數比例剪枝)；
+        依第一階段分數排在前 top_k 者一律保留，最後以 max_pairs 作為送進 Cross-Encoder 的硬性上限。
+        沒有 best_rank (未經融合) 的候選不受名次剪枝影響。
+        """
+        first = np.array([self._first_stage_score(doc) for doc in docs], dtype=np.float64)
+        order = np.argsort(-np.nan_to_num(first, nan=-np.inf), kind="stable")
+        if max_rank is not None:
+            ranks = [(docs[i].get("metadata") or {}).get("best_rank") for i in order]
+            keep = np.array([rank is None or rank <= max_rank for rank in ranks], dtype=bool)
+            keep[:top_k] = True
+            order = order[keep]
+        if max_pairs is not None:
+            order = order[:max_pairs]
+        return [docs[i] for i in order]
+
+    def rerank(self, query: str, docs: list, top_k: int = 3, max_pairs: int = None,
+               max_rank: int = None, chunk_size: int = None) -> list:
+        """
+        對已經檢索出來的文件 (docs) 進行重新打分排序。
+        採 cascade 方式控制 Cross-Encoder 的成本：
+        1. 依各引擎名次 (best_rank) 剪枝，並限制最多 max_pairs 個配對
+        2. 依第一階段名次分段 (每段 chunk_size 筆) 送進 Cross-Encoder，當新的一段不再改變 top_k 時提前停止；
+           至少要有三段才可能省下打分 (第二段只能確認第一段的結果)，否則直接一次打分全部候選
+        :param max_pairs: 送進 Cross-Encoder 的配對數上限，None 表示不限制
+        :param max_rank: 候選至少要在一個引擎中排進前 max_rank 名，None 表示不剪枝
+        :param chunk_size: 每段打分的筆數 (不小於 top_k)，None 表示一次打分全部候選
         """
         if not docs:
             return []
 
-        # 1. 將 (query, doc_content) 配對成模型吃得進去的格式
-        pairs = []
-        for doc in docs:
-            content = doc.get("page_content", "")
-            pairs.append([query, content])
+        candidates = self._prune(docs, top_k, max_pairs, max_rank)
+        contents = [doc.get("page_content", "") for doc in candidates]
+        chunk = max(chunk_size, top_k) if chunk_size else len(candidates)
+        if len(candidates) <= 2 * chunk:
+            # 只有一到兩段時提前停止不會省下任何打分，只會多一次前向運算與批次等待
+            chunk = len(candidates)
 
-        # 2. 丟給 Cross-Encoder 進行精密打分
+        # 1. 逐段取得 (query, doc_content) 的分數 (快取 + Cross-Encoder 精密打分)
         # scores 會是一個陣列，例如: [0.95, -1.2, 5.4, 0.3 ...]，分數越高越相關
-        scores = self.model.predict(pairs)
+        scores = np.full(len(candidates), -np.inf, dtype=np.float32)
+        scored, previous = 0, None
+        while scored < len(candidates):
+            end = min(scored + chunk, len(candidates))
+            scores[scored:end] = self.score(query, contents[scored:end])
+            scored = end
+            current = set(np.argsort(-scores[:scored], kind="stable")[:top_k].tolist())
+            if current == previous:
+                break
+            previous = current
+        if scored < len(docs):
+            print(f"[BGEReranker] Cascade scored {scored}/{len(docs)} candidates")
+
+        # 2. 依照分數由高至低降冪排序，只取最精華的 top_k 筆資料回傳，幫 LLM 省 Token 又能避開雜亂資訊
+        order = np.argsort(-scores[:scored], kind="stable")[:top_k]
 
         # 3. 將分數與原本的 doc 綁定
         scored_docs = []
-        for score, doc in zip(scores, docs):
-            doc_copy = doc.copy()
+        for i in order:
+            doc_copy = candidates[i].copy()
             # 我們將打分結果附著在 metadata 裡，方便 LangSmith 追蹤除錯
-            if "metadata" not in doc_copy:
-                doc_copy["metadata"] = {}
-            doc_copy["metadata"]["rerank_score"] = float(score)
+            doc_copy["metadata"] = dict(doc_copy.get("metadata") or {})
+            doc_copy["metadata"]["rerank_score"] = float(scores[i])
             scored_docs.append(doc_copy)
-
-        # 4. 依照分數由高至低降冪排序
-        scored_docs.sort(key=lambda x: x["metadata"]["rerank_score"], reverse=True)
-
-        # 5. 只取最精華的 top_k 筆資料回傳，幫 LLM 省 Token 又能避開雜亂資訊
-        return scored_docs[:top_k]
+        return scored_docs
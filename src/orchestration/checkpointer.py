@@ -0,0 +1,218 @@
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import Any, Dict, Iterator, Optional, Sequence, Set, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import ChannelVersions, Checkpoint, CheckpointMetadata, CheckpointTuple
+from langgraph.checkpoint.memory import InMemorySaver
+
+class BoundedMemorySaver(InMemorySaver):
+    """
+    有上限的記憶體 Checkpointer，取代會無限成長的 MemorySaver：
+    - 每個 thread 只保留最新 max_checkpoints_per_thread 個 checkpoint (連同其 writes 與不再被引用的 channel blobs)
+    - 閒置超過 thread_ttl 秒的 thread 整個移除
+    - thread 數量超過 max_threads 或總序列化大小超過 max_bytes 時，依 LRU 淘汰最久未使用的 thread
+    讀取 (get_tuple) 與寫入皆視為使用；正在寫入的 thread 不會被淘汰。
+    """
+
+    def __init__(
+        self,
+        max_checkpoints_per_thread: int = 20,
+        max_threads: int = 1000,
+        thread_ttl: Optional[float] = None,
+        max_bytes: Optional[int] = None,
+    ):
+        """
+        :param max_checkpoints_per_thread: 每個 thread (與 namespace) 保留的 checkpoint 數
+        :param max_threads: 最多保留的 thread 數
+        :param thread_ttl: thread 閒置多少秒後移除，None 表示不過期
+        :param max_bytes: 所有 thread 的序列化總大小上限，None 表示不限制
+        """
+        super().__init__()
+        self.max_checkpoints_per_thread = max_checkpoints_per_thread
+        self.max_threads = max_threads
+        self.thread_ttl = thread_ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.RLock()
+        # thread_id -> 最後使用時間 (依 LRU 順序排列)
+        self._last_access: "OrderedDict[str, float]" = OrderedDict()
+        self._thread_bytes: Dict[str, int] = {}
+        self._total_bytes = 0
+        # thread_id -> 該 thread 的 blob 鍵；(thread_id, ns, checkpoint_id) -> channel_versions
+        self._blob_keys: Dict[str, Set[Tuple]] = defaultdict(set)
+        self._channel_versions: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """目前保留的 thread 數與序列化總大小"""
+        return {"threads": len(self._last_access), "bytes": self._total_bytes}
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        with self._lock:
+            # 查詢不存在的 thread 時不建立空的 defaultdict 項目
+            if thread_id not in self.storage:
+                return None
+            self._touch(thread_id)
+            return super().get_tuple(config)
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[CheckpointTuple]:
+        with self._lock:
+            if config is not None and config["configurable"]["thread_id"] not in self.storage:
+                return iter(())
+            # 在鎖內取出結果，避免迭代期間被淘汰或裁剪
+            return iter([*super().list(config, filter=filter, before=before, limit=limit)])
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        with self._lock:
+            result = super().put(config, checkpoint, metadata, new_versions)
+            for channel, version in new_versions.items():
+                self._blob_keys[thread_id].add((thread_id, checkpoint_ns, channel, version))
+            self._channel_versions[(thread_id, checkpoint_ns, checkpoint["id"])] = dict(checkpoint["channel_versions"])
+            self._trim_thread(thread_id, checkpoint_ns)
+            self._after_write(thread_id)
+            return result
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        with self._lock:
+            super().put_writes(config, writes, task_id, task_path)
+            self._after_write(config["configurable"]["thread_id"])
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            self._drop(thread_id)
+
+    def _touch(self, thread_id: str) -> None:
+        self._last_access[thread_id] = time.monotonic()
+        self._last_access.move_to_end(thread_id)
+
+    def _after_write(self, thread_id: str) -> None:
+        self._touch(thread_id)
+        size = self._measure(thread_id)
+        self._total_bytes += size - self._thread_bytes.get(thread_id, 0)
+        self._thread_bytes[thread_id] = size
+        self._evict(keep=thread_id)
+
+    def _trim_thread(self, thread_id: str, checkpoint_ns: str) -> None:
+        """只保留最新的 N 個 checkpoint，並移除不再被任何保留中 checkpoint 引用的 blobs"""
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        excess = len(checkpoints) - self.max_checkpoints_per_thread
+        if excess <= 0:
+            return
+        # checkpoint ID 為時間排序的 UUIDv6，字典序即為新舊順序
+        for checkpoint_id in sorted(checkpoints)[:excess]:
+            del checkpoints[checkpoint_id]
+            self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+            self._channel_versions.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+
+        referenced = {
+            (thread_id, checkpoint_ns, channel, version)
+            for checkpoint_id in checkpoints
+            for channel, version in self._channel_versions.get((thread_id, checkpoint_ns, checkpoint_id), {}).items()
+        }
+        blob_keys = self._blob_keys[thread_id]
+        for key in [key for key in blob_keys if key[1] == checkpoint_ns and key not in referenced]:
+            self.blobs.pop(key, None)
+            blob_keys.discard(key)
+
+    def _measure(self, thread_id: str) -> int:
+        """估算 thread 的序列化大小 (checkpoint + metadata + writes + blobs)"""
+        size = 0
+        for checkpoint_ns, checkpoints in self.storage.get(thread_id, {}).items():
+            for checkpoint_id, (checkpoint, metadata, _) in checkpoints.items():
+                size += len(checkpoint[1]) + len(metadata[1])
+                for write in self.writes.get((thread_id, checkpoint_ns, checkpoint_id), {}).values():
+                    size += len(write[2][1])
+        for key in self._blob_keys.get(thread_id, ()):
+            blob = self.blobs.get(key)
+            if blob is not None:
+                size += len(blob[1])
+        return size
+
+    def _evict(self, keep: str) -> None:
+        if self.thread_ttl is not None:
+            cutoff = time.monotonic() - self.thread_ttl
+            # _last_access 依使用時間排序，遇到未過期者即可停止
+            for thread_id, last_access in list(self._last_access.items()):
+                if last_access > cutoff:
+                    break
+                if thread_id != keep:
+                    self._drop(thread_id)
+
+        while len(self._last_access) > self.max_threads or (
+            self.max_bytes is not None and self._total_bytes > self.max_bytes
+        ):
+            oldest = next(iter(self._last_access))
+            if oldest == keep:
+                break
+            self._drop(oldest)
+
+    def _drop(self, thread_id: str) -> None:
+        """移除 thread 的所有 checkpoint、writes 與 blobs"""
+        for checkpoint_ns, checkpoints in self.storage.pop(thread_id, {}).items():
+            for checkpoint_id in checkpoints:
+                self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+                self._channel_versions.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+        for key in self._blob_keys.pop(thread_id, set()):
+            self.blobs.pop(key, None)
+        # put_writes 可能寫入不屬於保留中 checkpoint 的 writes
+        for key in [key for key in self.writes if key[0] == thread_id]:
+            del self.writes[key]
+        self._last_access.pop(thread_id, None)
+        self._total_bytes -= self._thread_bytes.pop(thread_id, 0)
+
+def get_checkpointer():
+    """
+    依環境變數建立 Checkpointer：
+    - CHECKPOINTER=memory (預設)：BoundedMemorySaver
+    - CHECKPOINTER=sqlite：CompactingSqliteSaver，狀態可跨重啟保留 (需安裝 langgraph-checkpoint-sqlite)
+    """
+    mode = os.environ.get("CHECKPOINTER", "memory").strip().lower()
+    max_checkpoints = int(os.environ.get("CHECKPOINT_MAX_PER_THREAD", "20"))
+    ttl = os.environ.get("CHECKPOINT_THREAD_TTL", "86400")
+    thread_ttl = float(ttl) if ttl else None
+
+    if mode == "sqlite":
+        try:
+            from src.orchestration.sqlite_checkpointer import CompactingSqliteSaver
+        except ImportError as e:
+            raise ImportError("CHECKPOINTER=sqlite requires the 'langgraph-checkpoint-sqlite' package") from e
+        return CompactingSqliteSaver.from_path(
+            os.environ.get("CHECKPOINT_SQLITE_PATH", "data/checkpoints.sqlite"),
+            max_checkpoints_per_thread=max_checkpoints,
+            thread_ttl=thread_ttl,
+            compact_interval=float(os.environ.get("CHECKPOINT_COMPACT_INTERVAL", "3600")),
+        )
+    if mode != "memory":
+        raise ValueError(f"Unknown CHECKPOINTER: {mode}")
+
+    max_mb = os.environ.get("CHECKPOINT_MAX_MB", "256")
+    return BoundedMemorySaver(
+        max_checkpoints_per_thread=max_checkpoints,
+        max_threads=int(os.environ.get("CHECKPOINT_MAX_THREADS", "1000")),
+        thread_ttl=thread_ttl,
+        max_bytes=int(float(max_mb) * 1024 * 1024) if max_mb else None,
+    )
@@ -1,12 +1,13 @@
 from typing import Literal
 from langgraph.graph import StateGraph, START, END
-from langgraph.checkpoint.memory import MemorySaver
+from langchain_core.runnables import RunnableLambda
 
 from src.orchestration.state import AgentState
-from src.orchestration.nodes.planner import planner_node
-from src.orchestration.nodes.researcher import researcher_node
+from src.orchestration.checkpointer import get_checkpointer
+from src.orchestration.nodes.planner import planner_node, aplanner_node
+from src.orchestration.nodes.researcher import researcher_node, aresearcher_node
 from src.orchestration.nodes.reviewer import reviewer_node
-from src.synthesis.generator import generator_node
+from src.synthesis.generator import generator_node, agenerator_node
 
 def route_after_review(state: AgentState) -> Literal["researcher", "generator"]:
     """
@@ -30,11 +31,11 @@ def build_graph() -> StateGraph:
     """
     workflow = StateGraph(AgentState)
     
-    # 註冊 Nodes
-    workflow.add_node("planner", planner_node)
-    workflow.add_node("researcher", researcher_node)
+    # 註冊 Nodes (同時提供 sync 與 async 實作：graph.invoke 走前者，graph.ainvoke / astream 走後者)
+    workflow.add_node("planner", RunnableLambda(planner_node, afunc=aplanner_node, name="planner"))
+    workflow.add_node("researcher", RunnableLambda(researcher_node, afunc=aresearcher_node, name="researcher"))
     workflow.add_node("reviewer", reviewer_node)
-    workflow.add_node("generator", generator_node)
+    workflow.add_node("generator", RunnableLambda(generator_node, afunc=agenerator_node, name="generator"))
     
     # 定義 Edges
     workflow.add_edge(START, "planner")
@@ -56,8 +57,8 @@ def build_graph() -> StateGraph:
     
     return workflow
 
-# 實例化 MemorySaver 作為 Checkpointer
-memory = MemorySaver()
+# 實例化有上限的 Checkpointer (預設為記憶體，CHECKPOINTER=sqlite 時持久化至 SQLite)
+memory = get_checkpointer()
 
 # 編譯並對外提供圖譜實例，加入 checkpointer
 graph = build_graph().compile(checkpointer=memory)
@@ -0,0 +1,249 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import httpx
+from langchain_core.caches import BaseCache
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult, Generation
+
+DEFAULT_MODEL = os.environ.get("LLM_MODEL", "gpt-4o-mini")
+
+class SQLiteResponseCache(BaseCache):
+    """
+    以 SQLite 持久化的 LLM 回應快取 (精確比對 prompt)。
+    鍵為 (模型設定字串, prompt) 的 SHA-256，總大小超過 max_bytes 時淘汰最久未使用的回應。
+    僅適用於 temperature=0 這類相同 prompt 產生相同答案的呼叫。
+    """
+
+    def __init__(self, path: str, max_bytes: int = 100 * 1024 * 1024):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(
+            """
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache (last_access);
+            """
+        )
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(prompt: str, llm_string: str) -> str:
+        return hashlib.sha256(f"{llm_string}\x00{prompt}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _dumps(generations: Sequence[Generation]) -> str:
+        return json.dumps([
+            {"text": g.text, "message": message_to_dict(g.message) if isinstance(g, ChatGeneration) else None}
+            for g in generations
+        ], ensure_ascii=False)
+
+    @staticmethod
+    def _loads(value: str) -> List[Generation]:
+        generations = []
+        for item in json.loads(value):
+            if item["message"] is not None:
+                generations.append(ChatGeneration(message=messages_from_dict([item["message"]])[0]))
+            else:
+                generations.append(Generation(text=item["text"]))
+        return generations
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[Sequence[Generation]]:
+        key = self._key(prompt, llm_string)
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+        return self._loads(row[0])
+
+    def update(self, prompt: str, llm_string: str, return_val: Sequence[Generation]) -> None:
+        value = self._dumps(return_val)
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (self._key(prompt, llm_string), value, size, time.time()),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        """總大小超過上限時，依最後使用時間由舊到新刪除"""
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        freed, victims = 0, []
+        for key, size in self._conn.execute("SELECT key, size FROM llm_cache ORDER BY last_access"):
+            victims.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        self._conn.executemany("DELETE FROM llm_cache WHERE key = ?", victims)
+
+    def clear(self, **kwargs: Any) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+            self._conn.commit()
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": entries,
+            "bytes": size,
+        }
+
+class OfflineChatModel(BaseChatModel):
+    """
+    離線測試 / benchmark 用的假 LLM：不呼叫任何外部服務。
+    若設定 response 則固定回傳該文字，否則回傳最後一則使用者訊息 (echo)；
+    可用 latency_ms 模擬 LLM 延遲，並支援逐字串流。
+    """
+
+    response: Optional[str] = None
+    latency_ms: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "offline-fake"
+
+    def _reply(self, messages: List[BaseMessage]) -> str:
+        if self.response is not None:
+            return self.response
+        for message in reversed(messages):
+            if message.type == "human":
+                return str(message.content)
+        return ""
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._reply(messages)))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        for char in self._reply(messages):
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=char))
+            if run_manager:
+                run_manager.on_llm_new_token(char, chunk=chunk)
+            yield chunk
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"response": self.response}
+
+# 模組層級共用的 LLM 實例、HTTP 連線池與回應快取
+_llms: Dict[Tuple[str, str, float], BaseChatModel] = {}
+_http_client: Optional[httpx.Client] = None
+_http_async_client: Optional[httpx.AsyncClient] = None
+_response_cache: Optional[SQLiteResponseCache] = None
+_lock = threading.Lock()
+
+def _http_settings() -> Dict[str, Any]:
+    max_connections = int(os.environ.get("LLM_MAX_CONNECTIONS", "20"))
+    return {
+        "timeout": httpx.Timeout(float(os.environ.get("LLM_TIMEOUT", "30")), connect=5.0),
+        "limits": httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+    }
+
+def get_response_cache() -> Optional[SQLiteResponseCache]:
+    """LLM_CACHE_PATH 有設定時啟用持久化的回應快取"""
+    global _response_cache
+    path = os.environ.get("LLM_CACHE_PATH")
+    if not path:
+        return None
+    if _response_cache is None:
+        _response_cache = SQLiteResponseCache(
+            path, max_bytes=int(float(os.environ.get("LLM_CACHE_MAX_MB", "100")) * 1024 * 1024)
+        )
+    return _response_cache
+
+def get_llm(model: Optional[str] = None, temperature: float = 0.0) -> BaseChatModel:
+    """
+    取得共用的 Chat Model (同一組設定只建立一次)。
+    - LLM_BACKEND=openai (預設)：ChatOpenAI，共用 HTTP 連線池 (保留連線與 TLS session)，逾時與重試次數由環境變數設定
+    - LLM_BACKEND=fake：OfflineChatModel，供測試與離線 benchmark 使用
+    temperature 為 0 時才會套用持久化的回應快取。
+    """
+    global _http_client, _http_async_client
+    backend = os.environ.get("LLM_BACKEND", "openai").strip().lower()
+    model = model or DEFAULT_MODEL
+    key = (backend, model, temperature)
+
+    with _lock:
+        llm = _llms.get(key)
+        if llm is not None:
+            return llm
+
+        cache = get_response_cache() if temperature == 0 else None
+        if backend == "fake":
+            llm = OfflineChatModel(
+                response=os.environ.get("LLM_FAKE_RESPONSE") or None,
+                latency_ms=float(os.environ.get("LLM_FAKE_LATENCY_MS", "0")),
+                cache=cache,
+            )
+        elif backend == "openai":
+            from langchain_openai import ChatOpenAI
+
+            if _http_client is None:
+                _http_client = httpx.Client(**_http_settings())
+                _http_async_client = httpx.AsyncClient(**_http_settings())
+            llm = ChatOpenAI(
+                model=model,
+                temperature=temperature,
+                request_timeout=float(os.environ.get("LLM_TIMEOUT", "30")),
+                max_retries=int(os.environ.get("LLM_MAX_RETRIES", "2")),
+                http_client=_http_client,
+                http_async_client=_http_async_client,
+                cache=cache,
+            )
+        else:
+            raise ValueError(f"Unknown LLM_BACKEND: {backend}")
+
+        _llms[key] = llm
+        return llm
+
+async def aclose_llm_clients() -> None:
+    """關閉共用的 HTTP 連線池 (於 API shutdown 時呼叫)"""
+    global _http_client, _http_async_client
+    with _lock:
+        _llms.clear()
+        client, async_client = _http_client, _http_async_client
+        _http_client = _http_async_client = None
+    if client is not None:
+        client.close()
+    if async_client is not None:
+        await async_client.aclose()
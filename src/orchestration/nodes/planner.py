@@ -1,49 +1,254 @@
+import asyncio
+import hashlib
 import os
-from langchain_openai import ChatOpenAI
+import re
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Set
 from langchain_core.prompts import ChatPromptTemplate
-from src.orchestration.state import AgentState
+from langchain_core.prompt_values import PromptValue
+from langchain_core.runnables import RunnableConfig
+from src.db.cache import LRUCache
+from src.orchestration.llm import get_llm
+from src.orchestration.nodes.researcher import afan_out_search, fan_out_search
+from src.orchestration.state import AgentState, estimate_tokens, reset_docs
+
+# Query Rewriting 只參考最近幾輪對話 (一輪 = 使用者 + 助理各一則)
+REWRITE_HISTORY_TURNS = int(os.environ.get("REWRITE_HISTORY_TURNS", "3"))
+# 短於此 token 數、且與上一個問題沒有共同詞彙的問題，視為省略了主詞而需要改寫
+REWRITE_MIN_TOKENS = int(os.environ.get("REWRITE_MIN_TOKENS", "6"))
+
+# 推測式檢索：LLM 改寫期間先以原問題檢索；改寫結果的詞彙有足夠比例已出現在原問題時沿用，否則捨棄
+SPECULATIVE_RETRIEVAL = os.environ.get("SPECULATIVE_RETRIEVAL", "true").strip().lower() in ("1", "true", "yes", "on")
+SPECULATIVE_REUSE_THRESHOLD = float(os.environ.get("SPECULATIVE_REUSE_THRESHOLD", "0.7"))
+
+# sync 路徑的推測式檢索執行緒 (fan_out_search 本身會阻塞等待各引擎，不可佔用檢索執行緒池；
+# 各引擎查詢則在 researcher 的推測專用池執行，被捨棄的查詢不會拖慢正式檢索)
+_speculation_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("SPECULATIVE_MAX_WORKERS", "4")),
+    thread_name_prefix="speculation"
+)
+
+# 改寫結果快取：鍵為 (截斷後的對話歷史, 問題) 的雜湊
+_rewrite_cache = LRUCache(max_entries=int(os.environ.get("REWRITE_CACHE_SIZE", "1024")))
+
+# 指代詞：出現時問題必須依賴上下文才能理解
+_ANAPHORA = re.compile(
+    r"(它們|他們|她們|它|(?<!其)他|她|這個|那個|這些|那些|這種|那種|這家|那家|這項|那項|這樣|那樣|"
+    r"上述|上面|前面|前者|後者|剛才|剛剛|(?<!應)該|此)"
+    r"|\b(it|its|they|them|their|this|that|these|those|he|she|him|her|his|former|latter)\b",
+    re.IGNORECASE,
+)
+# 省略句：承接上一輪主題的追問句型
+_ELLIPSIS = re.compile(
+    r"^\s*(那麼?|還有|另外|然後|那如果|如果是|至於|and\b|what about\b|how about\b)"
+    r"|呢\s*[?？]?\s*$",
+    re.IGNORECASE,
+)
+_TERMS = re.compile(r"[\u4e00-\u9fff]+|[a-z0-9]+")
+
+def _terms(text: str) -> Set[str]:
+    """擷取用於比對重疊度的詞彙：中文取相鄰雙字，英數取長度 >= 2 的單字"""
+    terms = set()
+    for chunk in _TERMS.findall(text.lower()):
+        if chunk.isascii():
+            if len(chunk) >= 2:
+                terms.add(chunk)
+        else:
+            terms.update(chunk[i:i + 2] for i in range(max(len(chunk) - 1, 1)))
+    return terms
+
+# 疑問詞：追問常與上一個問題共用，不能代表追問重複了上一個問題的主題
+_QUESTION_TERMS = _terms(
+    "罰多少錢 要多少 是什麼 為什麼 怎麼辦 如何 是否 可不可以 會不會 要不要 有沒有 需不需要 哪些 多久 幾天 "
+    "how much many what which when where why"
+)
+
+def needs_rewrite(question: str, history: List[str]) -> bool:
+    """
+    本地快速判斷追問是否需要 LLM 改寫 (不呼叫任何模型)：
+    - 含指代詞 (它 / 這個 / 上述 / it / they ...) 或省略句型 (那...呢 / 還有呢 / what about ...) -> 需要
+    - 與上一個問題只有疑問詞 (多少 / 什麼 / 如何 ...) 相同，主題詞都沒有重複 (例如接在「闖紅燈會被罰多少錢？」
+      之後的「罰款是多少錢」) -> 需要，與問題長度無關
+    - 與上一個問題沒有共同詞彙：過短者視為省略了主詞 -> 需要；否則視為換了新主題
+    - 其餘 (重複了上一個問題的主題詞) 視為自足的問題，直接使用原問題
+    :param question: 使用者最新的問題
+    :param history: 先前的對話內容 (由舊到新)
+    """
+    if not history:
+        return False
+    if _ANAPHORA.search(question) or _ELLIPSIS.search(question):
+        return True
+    previous_question = next((text[len("User: "):] for text in reversed(history) if text.startswith("User: ")), "")
+    previous_terms = _terms(previous_question)
+    shared = _terms(question) & previous_terms
+    if not shared:
+        return estimate_tokens(question) < REWRITE_MIN_TOKENS
+    return not (shared - _QUESTION_TERMS)
+
+def _trim_history(messages: list) -> List[str]:
+    """取最近 REWRITE_HISTORY_TURNS 輪的對話，格式化為 'User: ...' / 'Assistant: ...'"""
+    recent = messages[:-1][-REWRITE_HISTORY_TURNS * 2:] if REWRITE_HISTORY_TURNS > 0 else []
+    return [f"{'User' if msg.type == 'human' else 'Assistant'}: {msg.content}" for msg in recent]
+
+def _rewrite_cache_key(history: List[str], question: str) -> str:
+    return hashlib.sha1("\x00".join([*history, question]).encode("utf-8")).hexdigest()
+
+def _build_rewrite_prompt(history: List[str], question: str) -> PromptValue:
+    """建立 Query Rewriting 的 prompt"""
+    prompt_template = ChatPromptTemplate.from_messages([
+        ("system", "你是一個查詢重寫助理。請閱讀以下的對話歷史，並將使用者的最新問題，改寫成一個不需要上下文也能完全理解的獨立檢索詞（Standalone Query）。如果不需要改寫，請直接輸出原問題。\n\n[對話歷史開始]\n{history}\n[對話歷史結束]"),
+        ("user", "最新問題: {question}")
+    ])
+    return prompt_template.invoke({"history": "\n".join(history), "question": question})
+
+def _plan_text(query: str) -> str:
+    return f"Plan to research about: {query}"
+
+def _plan_update(query: str, prefetched: Optional[Dict[str, Any]] = None) -> dict:
+    return {
+        "current_plan": _plan_text(query),
+        "search_count": 0,
+        # 新一輪對話：清空上一輪累積的文件
+        "retrieved_docs": reset_docs(),
+        # 未沿用推測式檢索時也要覆寫，避免上一輪的結果殘留在 checkpoint 中
+        "prefetched_results": prefetched
+    }
+
+def rewrite_coverage(question: str, rewritten: str) -> float:
+    """改寫後的詞彙有多少比例已出現在原問題中 (1.0 表示原問題的檢索結果足以代表改寫結果)"""
+    rewritten_terms = _terms(rewritten)
+    if not rewritten_terms:
+        return 1.0
+    return len(rewritten_terms & _terms(question)) / len(rewritten_terms)
+
+def _speculation_result(engine_results: Dict[str, Any], timed_out: List[str]) -> Optional[Dict[str, Any]]:
+    """有引擎逾時的推測結果不完整，不沿用 (由 Researcher 重新檢索)"""
+    if timed_out:
+        print(f"推測式檢索有引擎逾時 ({', '.join(timed_out)})，改由 Researcher 重新檢索")
+        return None
+    return {"engine_results": engine_results, "timed_out": timed_out}
+
+def _should_reuse(question: str, rewritten: str) -> bool:
+    coverage = rewrite_coverage(question, rewritten)
+    reuse = coverage >= SPECULATIVE_REUSE_THRESHOLD
+    print(f"推測式檢索 coverage={coverage:.2f} -> {'沿用' if reuse else '捨棄'}")
+    return reuse
+
+def _start_speculation(question: str) -> Optional[Future]:
+    if not SPECULATIVE_RETRIEVAL:
+        return None
+    return _speculation_executor.submit(fan_out_search, _plan_text(question), 5, speculative=True)
+
+def _collect_speculation(future: Optional[Future], question: str, rewritten: str) -> Optional[Dict[str, Any]]:
+    """改寫結果與原問題相近時等待並回傳推測式檢索結果，否則取消"""
+    if future is None:
+        return None
+    if not _should_reuse(question, rewritten):
+        future.cancel()
+        return None
+    try:
+        engine_results, timed_out = future.result()
+    except Exception as e:
+        print(f"Speculative retrieval error: {e}")
+        return None
+    return _speculation_result(engine_results, timed_out)
+
+async def _acollect_speculation(task: Optional[asyncio.Task], question: str, rewritten: str) -> Optional[Dict[str, Any]]:
+    """_collect_speculation 的 async 版本：不沿用時取消 task (尚未開始的引擎查詢一併取消，執行中的於推測專用池跑完後捨棄)"""
+    if task is None:
+        return None
+    if not _should_reuse(question, rewritten):
+        task.cancel()
+        return None
+    try:
+        engine_results, timed_out = await task
+    except Exception as e:
+        print(f"Speculative retrieval error: {e}")
+        return None
+    return _speculation_result(engine_results, timed_out)
+
+def _resolve_without_llm(messages: list):
+    """
+    嘗試不經 LLM 決定檢索詞。
+    :return: (檢索詞, None) 或需要改寫時的 (None, (截斷後的歷史, 快取鍵))
+    """
+    question = messages[-1].content
+    history = _trim_history(messages)
+    if not needs_rewrite(question, history):
+        return question, None
+
+    key = _rewrite_cache_key(history, question)
+    cached = _rewrite_cache.get(key)
+    if cached is not None:
+        print(f"原問題: {question} -> 重寫後 (快取): {cached}")
+        return cached, None
+    return None, (history, key)
+
+def _store_rewrite(key: str, question: str, rewritten: str) -> str:
+    rewritten = rewritten or question
+    _rewrite_cache.set(key, rewritten)
+    print(f"原問題: {question} -> 重寫後: {rewritten}")
+    return rewritten
+
+def get_rewrite_cache_stats() -> dict:
+    return _rewrite_cache.stats
 
 def planner_node(state: AgentState) -> dict:
     """
     Planner 節點
     職責：讀取歷史對話 (messages)，判斷使用者的意圖，
-    如果有多輪對話，會將代名詞改寫成獨立檢索詞 (Standalone Query)。
+    如果追問依賴上下文 (代名詞 / 省略)，會改寫成獨立檢索詞 (Standalone Query)；
+    自足的追問與已改寫過的問題不會呼叫 LLM。
+    呼叫 LLM 改寫的同時以原問題進行推測式檢索，改寫結果相近時交由 Researcher 沿用。
     """
     messages = state.get("messages", [])
-    
+
     if not messages:
         return {"current_plan": "No questions asked."}
 
-    last_message = messages[-1].content
-    
-    # 若對話只有一句，無須參考上下文
-    if len(messages) <= 1:
-        plan = f"Plan to research about: {last_message}"
-    else:
-        # 使用 LLM 進行 Query Rewriting
-        llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
-        
-        chat_history = []
-        for msg in messages[:-1]:
-            role = "User" if msg.type == "human" else "Assistant"
-            chat_history.append(f"{role}: {msg.content}")
-        history_str = "\n".join(chat_history)
-        
-        prompt_template = ChatPromptTemplate.from_messages([
-            ("system", "你是一個查詢重寫助理。請閱讀以下的對話歷史，並將使用者的最新問題，改寫成一個不需要上下文也能完全理解的獨立檢索詞（Standalone Query）。如果不需要改寫，請直接輸出原問題。\n\n[對話歷史開始]\n{history}\n[對話歷史結束]"),
-            ("user", "最新問題: {question}")
-        ])
-        
-        prompt_value = prompt_template.invoke({"history": history_str, "question": last_message})
-        print("Planner 正在進行 Query Rewriting...")
-        response = llm.invoke(prompt_value)
-        rewritten_query = response.content.strip()
-        print(f"原問題: {last_message} -> 重寫後: {rewritten_query}")
-        
-        plan = f"Plan to research about: {rewritten_query}"
+    query, pending = _resolve_without_llm(messages)
+    if pending is None:
+        return _plan_update(query)
 
-    return {
-        "current_plan": plan,
-        "search_count": 0,
-        "retrieved_docs": []
-    }
+    # 使用 LLM 進行 Query Rewriting (共用連線池的 LLM 實例)
+    history, key = pending
+    question = messages[-1].content
+    llm = get_llm()
+    speculation = _start_speculation(question)
+    print("Planner 正在進行 Query Rewriting...")
+    try:
+        response = llm.invoke(_build_rewrite_prompt(history, question))
+    except Exception:
+        if speculation is not None:
+            speculation.cancel()
+        raise
+    rewritten = _store_rewrite(key, question, response.content.strip())
+    return _plan_update(rewritten, _collect_speculation(speculation, question, rewritten))
+
+async def aplanner_node(state: AgentState, config: RunnableConfig) -> dict:
+    """
+    Planner 節點 (async 版本，供 graph.ainvoke 使用)
+    config 需明確傳給 LLM：Python 3.11 以下 async 節點無法透過 contextvars 自動傳遞 callbacks。
+    """
+    messages = state.get("messages", [])
+
+    if not messages:
+        return {"current_plan": "No questions asked."}
+
+    query, pending = _resolve_without_llm(messages)
+    if pending is None:
+        return _plan_update(query)
+
+    history, key = pending
+    question = messages[-1].content
+    llm = get_llm()
+    speculation = asyncio.ensure_future(afan_out_search(_plan_text(question), 5, speculative=True)) if SPECULATIVE_RETRIEVAL else None
+    print("Planner 正在進行 Query Rewriting...")
+    try:
+        response = await llm.ainvoke(_build_rewrite_prompt(history, question), config=config)
+    except BaseException:
+        if speculation is not None:
+            speculation.cancel()
+        raise
+    rewritten = _store_rewrite(key, question, response.content.strip())
+    return _plan_update(rewritten, await _acollect_speculation(speculation, question, rewritten))
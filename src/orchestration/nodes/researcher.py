@@ -1,22 +1,89 @@
+import asyncio
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from typing import List, Dict, Any, Tuple
 from langchain_huggingface import HuggingFaceEmbeddings
 from src.orchestration.state import AgentState
 from src.db.qdrant_store import QdrantStore
 from src.db.neo4j_store import Neo4jStore
 from src.db.bm25_store import BM25Store
 from src.db.reranker import BGEReranker
+from src.db.registry import RetrieverRegistry
+from src.db.cached_retriever import CachedRetriever
+from src.db.fusion import reciprocal_rank_fusion
+from src.db.embeddings import BatchedEmbeddings, CachedEmbeddings
 
 # 模組層級初始化 Embeddings (避免每次呼叫節點都重新載入模型)
 _embeddings = None
 _reranker = None
+_registry = None
+
+# 有界的檢索執行緒池：三個引擎同時查詢，hop 延遲約等於最慢的單一引擎
+_search_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("RETRIEVAL_MAX_WORKERS", "6")),
+    thread_name_prefix="retrieval"
+)
+
+# 推測式檢索 (Planner 改寫期間以原問題預先檢索) 專用的引擎執行緒池：
+# 被捨棄的推測查詢已送出的引擎查詢仍會跑完，獨立的池可避免它們佔用正式檢索的 worker，
+# 使正式檢索的截止時間被排隊時間吃掉而誤判逾時
+_speculative_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("SPECULATIVE_ENGINE_WORKERS", "3")),
+    thread_name_prefix="speculative-retrieval"
+)
+
+# CPU 密集的模型推論 (Reranker) 專用執行緒池，async 路徑下不阻塞 event loop
+_model_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("MODEL_MAX_WORKERS", "2")),
+    thread_name_prefix="model"
+)
+
+# 各引擎的截止時間 (秒)，逾時的結果直接捨棄而不等待
+ENGINE_TIMEOUTS = {
+    "qdrant": float(os.environ.get("QDRANT_SEARCH_TIMEOUT", "5.0")),
+    "neo4j": float(os.environ.get("NEO4J_SEARCH_TIMEOUT", "3.0")),
+    "bm25": float(os.environ.get("BM25_SEARCH_TIMEOUT", "2.0")),
+}
+
+def _parse_weights(raw: str) -> Dict[str, float]:
+    """解析 'qdrant=1.0,bm25=0.8' 格式的引擎權重設定"""
+    weights = {}
+    for item in raw.split(","):
+        if "=" in item:
+            name, value = item.split("=", 1)
+            weights[name.strip()] = float(value)
+    return weights
+
+# 混合檢索融合設定 (RRF)
+FUSION_WEIGHTS = _parse_weights(os.environ.get("FUSION_WEIGHTS", ""))
+FUSION_RRF_K = int(os.environ.get("FUSION_RRF_K", "60"))
+FUSION_NORMALIZATION = os.environ.get("FUSION_NORMALIZATION") or None
+# Cascade Rerank：送入 Cross-Encoder 的配對數上限、各引擎名次剪枝門檻、分段打分大小 (提前停止，留空表示一次打分)
+RERANK_CANDIDATE_BUDGET = int(os.environ.get("RERANK_CANDIDATE_BUDGET", "8"))
+RERANK_MAX_ENGINE_RANK = int(os.environ.get("RERANK_MAX_ENGINE_RANK", "3"))
+RERANK_CHUNK_SIZE = int(os.environ.get("RERANK_CHUNK_SIZE") or 0) or None
 
 def get_embeddings():
     global _embeddings
     if _embeddings is None:
         # 改用更強大且開源免費的繁中嵌入模型 BAAI/bge-base-zh-v1.5
-        _embeddings = HuggingFaceEmbeddings(
-            model_name="BAAI/bge-base-zh-v1.5",
-            encode_kwargs={'normalize_embeddings': True}
+        model_name = "BAAI/bge-base-zh-v1.5"
+        # 查詢向量快取：跨 hop、跨請求共用，重複查詢不再執行 encoder
+        ttl = os.environ.get("QUERY_EMBEDDING_CACHE_TTL")
+        _embeddings = CachedEmbeddings(
+            # 未命中快取的查詢再經由微批次排程，與其他並行請求合併成一次前向運算
+            BatchedEmbeddings(
+                HuggingFaceEmbeddings(
+                    model_name=model_name,
+                    encode_kwargs={'normalize_embeddings': True}
+                ),
+                max_batch=int(os.environ.get("EMBEDDING_BATCH_MAX_SIZE", "32")),
+                max_wait_ms=float(os.environ.get("EMBEDDING_BATCH_WAIT_MS", "5"))
+            ),
+            model_name=model_name,
+            max_entries=int(os.environ.get("QUERY_EMBEDDING_CACHE_SIZE", "4096")),
+            ttl=float(ttl) if ttl else None
         )
     return _embeddings
 
@@ -26,82 +93,236 @@ def get_reranker():
         _reranker = BGEReranker()
     return _reranker
 
+def _qdrant_path() -> str:
+    # 測試環境下，如果是 :memory: 將由環境變數或上層決定；設為空字串時改用 QDRANT_URL 連線 Qdrant 服務
+    return os.environ.get("QDRANT_PATH", "data/qdrant_db")
+
+def _build_qdrant_store() -> QdrantStore:
+    qdrant_path = _qdrant_path()
+    return QdrantStore(
+        collection_name="deep_research_rag_bge",
+        embedding_model=get_embeddings(),
+        vector_size=768, # BAAI/bge-base-zh-v1.5 維度為 768
+        qdrant_path=qdrant_path
+    )
+
+def _build_neo4j_store() -> Neo4jStore:
+    neo4j_uri = os.environ.get("NEO4J_URI", "bolt://localhost:7687")
+    return Neo4jStore(uri=neo4j_uri)
+
+def get_retriever_registry() -> RetrieverRegistry:
+    """
+    取得 Process 層級的檢索器註冊表。
+    各資料庫連線只建立一次並跨 hop / 跨請求重複使用，由 API shutdown 時統一關閉。
+    例外：本地模式 (QDRANT_PATH) 的 Qdrant client 在開啟期間獨占儲存目錄的鎖，
+    閒置 QDRANT_LOCAL_IDLE_TIMEOUT 秒後釋放，API 閒置時才能執行 scripts/ingest_data.py；
+    API 與 ingestion 需同時運作時請改用 Qdrant 服務 (QDRANT_URL，並將 QDRANT_PATH 設為空)。
+    """
+    global _registry
+    if _registry is None:
+        _registry = RetrieverRegistry(
+            health_check_interval=float(os.environ.get("RETRIEVER_HEALTH_CHECK_INTERVAL", "30"))
+        )
+        # 每個引擎外層包一層檢索結果快取 (語料版本變動時失效)
+        qdrant_idle_timeout = float(os.environ.get("QDRANT_LOCAL_IDLE_TIMEOUT", "30")) if _qdrant_path() else None
+        _registry.register("qdrant", lambda: _with_result_cache("qdrant", _build_qdrant_store()), idle_timeout=qdrant_idle_timeout or None)
+        _registry.register("neo4j", lambda: _with_result_cache("neo4j", _build_neo4j_store()))
+        _registry.register("bm25", lambda: _with_result_cache("bm25", BM25Store()))
+    return _registry
+
+def _with_result_cache(name: str, store) -> CachedRetriever:
+    ttl = os.environ.get("RETRIEVAL_CACHE_TTL")
+    return CachedRetriever(
+        name,
+        store,
+        max_entries=int(os.environ.get("RETRIEVAL_CACHE_SIZE", "1024")),
+        max_bytes=int(float(os.environ.get("RETRIEVAL_CACHE_MAX_MB", "64")) * 1024 * 1024),
+        ttl=float(ttl) if ttl else None
+    )
+
+def get_cache_stats() -> Dict[str, Any]:
+    """各層快取 (查詢向量 / Reranker 分數 / 各引擎檢索結果) 的命中率，只統計已建立者"""
+    stats: Dict[str, Any] = {}
+    if _embeddings is not None:
+        stats["query_embeddings"] = _embeddings.stats
+    if _reranker is not None:
+        stats["rerank_scores"] = _reranker.score_cache.stats
+    if _registry is not None:
+        for name in _registry.names:
+            instance = _registry.peek(name)
+            if isinstance(instance, CachedRetriever):
+                stats[f"retrieval.{name}"] = instance.stats
+    return stats
+
+def close_retriever_registry() -> None:
+    """關閉所有長駐的檢索器連線"""
+    global _registry
+    if _registry is not None:
+        _registry.close()
+        _registry = None
+
+def _search_qdrant(query: str, k: int) -> List[Dict[str, Any]]:
+    """檢索 Qdrant (向量)"""
+    return get_retriever_registry().get("qdrant").similarity_search(query, k=k)
+
+def _search_neo4j(query: str, k: int) -> List[Dict[str, Any]]:
+    """檢索 Neo4j (圖譜)"""
+    return get_retriever_registry().get("neo4j").similarity_search(query, k=k)
+
+def _search_bm25(query: str, k: int) -> List[Dict[str, Any]]:
+    """檢索 BM25 (關鍵字)"""
+    return get_retriever_registry().get("bm25").similarity_search(query, k=k)
+
+# 引擎名稱 -> 檢索函式，順序即為合併時的優先順序
+_ENGINES = {
+    "qdrant": _search_qdrant,
+    "neo4j": _search_neo4j,
+    "bm25": _search_bm25,
+}
+
+def fan_out_search(query: str, k: int = 5, speculative: bool = False) -> Tuple[Dict[str, List[Dict[str, Any]]], List[str]]:
+    """
+    並行查詢所有檢索引擎，每個引擎各自套用 ENGINE_TIMEOUTS 中的截止時間。
+    :param query: 查詢字串
+    :param k: 每個引擎的返回數量
+    :param speculative: 推測式檢索，改用獨立的執行緒池 (不與正式檢索搶 worker)
+    :return: (引擎名稱 -> 結果列表, 逾時的引擎名稱列表)
+    """
+    executor = _speculative_executor if speculative else _search_executor
+    start = time.monotonic()
+    futures = {name: executor.submit(search_fn, query, k) for name, search_fn in _ENGINES.items()}
+
+    results: Dict[str, List[Dict[str, Any]]] = {}
+    timed_out: List[str] = []
+    for name, future in futures.items():
+        # 截止時間從同一個起點起算，先等待的引擎不會吃掉後面引擎的額度
+        remaining = max(0.0, start + ENGINE_TIMEOUTS[name] - time.monotonic())
+        try:
+            engine_results = future.result(timeout=remaining)
+        except FuturesTimeoutError:
+            future.cancel()
+            timed_out.append(name)
+            print(f"{name} search timed out after {ENGINE_TIMEOUTS[name]}s, results dropped.")
+            continue
+        except Exception as e:
+            print(f"{name} search error: {e}")
+            continue
+
+        results[name] = _tag_engine(name, engine_results)
+
+    return results, timed_out
+
+def _tag_engine(name: str, engine_results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """確保結果為字典格式並標記來源引擎"""
+    for res in engine_results:
+        if "metadata" not in res:
+            res["metadata"] = {}
+        res["metadata"]["engine"] = name
+    return engine_results
+
+async def afan_out_search(query: str, k: int = 5, speculative: bool = False) -> Tuple[Dict[str, List[Dict[str, Any]]], List[str]]:
+    """
+    fan_out_search 的 async 版本：同步的資料庫 client 與 embedding 於檢索執行緒池中執行，
+    event loop 只負責等待，各引擎同時起跑並各自套用 ENGINE_TIMEOUTS。
+    被取消時，尚未開始執行的引擎查詢會一併自執行緒池中取消。
+    """
+    loop = asyncio.get_running_loop()
+    executor = _speculative_executor if speculative else _search_executor
+
+    async def run(name, search_fn):
+        future = loop.run_in_executor(executor, search_fn, query, k)
+        return await asyncio.wait_for(future, timeout=ENGINE_TIMEOUTS[name])
+
+    names = list(_ENGINES)
+    outcomes = await asyncio.gather(*(run(name, _ENGINES[name]) for name in names), return_exceptions=True)
+
+    results: Dict[str, List[Dict[str, Any]]] = {}
+    timed_out: List[str] = []
+    for name, outcome in zip(names, outcomes):
+        if isinstance(outcome, asyncio.TimeoutError):
+            timed_out.append(name)
+            print(f"{name} search timed out after {ENGINE_TIMEOUTS[name]}s, results dropped.")
+        elif isinstance(outcome, Exception):
+            print(f"{name} search error: {outcome}")
+        else:
+            results[name] = _tag_engine(name, outcome)
+    return results, timed_out
+
+def _fuse_and_rerank(current_plan: str, engine_results: Dict[str, List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """融合各引擎結果並以 Cross-Encoder 重排序 (CPU 密集，async 路徑下於 _model_executor 執行)"""
+    # ===== 融合與去重 (Reciprocal Rank Fusion) =====
+    # 各引擎分數尺度不同 (cosine / 實體命中數 / BM25)，以名次融合並寫入 fusion_score 供 Reranker 剪枝
+    fused_docs = reciprocal_rank_fusion(
+        engine_results,
+        weights=FUSION_WEIGHTS,
+        k=FUSION_RRF_K,
+        normalization=FUSION_NORMALIZATION
+    )
+    total = sum(len(results) for results in engine_results.values())
+    print(f"Total retrieved docs before fusion: {total}, fused candidates: {len(fused_docs)}")
+
+    # ===== 重排序機制 (Reranking) =====
+    reranker = get_reranker()
+    # Cascade：依各引擎名次剪枝並限制配對數 (預設一次批次打分全部存活的候選)
+    reranked_docs = reranker.rerank(
+        current_plan,
+        fused_docs,
+        top_k=3,
+        max_pairs=RERANK_CANDIDATE_BUDGET,
+        max_rank=RERANK_MAX_ENGINE_RANK,
+        chunk_size=RERANK_CHUNK_SIZE
+    )
+    print(f"Docs after reranking: {len(reranked_docs)}")
+    return reranked_docs
+
+def _take_prefetched(state: AgentState):
+    """第一次 hop 且 Planner 留下推測式檢索結果時回傳 (引擎結果, 逾時引擎)，否則回傳 None"""
+    prefetched = state.get("prefetched_results")
+    if not prefetched or state.get("search_count", 0) != 0:
+        return None
+    print("Researcher reusing speculative retrieval results.")
+    return prefetched["engine_results"], prefetched.get("timed_out", [])
+
 def researcher_node(state: AgentState) -> dict:
     """
     Researcher 節點
-    職責：根據 current_plan，前往 Qdrant (Vector DB) 與 Neo4j (Graph DB) 檢索文獻，並合併結果。
+    職責：根據 current_plan，同時前往 Qdrant (Vector DB)、Neo4j (Graph DB) 與 BM25 檢索文獻，並合併結果。
     """
     current_plan = state.get("current_plan", "")
     current_count = state.get("search_count", 0)
     
     print(f"Researcher invoked. Current count: {current_count}. Plan: {current_plan}")
     
-    docs = []
-    
-    # 初始化資料庫連線
-    # 測試環境下，如果是 :memory: 將由環境變數或上層決定
-    qdrant_path = os.environ.get("QDRANT_PATH", "data/qdrant_db")
-    neo4j_uri = os.environ.get("NEO4J_URI", "bolt://localhost:7687")
-    
-    try:
-        # 1. 檢索 Qdrant (向量)
-        qdrant_store = QdrantStore(
-            collection_name="deep_research_rag_bge", 
-            embedding_model=get_embeddings(),
-            vector_size=768, # BAAI/bge-base-zh-v1.5 維度為 768
-            qdrant_path=qdrant_path
-        )
-        qdrant_results = qdrant_store.similarity_search(current_plan, k=5)
-        docs.extend(qdrant_results)
-    except Exception as e:
-        print(f"Qdrant search error: {e}")
-
-    try:
-        # 2. 檢索 Neo4j (圖譜)
-        neo4j_store = Neo4jStore(uri=neo4j_uri)
-        neo4j_results = neo4j_store.similarity_search(current_plan, k=5)
-        # 確保結果為字典格式並標記來源引擎
-        for res in neo4j_results:
-            if "metadata" not in res:
-                res["metadata"] = {}
-            res["metadata"]["engine"] = "neo4j"
-        docs.extend(neo4j_results)
-        neo4j_store.close()
-    except Exception as e:
-        print(f"Neo4j search error: {e}")
-    
-    try:
-        # 3. 檢索 BM25 (關鍵字)
-        bm25_store = BM25Store()
-        bm25_results = bm25_store.similarity_search(current_plan, k=5)
-        for res in bm25_results:
-            if "metadata" not in res:
-                res["metadata"] = {}
-            res["metadata"]["engine"] = "bm25"
-        docs.extend(bm25_results)
-    except Exception as e:
-        print(f"BM25 search error: {e}")
-
-    # ===== 去重邏輯 (Deduplication) =====
-    # 基於 page_content 進行簡單去重，確保 LLM 不會吃到重複的字串
-    unique_docs = []
-    seen_contents = set()
-    for doc in docs:
-        content = doc.get("page_content", "")
-        if content not in seen_contents:
-            seen_contents.add(content)
-            unique_docs.append(doc)
-    
-    print(f"Total retrieved docs before dedup: {len(docs)}, after dedup: {len(unique_docs)}")
-
-    # ===== 重排序機制 (Reranking) =====
-    reranker = get_reranker()
-    reranked_docs = reranker.rerank(current_plan, unique_docs, top_k=3)
-    
-    print(f"Docs after reranking: {len(reranked_docs)}")
+    # 沿用 Planner 的推測式檢索結果 (Rerank 仍以改寫後的計畫為準)
+    engine_results, timed_out = _take_prefetched(state) or fan_out_search(current_plan, k=5)
+    reranked_docs = _fuse_and_rerank(current_plan, engine_results)
 
     # 回傳更新的狀態
     return {
-        "retrieved_docs": reranked_docs,  # 搭配 operator.add 會自動 append
-        "search_count": current_count + 1
+        "retrieved_docs": reranked_docs,  # 由 merge_retrieved_docs 去重後累積
+        "search_count": current_count + 1,
+        "timed_out_engines": timed_out,
+        "prefetched_results": None
+    }
+
+async def aresearcher_node(state: AgentState) -> dict:
+    """
+    Researcher 節點 (async 版本，供 graph.ainvoke 使用)
+    檢索於 _search_executor、融合與重排序於 _model_executor 執行，event loop 可同時服務其他請求。
+    """
+    current_plan = state.get("current_plan", "")
+    current_count = state.get("search_count", 0)
+
+    print(f"Researcher invoked. Current count: {current_count}. Plan: {current_plan}")
+
+    prefetched = _take_prefetched(state)
+    engine_results, timed_out = prefetched or await afan_out_search(current_plan, k=5)
+    loop = asyncio.get_running_loop()
+    reranked_docs = await loop.run_in_executor(_model_executor, _fuse_and_rerank, current_plan, engine_results)
+
+    return {
+        "retrieved_docs": reranked_docs,
+        "search_count": current_count + 1,
+        "timed_out_engines": timed_out,
+        "prefetched_results": None
     }
@@ -0,0 +1,164 @@
+import asyncio
+import os
+import sqlite3
+import time
+from functools import partial
+from typing import Any, AsyncIterator, Dict, Optional, Sequence, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import ChannelVersions, Checkpoint, CheckpointMetadata, CheckpointTuple
+# 選用相依套件：langgraph-checkpoint-sqlite (由 get_checkpointer 以 CHECKPOINTER=sqlite 啟用)
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+class CompactingSqliteSaver(SqliteSaver):
+    """
+    以 SQLite 持久化的 Checkpointer，服務重啟後對話狀態仍保留。
+    每隔 compact_interval 秒於寫入時順便壓縮：每個 thread 只保留最新 N 個 checkpoint、
+    移除閒置超過 thread_ttl 的 thread 與孤立的 writes，並截斷 WAL 檔。
+    另以執行緒池包裝 async 介面，讓 graph.ainvoke / astream 可直接使用。
+    """
+
+    def __init__(
+        self,
+        conn: sqlite3.Connection,
+        max_checkpoints_per_thread: int = 20,
+        thread_ttl: Optional[float] = None,
+        compact_interval: float = 3600.0,
+    ):
+        super().__init__(conn)
+        self.max_checkpoints_per_thread = max_checkpoints_per_thread
+        self.thread_ttl = thread_ttl
+        self.compact_interval = compact_interval
+        self._last_compact = time.monotonic()
+
+    @classmethod
+    def from_path(cls, path: str, **kwargs: Any) -> "CompactingSqliteSaver":
+        """開啟 (或建立) 指定路徑的 SQLite 資料庫"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        return cls(sqlite3.connect(path, check_same_thread=False), **kwargs)
+
+    def setup(self) -> None:
+        if self.is_setup:
+            return
+        super().setup()
+        # 記錄每個 thread 最後寫入時間，供 TTL 清除使用
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS thread_activity (thread_id TEXT PRIMARY KEY, updated_at REAL NOT NULL)"
+        )
+        self.conn.commit()
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        result = super().put(config, checkpoint, metadata, new_versions)
+        with self.cursor() as cur:
+            cur.execute(
+                "INSERT INTO thread_activity (thread_id, updated_at) VALUES (?, ?) "
+                "ON CONFLICT(thread_id) DO UPDATE SET updated_at = excluded.updated_at",
+                (str(config["configurable"]["thread_id"]), time.time()),
+            )
+        if time.monotonic() - self._last_compact >= self.compact_interval:
+            self.compact()
+        return result
+
+    def delete_thread(self, thread_id: str) -> None:
+        super().delete_thread(thread_id)
+        with self.cursor() as cur:
+            cur.execute("DELETE FROM thread_activity WHERE thread_id = ?", (str(thread_id),))
+
+    def compact(self) -> Dict[str, int]:
+        """
+        壓縮資料庫。
+        :return: 各類刪除筆數 {"threads", "checkpoints", "writes"}
+        """
+        removed = {"threads": 0, "checkpoints": 0, "writes": 0}
+        with self.cursor() as cur:
+            if self.thread_ttl is not None:
+                cutoff = time.time() - self.thread_ttl
+                expired = [row[0] for row in cur.execute(
+                    "SELECT thread_id FROM thread_activity WHERE updated_at < ?", (cutoff,)
+                )]
+                for thread_id in expired:
+                    cur.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+                    cur.execute("DELETE FROM writes WHERE thread_id = ?", (thread_id,))
+                    cur.execute("DELETE FROM thread_activity WHERE thread_id = ?", (thread_id,))
+                removed["threads"] = len(expired)
+
+            # checkpoint_id 為時間排序的 UUIDv6，依字典序保留最新的 N 個
+            cur.execute(
+                """
+                DELETE FROM checkpoints WHERE rowid IN (
+                    SELECT rowid FROM (
+                        SELECT rowid, ROW_NUMBER() OVER (
+                            PARTITION BY thread_id, checkpoint_ns ORDER BY checkpoint_id DESC
+                        ) AS rn
+                        FROM checkpoints
+                    ) WHERE rn > ?
+                )
+                """,
+                (self.max_checkpoints_per_thread,),
+            )
+            removed["checkpoints"] = cur.rowcount
+            cur.execute(
+                """
+                DELETE FROM writes WHERE NOT EXISTS (
+                    SELECT 1 FROM checkpoints c
+                    WHERE c.thread_id = writes.thread_id
+                      AND c.checkpoint_ns = writes.checkpoint_ns
+                      AND c.checkpoint_id = writes.checkpoint_id
+                )
+                """
+            )
+            removed["writes"] = cur.rowcount
+        with self.lock:
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self._last_compact = time.monotonic()
+        print(f"[Checkpointer] Compacted SQLite checkpoints: {removed}")
+        return removed
+
+    # ===== async 介面：SqliteSaver 本身不支援，改於預設執行緒池執行同步版本 =====
+
+    async def _run(self, func, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(None, partial(func, *args, **kwargs))
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await self._run(self.get_tuple, config)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        items = await self._run(lambda: [*self.list(config, filter=filter, before=before, limit=limit)])
+        for item in items:
+            yield item
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        return await self._run(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        return await self._run(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        return await self._run(self.delete_thread, thread_id)
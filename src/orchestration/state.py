@@ -1,7 +1,72 @@
-from typing import TypedDict, Annotated, List, Any
+import os
+import re
+from typing import TypedDict, Annotated, List, Any, Dict, Optional
 import operator
 from langchain_core.messages import BaseMessage
 
+from src.db.base import content_hash
+
+# 放在更新列表第一筆時，代表先清空既有文件 (新一輪對話開始)
+RESET_DOCS: Dict[str, Any] = {"__reset__": True}
+
+# 累積文件的上限 (筆數 / 估計 token 數)，讓 Generator 的 prompt 不隨對話長度成長
+MAX_RETRIEVED_DOCS = int(os.environ.get("MAX_RETRIEVED_DOCS", "10"))
+MAX_RETRIEVED_DOC_TOKENS = int(os.environ.get("MAX_RETRIEVED_DOC_TOKENS", "4000"))
+
+_CJK_CHAR = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\u3040-\u30ff\uac00-\ud7af]")
+
+def reset_docs(docs: Optional[List[Any]] = None) -> List[Any]:
+    """產生「先清空再寫入」的 retrieved_docs 更新"""
+    return [RESET_DOCS, *(docs or [])]
+
+def estimate_tokens(text: str) -> int:
+    """粗估 token 數：CJK 字元各算一個，其餘以空白分詞後每詞約 1.3 個"""
+    cjk = len(_CJK_CHAR.findall(text))
+    words = len(_CJK_CHAR.sub(" ", text).split())
+    return cjk + int(words * 1.3 + 0.5)
+
+def merge_retrieved_docs(existing: Optional[List[Any]], new: Optional[List[Any]]) -> List[Any]:
+    """retrieved_docs 的 reducer，套用 MAX_RETRIEVED_DOCS / MAX_RETRIEVED_DOC_TOKENS 上限"""
+    return bounded_merge_docs(existing, new, MAX_RETRIEVED_DOCS, MAX_RETRIEVED_DOC_TOKENS)
+
+def bounded_merge_docs(existing: Optional[List[Any]], new: Optional[List[Any]], max_docs: int, max_tokens: int) -> List[Any]:
+    """
+    合併文件列表：
+    - 更新以 RESET_DOCS 開頭時先清空既有文件
+    - 以內容雜湊去重 (保留先出現者)
+    - 超過筆數或 token 上限時，依 rerank_score 保留分數較高的文件 (至少保留一筆)，其餘維持原本順序
+    """
+    existing = list(existing or [])
+    new = list(new or [])
+    if new and new[0] == RESET_DOCS:
+        existing, new = [], new[1:]
+
+    merged, seen = [], set()
+    for doc in existing + new:
+        key = content_hash(doc.get("page_content", ""))
+        if key in seen:
+            continue
+        seen.add(key)
+        merged.append(doc)
+
+    tokens = [estimate_tokens(doc.get("page_content", "")) for doc in merged]
+    if len(merged) <= max_docs and sum(tokens) <= max_tokens:
+        return merged
+
+    def score(i: int) -> float:
+        value = (merged[i].get("metadata") or {}).get("rerank_score")
+        return float("-inf") if value is None else value
+
+    kept, used = set(), 0
+    for i in sorted(range(len(merged)), key=score, reverse=True):
+        if len(kept) >= max_docs:
+            break
+        if kept and used + tokens[i] > max_tokens:
+            continue
+        kept.add(i)
+        used += tokens[i]
+    return [doc for i, doc in enumerate(merged) if i in kept]
+
 class AgentState(TypedDict):
     """
     Agentic RAG 系統的全局狀態定義 (State)。
@@ -15,8 +80,15 @@ class AgentState(TypedDict):
     current_plan: str
     
     # 從資料庫中檢索出的各類文件集合
-    # 使用 operator.add 來累積不同次 Multi-hop 檢索結果
-    retrieved_docs: Annotated[List[Any], operator.add]
+    # 累積不同次 Multi-hop 檢索結果 (去重並有上限)，Planner 於每輪對話開始時以 reset_docs() 清空
+    retrieved_docs: Annotated[List[Any], merge_retrieved_docs]
     
     # 已執行的 Multi-hop 檢索次數
     search_count: int
+    
+    # 最近一次 hop 中超過截止時間而被捨棄結果的檢索引擎
+    timed_out_engines: List[str]
+
+    # Planner 改寫期間以原問題預先檢索的結果 {"engine_results", "timed_out"}，
+    # 改寫結果與原問題相近時由第一次 hop 直接沿用，使用後清空
+    prefetched_results: Optional[Dict[str, Any]]
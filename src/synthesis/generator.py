@@ -1,20 +1,16 @@
 from langchain_core.messages import AIMessage, SystemMessage
 from langchain_core.prompts import ChatPromptTemplate
-# 實務上會使用真實的 LLM，例如 ChatOpenAI
-from langchain_openai import ChatOpenAI
+from langchain_core.runnables import RunnableConfig
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
+from src.orchestration.llm import get_llm
 from src.orchestration.state import AgentState
 
-def generator_node(state: AgentState) -> dict:
-    """
-    Synthesis Layer (Generator 節點)
-    負責接收 retrieved_docs 與原始問題 (messages)，
-    使用嚴格的 Prompt 指示 LLM 依據檢索文本進行回答並標示來源。
-    """
+def _build_messages(state: AgentState) -> list:
+    """組出 System Prompt (含檢索文檔) 與對話歷史"""
     messages = state.get("messages", [])
     docs = state.get("retrieved_docs", [])
     
@@ -42,10 +38,18 @@ def generator_node(state: AgentState) -> dict:
 [檢索文檔結束]"""
 
     # 將 System Prompt 插入作為首筆訊息，後接所有對話歷史
-    final_messages = [SystemMessage(content=system_prompt)] + messages
+    return [SystemMessage(content=system_prompt)] + messages
+
+def generator_node(state: AgentState) -> dict:
+    """
+    Synthesis Layer (Generator 節點)
+    負責接收 retrieved_docs 與原始問題 (messages)，
+    使用嚴格的 Prompt 指示 LLM 依據檢索文本進行回答並標示來源。
+    """
+    final_messages = _build_messages(state)
     
-    # === LLM 呼叫區塊 ===
-    llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
+    # === LLM 呼叫區塊 (共用連線池的 LLM 實例，LLM_BACKEND=fake 時為離線假模型) ===
+    llm = get_llm()
     response = llm.invoke(final_messages)
     answer = response.content
             
@@ -53,3 +57,17 @@ def generator_node(state: AgentState) -> dict:
     return {
         "messages": [AIMessage(content=answer)]
     }
+
+async def agenerator_node(state: AgentState, config: RunnableConfig) -> dict:
+    """
+    Generator 節點 (async 版本，供 graph.ainvoke 使用)
+    config 需明確傳給 LLM，串流 token 的 callbacks 才能在 Python 3.11 以下正確傳遞。
+    """
+    final_messages = _build_messages(state)
+
+    llm = get_llm()
+    response = await llm.ainvoke(final_messages, config=config)
+
+    return {
+        "messages": [AIMessage(content=response.content)]
+    }
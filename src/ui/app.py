@@ -1,6 +1,7 @@
 import streamlit as st
 import httpx
 import asyncio
+import json
 import uuid
 
 # --- Page Config ---
@@ -13,6 +14,28 @@ st.set_page_config(
 
 # --- Constants ---
 API_URL = "http://localhost:8000/chat"
+STREAM_URL = f"{API_URL}/stream"
+
+# 各節點完成時顯示的進度文字
+NODE_STATUS = {
+    "planner": "🎯 已完成意圖分析，開始檢索資料 (Researching)...",
+    "researcher": "🔍 已完成一輪檢索與重排序，正在審核資料 (Reviewing)...",
+    "reviewer": "📄 資料審核完成...",
+    "generator": "🤖 答案生成完成",
+}
+
+def iter_sse(response: httpx.Response):
+    """解析 Server-Sent Events 串流，逐筆產生 (event, data)"""
+    event, data_lines = None, []
+    for line in response.iter_lines():
+        if not line:
+            if event is not None:
+                yield event, json.loads("\n".join(data_lines))
+            event, data_lines = None, []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data_lines.append(line[len("data:"):].strip())
 
 # --- Sidebar ---
 with st.sidebar:
@@ -75,47 +98,61 @@ if user_input := st.chat_input("請輸入問題"):
         message_placeholder.markdown("🧠 正在思考並檢索資料中 (Planning & Researching)...")
         
         try:
-            # 同步呼叫 httpx (Streamlit 預設環境為同步)
+            # 以串流方式呼叫 /chat/stream，節點進度、來源與 token 到達時即時更新畫面
+            answer, logs, sources = "", [], []
+            status_placeholder = st.empty()
             with httpx.Client(timeout=60.0) as client:
-                response = client.post(
-                    API_URL, 
+                with client.stream(
+                    "POST",
+                    STREAM_URL,
                     json={"message": user_input, "thread_id": st.session_state.thread_id}
-                )
-                response.raise_for_status()
-                data = response.json()
-                
-                answer = data.get("answer", "無法取得回答。")
-                logs = data.get("reasoning_logs", [])
-                sources = data.get("sources", [])
-                
-                # 更新畫面字體
-                message_placeholder.markdown(answer)
-                
-                # 即時展示 Expander (不存入 session_state 的重繪，自己先畫一次)
-                with st.expander("🕵️ Agent 思考與檢索過程", expanded=False):
-                    st.markdown("**執行軌跡 (Execution Plan):**")
-                    for log in logs:
-                        st.markdown(f"- {log}")
-                    st.divider()
-                    st.markdown("**檢索來源 (Retrieved Documents):**")
-                    if not sources:
-                        st.markdown("未檢索到相關文檔。")
-                    else:
-                        for i, doc in enumerate(sources):
-                            st.markdown(f"**Document {i+1}**")
-                            st.json(doc["metadata"])
-                            st.text(doc["content"][:200] + "...")
-                            
-                # 存回 Session State 以供重繪
-                st.session_state.messages.append({
-                    "role": "assistant",
-                    "content": answer,
-                    "reasoning": {
-                        "logs": logs,
-                        "sources": sources
-                    }
-                })
-                
+                ) as response:
+                    response.raise_for_status()
+                    for event, data in iter_sse(response):
+                        if event == "node":
+                            status_placeholder.caption(NODE_STATUS.get(data["node"], data["node"]))
+                        elif event == "sources":
+                            sources.extend(data["sources"])
+                            status_placeholder.caption(f"🔍 已取得 {len(sources)} 份相關文件，正在審核資料 (Reviewing)...")
+                        elif event == "token":
+                            answer += data["content"]
+                            message_placeholder.markdown(answer + "▌")
+                        elif event == "done":
+                            answer = data.get("answer") or answer or "無法取得回答。"
+                            logs = data.get("reasoning_logs", [])
+                            sources = data.get("sources", sources)
+                        elif event == "error":
+                            raise RuntimeError(data.get("detail"))
+
+            status_placeholder.empty()
+            # 更新畫面字體
+            message_placeholder.markdown(answer)
+
+            # 即時展示 Expander (不存入 session_state 的重繪，自己先畫一次)
+            with st.expander("🕵️ Agent 思考與檢索過程", expanded=False):
+                st.markdown("**執行軌跡 (Execution Plan):**")
+                for log in logs:
+                    st.markdown(f"- {log}")
+                st.divider()
+                st.markdown("**檢索來源 (Retrieved Documents):**")
+                if not sources:
+                    st.markdown("未檢索到相關文檔。")
+                else:
+                    for i, doc in enumerate(sources):
+                        st.markdown(f"**Document {i+1}**")
+                        st.json(doc["metadata"])
+                        st.text(doc["content"][:200] + "...")
+
+            # 存回 Session State 以供重繪
+            st.session_state.messages.append({
+                "role": "assistant",
+                "content": answer,
+                "reasoning": {
+                    "logs": logs,
+                    "sources": sources
+                }
+            })
+
         except Exception as e:
             error_msg = f"❌ API 請求失敗或超時: {str(e)}"
             message_placeholder.markdown(error_msg)
@@ -0,0 +1,116 @@
+import json
+from typing import List
+from unittest.mock import AsyncMock, patch
+
+from fastapi.testclient import TestClient
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AIMessage
+from langgraph.checkpoint.memory import MemorySaver
+
+from src.api import server
+from src.db.answer_cache import SemanticAnswerCache
+from src.orchestration.graph import build_graph
+
+def _parse_sse(body: str) -> list:
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+async def _fake_generator(state, config):
+    llm = GenericFakeChatModel(messages=iter([AIMessage(content="罰鍰 500 元")]))
+    response = await llm.ainvoke(state["messages"], config=config)
+    return {"messages": [AIMessage(content=response.content)]}
+
+@patch('src.orchestration.graph.agenerator_node', new=_fake_generator)
+@patch('src.orchestration.graph.aresearcher_node', new_callable=AsyncMock)
+@patch('src.orchestration.graph.aplanner_node', new_callable=AsyncMock)
+def test_chat_stream_emits_nodes_sources_and_tokens(mock_planner, mock_researcher):
+    """測試 /chat/stream 依序送出節點進度、來源文件、Generator token 與最終回應"""
+    mock_planner.return_value = {"current_plan": "Plan to research about: 安全帽"}
+    mock_researcher.side_effect = [
+        {"retrieved_docs": [{"page_content": "doc 1", "metadata": {}}], "search_count": 1},
+        {"retrieved_docs": [{"page_content": "doc 2", "metadata": {}}], "search_count": 2},
+    ]
+    test_graph = build_graph().compile(checkpointer=MemorySaver())
+
+    with patch.object(server, "graph", test_graph), patch.object(server, "ANSWER_CACHE_ENABLED", False):
+        client = TestClient(server.app)
+        response = client.post("/chat/stream", json={"message": "沒戴安全帽?", "thread_id": "t1"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = _parse_sse(response.text)
+    kinds = [event for event, _ in events]
+
+    assert kinds[0] == "start" and kinds[-1] == "done"
+    nodes = [data["node"] for event, data in events if event == "node"]
+    assert nodes == ["planner", "researcher", "reviewer", "researcher", "reviewer", "generator"]
+    # 來源在 Generator 開始前即已送出
+    assert kinds.index("sources") < kinds.index("token")
+    tokens = "".join(data["content"] for event, data in events if event == "token")
+    assert tokens == "罰鍰 500 元"
+
+    done = events[-1][1]
+    assert done["answer"] == "罰鍰 500 元"
+    assert [s["content"] for s in done["sources"]] == ["doc 1", "doc 2"]
+
+class _KeywordEmbeddings(Embeddings):
+    """以關鍵字出現與否組成向量的假模型：含「安全帽」的問題彼此相似"""
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed_query(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return [1.0 if "安全帽" in text else 0.0, 1.0 if "酒駕" in text else 0.0, 0.1]
+
+@patch('src.orchestration.graph.agenerator_node', new=_fake_generator)
+@patch('src.orchestration.graph.aresearcher_node', new_callable=AsyncMock)
+@patch('src.orchestration.graph.aplanner_node', new_callable=AsyncMock)
+def test_chat_answer_cache_short_circuits_first_turn(mock_planner, mock_researcher):
+    """測試語意相近的第一輪問題直接命中答案快取，且答案寫入對話狀態；語料版本變動後快取失效"""
+    mock_planner.return_value = {"current_plan": "Plan"}
+    mock_researcher.return_value = {"retrieved_docs": [{"page_content": "doc", "metadata": {}}], "search_count": 3}
+    test_graph = build_graph().compile(checkpointer=MemorySaver())
+    version = {"value": "v1"}
+    cache = SemanticAnswerCache(_KeywordEmbeddings(), threshold=0.9, version_fn=lambda: version["value"])
+
+    with patch.object(server, "graph", test_graph), patch.object(server, "_answer_cache", cache), \
+         patch.object(server, "get_corpus_version", lambda: version["value"]):
+        client = TestClient(server.app)
+        first = client.post("/chat", json={"message": "沒戴安全帽要罰多少錢", "thread_id": "a"}).json()
+        second = client.post("/chat", json={"message": "請問沒戴安全帽罰多少?", "thread_id": "b"}).json()
+
+        assert mock_researcher.await_count == 1
+        assert second["answer"] == first["answer"] == "罰鍰 500 元"
+        assert second["sources"] == first["sources"]
+        assert "Answer Cache" in second["reasoning_logs"][0]
+        state = test_graph.get_state({"configurable": {"thread_id": "b"}}).values
+        assert [m.content for m in state["messages"]] == ["請問沒戴安全帽罰多少?", "罰鍰 500 元"]
+
+        # 重新匯入資料後快取失效
+        version["value"] = "v2"
+        client.post("/chat", json={"message": "沒戴安全帽會怎樣", "thread_id": "c"})
+        assert mock_researcher.await_count == 2
+
+@patch('src.orchestration.graph.agenerator_node', new=_fake_generator)
+@patch('src.orchestration.graph.aresearcher_node', new_callable=AsyncMock)
+@patch('src.orchestration.graph.aplanner_node', new_callable=AsyncMock)
+def test_chat_does_not_cache_degraded_answers(mock_planner, mock_researcher):
+    """測試有引擎逾時或沒有來源的答案不寫入答案快取"""
+    mock_planner.return_value = {"current_plan": "Plan"}
+    cache = SemanticAnswerCache(_KeywordEmbeddings(), threshold=0.9, version_fn=lambda: "v1")
+
+    with patch.object(server, "graph", build_graph().compile(checkpointer=MemorySaver())), \
+         patch.object(server, "_answer_cache", cache), patch.object(server, "get_corpus_version", lambda: "v1"):
+        client = TestClient(server.app)
+        mock_researcher.return_value = {"retrieved_docs": [{"page_content": "doc", "metadata": {}}],
+                                        "search_count": 3, "timed_out_engines": ["neo4j"]}
+        client.post("/chat", json={"message": "沒戴安全帽要罰多少錢", "thread_id": "a"})
+        mock_researcher.return_value = {"retrieved_docs": [], "search_count": 3, "timed_out_engines": []}
+        client.post("/chat", json={"message": "沒戴安全帽罰多少?", "thread_id": "b"})
+
+    assert mock_researcher.await_count == 2
+    assert cache.stats["entries"] == 0
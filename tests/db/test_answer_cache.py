@@ -0,0 +1,63 @@
+from typing import List
+from unittest.mock import patch
+
+from langchain_core.embeddings import Embeddings
+
+from src.db.answer_cache import SemanticAnswerCache
+from src.db.corpus_version import bump_corpus_version, get_corpus_version
+
+class _AxisEmbeddings(Embeddings):
+    """依問題的首字選擇座標軸的假模型 (首字相同者完全相似)"""
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed_query(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = [0.0] * 4
+        vector["abcd".index(text[0])] = 1.0
+        return vector
+
+def test_threshold_and_lru_eviction():
+    """測試相似度門檻與滿載時淘汰最久未命中的項目"""
+    cache = SemanticAnswerCache(_AxisEmbeddings(), threshold=0.9, max_entries=2, version_fn=lambda: "v")
+    cache.store("a1", "A", [])
+    cache.store("b1", "B", [])
+    assert cache.lookup("a2")["answer"] == "A"      # a 變為最近使用
+    assert cache.lookup("c1") is None
+
+    cache.store("c1", "C", [])                      # 淘汰 b
+    assert cache.lookup("b2") is None
+    assert cache.lookup("c2")["similarity"] == 1.0
+    assert cache.stats["entries"] == 2
+
+def test_corpus_version_invalidates_entries(tmp_path):
+    """測試語料版本更新後快取清空，且以舊版本產生的答案不會寫入"""
+    path = str(tmp_path / "corpus_version.json")
+    assert get_corpus_version(path) == "0"
+    old = bump_corpus_version(path)
+    assert get_corpus_version(path) == old
+
+    cache = SemanticAnswerCache(_AxisEmbeddings(), version_fn=lambda: get_corpus_version(path))
+    cache.store("a1", "A", [], version=old)
+    assert cache.lookup("a1") is not None
+
+    new = bump_corpus_version(path)
+    assert new != old
+    assert cache.lookup("a1") is None
+    assert cache.store("a1", "stale", [], version=old) is False
+    assert cache.stats["entries"] == 0
+
+def test_entries_expire_after_ttl():
+    """測試答案超過 ttl 後不再命中，且過期的位置會優先被新答案覆寫"""
+    now = {"value": 100.0}
+    cache = SemanticAnswerCache(_AxisEmbeddings(), threshold=0.9, max_entries=2, version_fn=lambda: "v", ttl=10)
+    with patch("src.db.answer_cache.time.monotonic", lambda: now["value"]):
+        cache.store("a1", "A", [])
+        cache.store("b1", "B", [])
+        assert cache.lookup("a2")["answer"] == "A"
+
+        now["value"] = 111.0
+        assert cache.lookup("a2") is None
+        cache.store("c1", "C", [])
+        assert cache.lookup("c2")["answer"] == "C"
+        assert cache.stats["entries"] == 2
@@ -0,0 +1,50 @@
+import threading
+
+import pytest
+
+from src.db.batching import MicroBatcher
+
+def test_concurrent_requests_share_one_batch():
+    """測試並行送出的輸入會合併成一次呼叫、依長度排序，且結果回到正確的呼叫者"""
+    calls = []
+
+    def batch_fn(items):
+        calls.append(list(items))
+        return [item.upper() for item in items]
+
+    batcher = MicroBatcher(batch_fn, max_batch=16, max_wait_ms=50)
+    results = {}
+    barrier = threading.Barrier(4)
+
+    def worker(text):
+        barrier.wait()
+        results[text] = batcher.submit(text).result(timeout=5)
+
+    threads = [threading.Thread(target=worker, args=(t,)) for t in ["cccc", "a", "bb", "ddd"]]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    batcher.close()
+
+    assert results == {"cccc": "CCCC", "a": "A", "bb": "BB", "ddd": "DDD"}
+    assert len(calls) == 1
+    assert calls[0] == ["a", "bb", "ddd", "cccc"]
+
+def test_batch_size_limit_and_errors():
+    """測試超過 max_batch 會切成多批，batch_fn 例外會傳遞給該批所有呼叫者"""
+    sizes = []
+
+    def batch_fn(items):
+        sizes.append(len(items))
+        if "boom" in items:
+            raise ValueError("boom")
+        return items
+
+    batcher = MicroBatcher(batch_fn, max_batch=2, max_wait_ms=20, sort_key=None)
+    assert batcher(["x", "y", "z"]) == ["x", "y", "z"]
+    assert sizes == [2, 1]
+
+    with pytest.raises(ValueError):
+        batcher(["boom"])
+    batcher.close()
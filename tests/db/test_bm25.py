@@ -0,0 +1,195 @@
+import math
+
+import pytest
+
+from src.db.base import document_id
+from src.db.bm25_index import BM25Index
+from src.db.bm25_store import BM25Store
+from src.db.analyzer import CJKAnalyzer, DEFAULT_STOPWORDS, WhitespaceAnalyzer
+
+DOCS = [
+    {"page_content": "helmet fine for scooter riders", "metadata": {"source": "a.txt", "id": "a"}},
+    {"page_content": "drunk driving fine and license suspension", "metadata": {"source": "b.txt", "id": "b"}},
+    {"page_content": "parking rules in the city", "metadata": {"source": "c.txt", "id": "c"}},
+]
+
+def test_bm25_scores_match_formula(tmp_path):
+    """測試索引計算出的分數與 BM25 公式一致"""
+    store = BM25Store(index_path=str(tmp_path / "bm25_index"), analyzer=WhitespaceAnalyzer())
+    store.add_documents(DOCS)
+
+    results = store.similarity_search("helmet", k=3)
+    assert [r["metadata"]["source"] for r in results] == ["a.txt"]
+
+    lengths = [len(d["page_content"].split()) for d in DOCS]
+    avgdl = sum(lengths) / len(lengths)
+    idf = math.log(1 + (3 - 1 + 0.5) / (1 + 0.5))
+    expected = idf * 1 * 2.5 / (1 + 1.5 * (1 - 0.75 + 0.75 * 5 / avgdl))
+    assert results[0]["score"] == pytest.approx(expected, rel=1e-5)
+
+def test_bm25_store_roundtrip(tmp_path):
+    """測試 BM25Store 建立索引、存檔、重新載入 (mmap) 後檢索"""
+    index_path = str(tmp_path / "bm25_index")
+    store = BM25Store(index_path=index_path)
+    assert store.similarity_search("fine") == []
+
+    store.add_documents(DOCS)
+
+    reloaded = BM25Store(index_path=index_path)
+    results = reloaded.similarity_search("fine helmet", k=2)
+
+    assert len(results) == 2
+    assert results[0]["metadata"]["source"] == "a.txt"
+    assert results[0]["score"] > results[1]["score"] > 0
+    assert reloaded.similarity_search("unknown terms", k=2) == []
+
+def test_incremental_add_update_delete(tmp_path):
+    """測試增量新增、更新、刪除時語料統計量與重建索引的結果一致"""
+    store = BM25Store(index_path=str(tmp_path / "inc"))
+    assert store.add_documents(DOCS[:2]) == 2
+    store.add_documents(DOCS[2:])
+    # 內容未變的文件不會重新寫入，回傳的寫入數不含略過的文件
+    assert store.add_documents(DOCS) == 0
+    assert len(store.index.segments) == 2
+
+    # 更新 b 並刪除 c
+    assert store.update_documents([{"page_content": "helmet law for cyclists", "metadata": {"source": "b.txt", "id": "b"}}]) == 1
+    assert store.delete_documents(["c", "missing"]) == 1
+
+    expected_docs = [DOCS[0], {"page_content": "helmet law for cyclists", "metadata": {"source": "b.txt", "id": "b"}}]
+    rebuilt = BM25Store(index_path=str(tmp_path / "full"))
+    rebuilt.add_documents(expected_docs)
+
+    assert store.index.n_docs == rebuilt.index.n_docs == 2
+    assert store.index.avgdl == rebuilt.index.avgdl
+    got = store.similarity_search("helmet", k=5)
+    want = rebuilt.similarity_search("helmet", k=5)
+    assert [r["page_content"] for r in got] == [r["page_content"] for r in want]
+    assert [r["score"] for r in got] == pytest.approx([r["score"] for r in want])
+    assert store.similarity_search("parking", k=5) == []
+
+def test_background_merge_keeps_results(tmp_path):
+    """測試分段過多時背景合併，合併前後檢索結果與刪除狀態保持一致"""
+    index_path = str(tmp_path / "merge")
+    store = BM25Store(index_path=index_path, max_segments=2)
+    for doc in DOCS:
+        store.add_documents([doc])
+    before = store.similarity_search("fine", k=5)
+
+    store.index.wait_for_merge(timeout=10)
+    assert len(store.index.segments) <= 2
+
+    store.delete_documents(["a"])
+    after = BM25Store(index_path=index_path).similarity_search("fine", k=5)
+    assert [r["metadata"]["id"] for r in before] == ["a", "b"]
+    assert [r["metadata"]["id"] for r in after] == ["b"]
+    assert isinstance(store.index, BM25Index)
+
+def test_cjk_analyzer_tokens():
+    """測試中文以字元 bigram 切分、英文以詞切分並轉小寫、停用詞被移除"""
+    analyzer = CJKAnalyzer(stopwords=["the"])
+    assert analyzer.tokenize("未戴安全帽，The Helmet") == ["未戴", "戴安", "安全", "全帽", "helmet"]
+    assert analyzer.tokenize("罰") == ["罰"]
+    assert CJKAnalyzer(ngram_range=(2, 3)).tokenize("安全帽") == ["安全", "全帽", "安全帽"]
+    # 全形數字經 NFKC 正規化
+    assert CJKAnalyzer().tokenize("５００元") == ["500", "元"]
+    # 單字停用詞在產生 bigram 前切開連續文字，不留下「的罰」之類的 bigram
+    assert CJKAnalyzer(stopwords=DEFAULT_STOPWORDS).tokenize("機車的罰鍰以及吊扣") == ["機車", "罰鍰", "吊扣"]
+
+def test_cjk_retrieval(tmp_path):
+    """測試中文條文可被部分關鍵字命中"""
+    docs = [
+        {"page_content": "機車駕駛人未依規定戴安全帽者，處駕駛人新臺幣五百元罰鍰。", "metadata": {"id": "helmet"}},
+        {"page_content": "汽車駕駛人酒精濃度超過規定標準者，吊扣其駕駛執照。", "metadata": {"id": "alcohol"}},
+    ]
+    analyzer = CJKAnalyzer()
+    store = BM25Store(index_path=str(tmp_path / "cjk"), analyzer=analyzer)
+    store.add_documents(docs)
+
+    results = store.similarity_search("沒戴安全帽要罰多少錢", k=2)
+    assert results[0]["metadata"]["id"] == "helmet"
+
+def test_close_finishes_merge_and_removes_retired_segments(tmp_path):
+    """測試寫入端 close() 會等待合併完成並刪除舊分段目錄；讀取端載入時不刪除任何檔案"""
+    index_path = tmp_path / "flush"
+    store = BM25Store(index_path=str(index_path), max_segments=2)
+    for doc in DOCS:
+        store.add_documents([doc])
+    store.close()
+
+    manifest_segments = {seg.name for seg in store.index.segments}
+    assert len(manifest_segments) <= 2
+    assert {p.name for p in index_path.glob("seg_*")} == manifest_segments
+
+    # 模擬先前程序遺留的舊分段、中斷的合併，以及寫入端正在建立的合併分段
+    stale = next(f"seg_{i:06d}" for i in range(1, 10) if f"seg_{i:06d}" not in manifest_segments)
+    for entry in (stale, "seg_999998.tmp", "seg_999999.tmp"):
+        (index_path / entry).mkdir()
+    reloaded = BM25Store(index_path=str(index_path))
+    assert {p.name for p in index_path.glob("seg_*")} == manifest_segments | {stale, "seg_999998.tmp", "seg_999999.tmp"}
+    assert [r["metadata"]["id"] for r in reloaded.similarity_search("fine", k=5)] == ["a", "b"]
+
+    store.index._building.add("seg_999999")
+    store.flush()
+    assert {p.name for p in index_path.glob("seg_*")} == manifest_segments | {"seg_999999.tmp"}
+
+def test_analyzer_change_rebuilds_index_before_write(tmp_path):
+    """測試斷詞設定變更時，下一次寫入前以新斷詞器重新斷詞所有既有文件"""
+    index_path = tmp_path / "rebuild"
+    docs = [
+        {"page_content": "機車駕駛人未戴安全帽", "metadata": {"id": "helmet"}},
+        {"page_content": "汽車駕駛人酒精濃度超過標準", "metadata": {"id": "alcohol"}},
+    ]
+    BM25Store(index_path=str(index_path), analyzer=WhitespaceAnalyzer()).add_documents(docs)
+
+    store = BM25Store(index_path=str(index_path), analyzer=CJKAnalyzer())
+    assert store.needs_rebuild
+    # 以空白斷詞時整句為一個 token，部分關鍵字無法命中
+    assert store.similarity_search("安全帽", k=2) == []
+
+    store.add_documents(docs + [{"page_content": "行人闖紅燈", "metadata": {"id": "pedestrian"}}])
+
+    assert not store.needs_rebuild
+    assert store.index.meta["analyzer"] == CJKAnalyzer().config
+    assert store.index.n_docs == 3
+    assert store.similarity_search("安全帽", k=2)[0]["metadata"]["id"] == "helmet"
+    assert not (tmp_path / "rebuild.rebuild").exists() and not (tmp_path / "rebuild.old").exists()
+    assert BM25Store(index_path=str(index_path)).similarity_search("酒精", k=2)[0]["metadata"]["id"] == "alcohol"
+
+def test_rebuild_continues_segment_numbering(tmp_path):
+    """測試重建後的分段編號接續舊索引，不會與讀取端仍持有的舊分段同名"""
+    index_path = tmp_path / "renumber"
+    BM25Store(index_path=str(index_path), analyzer=WhitespaceAnalyzer()).add_documents(DOCS)
+    old_names = {seg.name for seg in BM25Store(index_path=str(index_path), analyzer=WhitespaceAnalyzer()).index.segments}
+
+    store = BM25Store(index_path=str(index_path), analyzer=CJKAnalyzer())
+    store.rebuild()
+
+    assert not old_names & {seg.name for seg in store.index.segments}
+
+def test_reader_reloads_when_writer_replaces_segments(tmp_path):
+    """測試讀取端：其他程序合併並刪除分段後，查詢會重新載入索引而不是回傳空結果"""
+    index_path = tmp_path / "reader"
+    writer = BM25Store(index_path=str(index_path), max_segments=1)
+    writer.add_documents(DOCS[:2])
+    reader = BM25Store(index_path=str(index_path))
+
+    writer.add_documents(DOCS[2:])
+    writer.close()
+    assert [r["metadata"]["id"] for r in reader.similarity_search("parking", k=1)] == ["c"]
+
+    # manifest 未變但分段檔案已消失 (檢查與讀取之間被移除)：讀取失敗時重新載入後重試
+    writer.add_documents([{"page_content": "parking fine", "metadata": {"id": "d"}}])
+    writer.close()
+    stale = BM25Store(index_path=str(index_path))
+    stale.index.segments[0].path = str(tmp_path / "missing")
+    assert stale.similarity_search("parking fine", k=1)[0]["metadata"]["id"] == "d"
+
+def test_document_id_is_stable_across_edits():
+    """測試有 chunk 位置時 ID 由 (來源, 位置) 決定，內容修改後不變；沒有位置時才依內容衍生"""
+    original = {"page_content": "舊內容", "metadata": {"source": "a.txt", "chunk_index": 3}}
+    edited = {"page_content": "新內容", "metadata": {"source": "a.txt", "chunk_index": 3}}
+    assert document_id(original) == document_id(edited)
+    assert document_id(original) != document_id({**edited, "metadata": {"source": "a.txt", "chunk_index": 4}})
+    assert document_id({"page_content": "舊內容", "metadata": {"source": "a.txt"}}) != \
+        document_id({"page_content": "新內容", "metadata": {"source": "a.txt"}})
@@ -0,0 +1,61 @@
+import time
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from src.db.cache import LRUCache
+from src.db.embeddings import CachedEmbeddings
+
+def test_lru_eviction_and_stats():
+    """測試超出筆數時淘汰最久未使用的資料，並正確統計命中率"""
+    cache = LRUCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1      # a 變為最近使用
+    cache.set("c", 3)               # 淘汰 b
+
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    assert cache.stats["hits"] == 2
+    assert cache.stats["misses"] == 1
+    assert len(cache) == 2
+
+def test_lru_byte_budget_and_ttl():
+    """測試位元組上限與 TTL 過期"""
+    cache = LRUCache(max_entries=100, max_bytes=10, sizeof=len)
+    cache.set("x", "123456")
+    cache.set("y", "123456")
+    assert "x" not in cache and "y" in cache
+    assert cache.stats["bytes"] == 6
+
+    ttl_cache = LRUCache(ttl=0.05)
+    ttl_cache.set("k", "v")
+    assert ttl_cache.get("k") == "v"
+    time.sleep(0.06)
+    assert ttl_cache.get("k") is None
+
+def test_cached_embeddings_reuses_query_vectors():
+    """測試相同 (正規化後) 查詢只會執行一次 encoder，且以 float32 儲存"""
+    class CountingEmbeddings(Embeddings):
+        def __init__(self):
+            self.calls = 0
+
+        def embed_documents(self, texts: List[str]) -> List[List[float]]:
+            return [[0.5, 0.25] for _ in texts]
+
+        def embed_query(self, text: str) -> List[float]:
+            self.calls += 1
+            return [0.5, 0.25]
+
+    base = CountingEmbeddings()
+    cached = CachedEmbeddings(base, model_name="dummy", max_entries=8)
+
+    first = cached.embed_query("沒戴安全帽 要罰多少？")
+    second = cached.embed_query("  沒戴安全帽   要罰多少？ ")
+
+    assert first == second == [0.5, 0.25]
+    assert base.calls == 1
+    assert cached.stats["hits"] == 1 and cached.stats["misses"] == 1
+    stored = next(iter(cached.cache._data.values()))[0]
+    assert isinstance(stored, np.ndarray) and stored.dtype == np.float32
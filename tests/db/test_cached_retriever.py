@@ -0,0 +1,58 @@
+from typing import Any, Dict, List
+
+from src.db.base import BaseRetriever
+from src.db.cached_retriever import CachedRetriever
+
+class CountingRetriever(BaseRetriever):
+    def __init__(self):
+        self.docs: List[str] = ["A"]
+        self.calls = 0
+
+    def add_documents(self, documents: List[Dict[str, Any]]) -> None:
+        self.docs.extend(d["page_content"] for d in documents)
+
+    def delete_documents(self, ids: List[str]) -> int:
+        self.docs = []
+        return 1
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Dict[str, Any]]:
+        self.calls += 1
+        return [{"page_content": d, "metadata": {}} for d in self.docs[:k]]
+
+def test_repeat_lookups_skip_the_engine():
+    """測試相同 (正規化查詢, k, 過濾條件) 命中快取，不同 k 或過濾條件則重新查詢；回傳複本不受呼叫端修改影響"""
+    base = CountingRetriever()
+    cached = CachedRetriever("bm25", base, version_fn=lambda: "v")
+
+    first = cached.similarity_search("沒戴 安全帽", k=2)
+    first[0]["metadata"]["engine"] = "bm25"
+    second = cached.similarity_search("  沒戴   安全帽 ", k=2)
+
+    assert base.calls == 1
+    assert second == [{"page_content": "A", "metadata": {}}]
+    cached.similarity_search("沒戴 安全帽", k=3)
+    cached.similarity_search("沒戴 安全帽", k=2, source="law.pdf")
+    assert base.calls == 3
+    assert cached.stats["hits"] == 1
+
+def test_writes_bump_corpus_version_and_invalidate(tmp_path, monkeypatch):
+    """測試經由包裝寫入 (add / delete) 會更新語料版本並清空快取；其他程序更新版本時亦失效"""
+    path = str(tmp_path / "corpus_version.json")
+    from src.db import corpus_version
+    monkeypatch.setattr(corpus_version, "CORPUS_VERSION_PATH", path)
+
+    base = CountingRetriever()
+    cached = CachedRetriever("qdrant", base)
+    before = corpus_version.get_corpus_version()
+
+    cached.similarity_search("q")
+    cached.add_documents([{"page_content": "B"}])
+    assert corpus_version.get_corpus_version() != before
+    assert [r["page_content"] for r in cached.similarity_search("q")] == ["A", "B"]
+
+    assert cached.delete_documents(["x"]) == 1
+    assert cached.similarity_search("q") == []
+
+    corpus_version.bump_corpus_version()
+    cached.similarity_search("q")
+    assert base.calls == 4
@@ -0,0 +1,18 @@
+from src.db.entities import EntityExtractor
+
+def test_extracts_chinese_regulations_articles_and_roles():
+    """測試中文條文可擷取出法規名稱、條號與角色名詞 (不需詞典)"""
+    extractor = EntityExtractor()
+    assert extractor.extract("道路交通管理處罰條例第31條規定：") == ["道路交通管理處罰條例", "第31條"]
+    assert extractor.extract("機車駕駛人或附載座人未依規定戴安全帽者") == ["機車駕駛人", "附載座人"]
+    assert extractor.extract("依第三十一條之一處罰") == ["第三十一條"]
+
+def test_lexicon_and_latin_entities(tmp_path):
+    """測試詞典中的詞彙與英文專有名詞皆會被擷取，且結果去重"""
+    lexicon = tmp_path / "lexicon.txt"
+    lexicon.write_text("# 註解\n安全帽\n行人\n", encoding="utf-8")
+    extractor = EntityExtractor.from_file(str(lexicon))
+
+    assert extractor.extract("機車應暫停讓行人先行，未戴安全帽與安全帽") == ["行人", "安全帽"]
+    assert extractor.extract("LangChain helps build Agent systems.") == ["LangChain", "Agent"]
+    assert EntityExtractor.from_file(str(tmp_path / "missing.txt")).extract("安全帽") == []
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from src.db.fusion import normalize_scores, reciprocal_rank_fusion
+
+def _docs(*contents, scores=None):
+    scores = scores or [1.0] * len(contents)
+    return [{"page_content": c, "metadata": {}, "score": s} for c, s in zip(contents, scores)]
+
+def test_rrf_rewards_agreement_across_engines():
+    """測試在多個引擎皆排名靠前的文件，融合後排名最高並完成去重"""
+    results = {
+        "qdrant": _docs("A", "B", "C", scores=[0.9, 0.8, 0.7]),
+        "neo4j": _docs("B", scores=[3]),
+        "bm25": _docs("D", "B", scores=[12.5, 11.0]),
+    }
+    fused = reciprocal_rank_fusion(results, k=60)
+
+    assert [d["page_content"] for d in fused][0] == "B"
+    assert len(fused) == 4
+    assert fused[0]["metadata"]["engines"] == ["qdrant", "neo4j", "bm25"]
+    assert fused[0]["metadata"]["best_rank"] == 1
+    assert [d["metadata"]["best_rank"] for d in fused][1:] == [1, 1, 3]
+    expected = 1 / 62 + 1 / 61 + 1 / 62
+    assert fused[0]["metadata"]["fusion_score"] == pytest.approx(expected)
+
+def test_rrf_weights_and_top_n():
+    """測試引擎權重與 top_n 截斷"""
+    results = {"qdrant": _docs("A"), "bm25": _docs("B")}
+    fused = reciprocal_rank_fusion(results, weights={"bm25": 2.0}, top_n=1)
+
+    assert len(fused) == 1
+    assert fused[0]["page_content"] == "B"
+
+def test_normalized_score_fusion():
+    """測試以正規化分數融合時，不同尺度的分數可以互相比較"""
+    results = {
+        "qdrant": _docs("A", "B", "E", scores=[0.91, 0.90, 0.50]),
+        "bm25": _docs("B", "C", scores=[40.0, 2.0]),
+    }
+    fused = reciprocal_rank_fusion(results, normalization="minmax")
+
+    assert fused[0]["page_content"] == "B"
+    assert fused[1]["page_content"] == "A"
+    assert fused[-1]["metadata"]["fusion_score"] == 0.0
+
+def test_normalize_scores_keeps_missing_values():
+    normalized = normalize_scores(np.array([2.0, np.nan, 4.0]), "minmax")
+    assert normalized[0] == 0.0 and normalized[2] == 1.0
+    assert np.isnan(normalized[1])
+
+    with pytest.raises(ValueError):
+        normalize_scores(np.array([1.0]), "unknown")
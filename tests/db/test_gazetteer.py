@@ -0,0 +1,24 @@
+from src.db.gazetteer import Gazetteer
+
+def test_finds_overlapping_chinese_entities():
+    """測試中文實體可在任意位置命中，且重疊的名稱都會被找出"""
+    gazetteer = Gazetteer(["安全帽", "機車", "機車駕駛人", "駕駛人"])
+    found = gazetteer.find("請問機車駕駛人沒戴安全帽要罰多少錢？")
+    assert found == ["機車", "機車駕駛人", "駕駛人", "安全帽"]
+    assert gazetteer.find("今天天氣很好") == []
+
+def test_latin_entities_respect_word_boundaries_and_case():
+    """測試英數實體需落在詞界上，且比對不分大小寫但回傳原始名稱"""
+    gazetteer = Gazetteer(["Agent", "LangChain"])
+    assert gazetteer.find("how do langchain agents work") == ["LangChain"]
+    assert gazetteer.find("An Agent, built on LangChain.") == ["Agent", "LangChain"]
+
+def test_incremental_add():
+    """測試增量加入名稱後，既有的失敗連結會被重建"""
+    gazetteer = Gazetteer(["乙丙丁"])
+    assert gazetteer.find("甲乙丙") == []
+    assert gazetteer.add(["甲乙丙戊", "乙丙丁", "丙"]) == 2
+    assert len(gazetteer) == 3
+    assert "甲乙丙戊" in gazetteer
+    # '甲乙丙' 之後失配時必須經由失敗連結回到 '乙丙' 才能找到 '乙丙丁'
+    assert gazetteer.find("甲乙丙丁") == ["丙", "乙丙丁"]
@@ -2,6 +2,7 @@ import unittest
 from unittest.mock import MagicMock, patch
 from typing import List, Dict, Any
 
+from src.db.base import content_hash, document_id
 from src.db.neo4j_store import Neo4jStore
 
 class TestNeo4jStore(unittest.TestCase):
@@ -18,10 +19,14 @@ class TestNeo4jStore(unittest.TestCase):
         mock_driver_class.return_value = mock_driver_instance
 
         # 初始化 Store
-        store = Neo4jStore(uri="bolt://mock", user="mock", password="pwd")
+        store = Neo4jStore(uri="bolt://mock", user="mock", password="pwd", batch_size=1)
         
-        # 確認 driver 已被呼叫
+        # 確認 driver 已被呼叫，且啟動時建立了 Document.id 與 Entity.name 的唯一性約束
         mock_driver_class.assert_called_once_with("bolt://mock", auth=("mock", "pwd"))
+        schema_queries = [c.args[0] for c in mock_session_instance.run.call_args_list]
+        self.assertEqual(len(schema_queries), 2)
+        self.assertTrue(all("CREATE CONSTRAINT" in q for q in schema_queries))
+        mock_session_instance.run.reset_mock()
 
         # 整理測試資料 (包含大寫實體 'OpenAI', 'LangChain', 'Agent')
         docs = [
@@ -40,12 +45,21 @@ class TestNeo4jStore(unittest.TestCase):
         # 測試 2: 驗證新增邏輯 (add_documents)
         store.add_documents(docs)
         
-        # 由於寫入了兩個 files, 每次寫入會有 1 次 MERGE Document，
-        # 和對應數量實體的 MERGE Entity 動作
-        # doc1 有 1 個實體 -> 2 calls
-        # doc2 有 2 個實體 -> 3 calls
-        # 總共預期 session.run 會被呼叫 5 次
-        self.assertEqual(mock_session_instance.run.call_count, 5)
+        # batch_size=1，因此兩個 files 各自是一個批次：
+        # 每批先以讀取交易查出已存在的文件 (此處皆為新文件)，再以一個寫入交易 UNWIND 寫入
+        self.assertEqual(mock_session_instance.execute_read.call_count, 2)
+        self.assertEqual(mock_session_instance.execute_write.call_count, 2)
+        self.assertEqual(mock_session_instance.run.call_count, 0)
+
+        tx_func, rows = mock_session_instance.execute_write.call_args_list[1].args
+        self.assertEqual(rows[0]["source"], "doc2.txt")
+        self.assertEqual(sorted(rows[0]["entities"]), ["Agent", "LangChain"])
+
+        # 交易函式本身只送出一次 UNWIND 查詢
+        mock_tx = MagicMock()
+        tx_func(mock_tx, rows)
+        mock_tx.run.assert_called_once()
+        self.assertIn("UNWIND $rows", mock_tx.run.call_args.args[0])
 
         # 測試 3: 驗證檢索邏輯 (similarity_search)
         
@@ -57,7 +71,22 @@ class TestNeo4jStore(unittest.TestCase):
         mock_session_instance.run.return_value = mock_result_cursor
         
         # 執行檢索 (查詢字串包含 'LangChain', 'Agent')
-        results = store.similarity_search("Tell me about LangChain and Agent.", k=1)
+        # 實體字典由圖中的 Entity 載入 (此處為空)，再加上本次寫入的實體
+        mock_session_instance.execute_read.return_value = ([], 1000)
+        mock_session_instance.run.reset_mock()
+        results = store.similarity_search("Tell me about langchain and Agent.", k=1, max_hops=2, fanout=5)
+        search_call = mock_session_instance.run.call_args
+        self.assertEqual(sorted(search_call.kwargs["entities"]), ["Agent", "LangChain"])
+        self.assertEqual(search_call.kwargs["fanout"], 5)
+        # Multi-hop 擴展仍只有一次往返，且每一跳各有一個 CALL 子查詢
+        mock_session_instance.run.assert_called_once()
+        self.assertEqual(search_call.args[0].count("CALL {"), 2)
+        self.assertEqual(store._build_search_query(0).count("CALL {"), 0)
+
+        # 沒有任何已知實體的查詢不會打 Neo4j
+        mock_session_instance.run.reset_mock()
+        self.assertEqual(store.similarity_search("Tell me about Python.", k=1), [])
+        mock_session_instance.run.assert_not_called()
         
         # 確認結果
         self.assertEqual(len(results), 1)
@@ -69,6 +98,32 @@ class TestNeo4jStore(unittest.TestCase):
         reranked = store.rerank("query", results, top_k=1)
         self.assertEqual(len(reranked), 1)
         
+        # 舊版圖譜沒有實體時間戳記：第一次載入後以資料庫時間作為增量刷新的起點
+        self.assertEqual(store._gazetteer_since, 1000)
+        mock_session_instance.execute_read.reset_mock()
+        store.refresh_gazetteer()
+        self.assertEqual(mock_session_instance.execute_read.call_args.args[1], 1000)
+
+        # 測試 5: 內容雜湊未變的文件不重寫，已變動者覆寫
+        mock_session_instance.execute_write.reset_mock()
+        mock_session_instance.execute_read.return_value = {document_id(docs[0]): content_hash(docs[0]["page_content"])}
+        store.add_documents([docs[0]])
+        mock_session_instance.execute_write.assert_not_called()
+
+        store.add_documents([{"page_content": "OpenAI provides new models.", "metadata": {"source": "doc1.txt"}, "id": document_id(docs[0])}])
+        _, rows = mock_session_instance.execute_write.call_args.args
+        self.assertEqual(rows[0]["id"], document_id(docs[0]))
+
+        # 測試 6: 依 ID 刪除文件
+        mock_session_instance.execute_write.reset_mock()
+        mock_session_instance.execute_write.return_value = 1
+        self.assertEqual(store.delete_documents([document_id(docs[0])]), 1)
+        tx_func, ids = mock_session_instance.execute_write.call_args.args
+        self.assertEqual(ids, [document_id(docs[0])])
+        mock_tx = MagicMock()
+        tx_func(mock_tx, ids)
+        self.assertIn("DETACH DELETE", mock_tx.run.call_args.args[0])
+
         # 關閉連線測試
         store.close()
         mock_driver_instance.close.assert_called_once()
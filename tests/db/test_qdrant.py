@@ -3,6 +3,7 @@ import pytest
 from typing import List
 
 from langchain_core.embeddings import Embeddings
+from src.db.base import document_id
 from src.db.qdrant_store import QdrantStore
 
 class DummyEmbeddings(Embeddings):
@@ -49,3 +50,83 @@ def test_qdrant_store_workflow():
     reranked = store.rerank("AI", results, top_k=1)
     assert len(reranked) == 1
     assert reranked[0]["page_content"] == results[0]["page_content"]
+
+def test_qdrant_stream_ingestion_in_batches():
+    """測試串流寫入：generator 輸入、依批次呼叫 embed_documents 並回報吞吐量"""
+    class CountingEmbeddings(DummyEmbeddings):
+        def __init__(self):
+            self.batch_sizes = []
+
+        def embed_documents(self, texts: List[str]) -> List[List[float]]:
+            self.batch_sizes.append(len(texts))
+            return super().embed_documents(texts)
+
+    embeddings = CountingEmbeddings()
+    store = QdrantStore(
+        collection_name="test_stream_collection",
+        embedding_model=embeddings,
+        vector_size=10,
+        qdrant_url=":memory:"
+    )
+
+    docs = ({"page_content": f"chunk {i}", "metadata": {"source": "stream.txt"}} for i in range(10))
+    stats = store.add_documents_stream(docs, batch_size=4)
+
+    assert embeddings.batch_sizes == [4, 4, 2]
+    assert stats["documents"] == 10
+    assert stats["docs_per_second"] > 0
+    assert store.client.count("test_stream_collection").count == 10
+
+def test_qdrant_reingestion_is_idempotent():
+    """測試重複匯入相同內容時 ID 不變、不會重複寫入，也不會再呼叫嵌入模型"""
+    class CountingEmbeddings(DummyEmbeddings):
+        def __init__(self):
+            self.embedded = 0
+
+        def embed_documents(self, texts: List[str]) -> List[List[float]]:
+            self.embedded += len(texts)
+            return super().embed_documents(texts)
+
+    embeddings = CountingEmbeddings()
+    store = QdrantStore(
+        collection_name="test_idempotent_collection",
+        embedding_model=embeddings,
+        vector_size=10,
+        qdrant_url=":memory:"
+    )
+    docs = [
+        {"page_content": "第一段", "metadata": {"source": "a.txt"}},
+        {"page_content": "第二段", "metadata": {"source": "a.txt"}},
+    ]
+
+    store.add_documents(docs)
+    stats = store.add_documents_stream(docs + [{"page_content": "第三段", "metadata": {"source": "a.txt"}}])
+
+    assert stats["skipped"] == 2
+    assert embeddings.embedded == 3
+    assert store.client.count("test_idempotent_collection").count == 3
+
+def test_qdrant_edited_chunk_overwrites_and_delete():
+    """測試以 (來源, 位置) 決定 ID：chunk 內容修改後覆寫同一個 point，並可依 ID 刪除"""
+    store = QdrantStore(
+        collection_name="test_update_collection",
+        embedding_model=DummyEmbeddings(),
+        vector_size=10,
+        qdrant_url=":memory:"
+    )
+    docs = [
+        {"page_content": "第一段", "metadata": {"source": "a.txt", "chunk_index": 0}},
+        {"page_content": "第二段", "metadata": {"source": "a.txt", "chunk_index": 1}},
+    ]
+    store.add_documents(docs)
+
+    edited = {"page_content": "第一段 (修訂)", "metadata": {"source": "a.txt", "chunk_index": 0}}
+    stats = store.add_documents_stream([edited, docs[1]])
+
+    assert stats["skipped"] == 1
+    assert store.client.count("test_update_collection").count == 2
+    point = store.client.retrieve("test_update_collection", ids=[store._point_id(edited)], with_payload=True)[0]
+    assert point.payload["page_content"] == "第一段 (修訂)"
+
+    assert store.delete_documents([document_id(docs[1]), "missing"]) == 1
+    assert store.client.count("test_update_collection").count == 1
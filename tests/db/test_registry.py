@@ -0,0 +1,65 @@
+import time
+import unittest
+from unittest.mock import MagicMock
+
+from src.db.registry import RetrieverRegistry
+
+
+class TestRetrieverRegistry(unittest.TestCase):
+
+    def test_store_is_built_once_and_reused(self):
+        """測試檢索器只建立一次，後續取用直接重用"""
+        factory = MagicMock()
+        registry = RetrieverRegistry(health_check_interval=3600)
+        registry.register("qdrant", factory)
+
+        first = registry.get("qdrant")
+        second = registry.get("qdrant")
+
+        self.assertIs(first, second)
+        factory.assert_called_once()
+        first.health_check.assert_not_called()
+
+    def test_unhealthy_store_is_rebuilt(self):
+        """測試健康檢查失敗時關閉舊實例並重建"""
+        stale, fresh = MagicMock(), MagicMock()
+        stale.health_check.side_effect = ConnectionError("gone")
+        factory = MagicMock(side_effect=[stale, fresh])
+
+        registry = RetrieverRegistry(health_check_interval=0)
+        registry.register("neo4j", factory)
+
+        self.assertIs(registry.get("neo4j"), stale)
+        self.assertIs(registry.get("neo4j"), fresh)
+        stale.close.assert_called_once()
+
+    def test_close_releases_all_stores(self):
+        """測試 close() 關閉所有已建立的連線"""
+        registry = RetrieverRegistry()
+        registry.register("a", MagicMock)
+        registry.register("b", MagicMock)
+        a = registry.get("a")
+
+        registry.close()
+
+        a.close.assert_called_once()
+        with self.assertRaises(KeyError):
+            registry.get("missing")
+
+    def test_idle_store_is_released_and_rebuilt(self):
+        """測試設定 idle_timeout 的檢索器閒置後被關閉，下次取用時重建"""
+        idle, fresh = MagicMock(), MagicMock()
+        factory = MagicMock(side_effect=[idle, fresh])
+        registry = RetrieverRegistry(health_check_interval=3600)
+        registry.register("qdrant", factory, idle_timeout=0.1)
+        registry.register("bm25", MagicMock)
+        bm25 = registry.get("bm25")
+
+        self.assertIs(registry.get("qdrant"), idle)
+        time.sleep(0.3)
+
+        idle.close.assert_called_once()
+        self.assertIsNone(registry.peek("qdrant"))
+        self.assertIs(registry.get("qdrant"), fresh)
+        bm25.close.assert_not_called()
+        registry.close()
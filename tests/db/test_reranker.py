@@ -0,0 +1,81 @@
+from unittest.mock import patch
+
+import numpy as np
+
+from src.db.reranker import BGEReranker
+
+@patch("src.db.reranker.CrossEncoder")
+def test_rerank_scores_only_uncached_pairs(mock_cross_encoder):
+    """測試重複的 (query, chunk) 直接取用快取分數，只有新配對送進 Cross-Encoder"""
+    model = mock_cross_encoder.return_value
+    model.predict.side_effect = lambda pairs, **kwargs: np.array([float(len(doc)) for _, doc in pairs])
+
+    reranker = BGEReranker(cache_size=100)
+    docs = [{"page_content": c, "metadata": {}} for c in ["aa", "aaaa", "a"]]
+
+    first = reranker.rerank("q", docs, top_k=2)
+    assert [d["page_content"] for d in first] == ["aaaa", "aa"]
+    assert first[0]["metadata"]["rerank_score"] == 4.0
+    assert docs[0]["metadata"] == {}
+
+    docs.append({"page_content": "aaa", "metadata": {}})
+    second = reranker.rerank("q", docs, top_k=3)
+
+    assert [d["page_content"] for d in second] == ["aaaa", "aaa", "aa"]
+    assert model.predict.call_count == 2
+    assert model.predict.call_args[0][0] == [["q", "aaa"]]
+    assert reranker.score_cache.stats["hits"] == 3
+
+@patch("src.db.reranker.quantize_dynamic_int8")
+@patch("src.db.reranker.CrossEncoder")
+def test_quantized_mode_and_length_based_batch_size(mock_cross_encoder, mock_quantize):
+    """測試量化模式會量化模型並區分快取鍵，batch size 依輸入長度調整"""
+    reranker = BGEReranker(quantize=True, max_length=128, token_budget=256)
+    mock_quantize.assert_called_once_with(mock_cross_encoder.return_value)
+    assert "int8" in reranker.cache_namespace
+
+    short_pairs = [["q", "x" * 10]] * 40
+    long_pairs = [["q", "x" * 1000]] * 40
+    assert reranker._batch_size(short_pairs) == 23   # 256 // 11
+    assert reranker._batch_size(long_pairs) == 2     # 256 // 128 (截斷於 max_length)
+
+    fp32 = BGEReranker(quantize=False, max_length=128)
+    assert reranker._pair_key("q", "d") != fp32._pair_key("q", "d")
+
+@patch("src.db.reranker.CrossEncoder")
+def test_cascade_prunes_and_stops_early(mock_cross_encoder):
+    """測試 cascade：依各引擎名次剪枝、限制配對數，且 top_k 穩定後不再打分剩餘候選"""
+    model = mock_cross_encoder.return_value
+    relevance = {"d0": 5.0, "d1": 4.0, "d2": 1.0, "d3": 0.5, "d4": 9.0, "d5": 0.1, "d6": 0.2, "weak": 99.0}
+    model.predict.side_effect = lambda pairs, **kwargs: np.array([relevance[doc] for _, doc in pairs])
+
+    names = ["d0", "d1", "weak", "d2", "d3", "d4", "d5", "d6"]
+    ranks = [1, 1, 5, 2, 2, 3, 3, 3]
+    docs = [{"page_content": c, "metadata": {"fusion_score": 1.0 - i / 10, "best_rank": r}}
+            for i, (c, r) in enumerate(zip(names, ranks))]
+
+    reranker = BGEReranker(cache_size=100)
+    ranked = reranker.rerank("q", docs, top_k=2, max_pairs=6, max_rank=3, chunk_size=2)
+
+    # weak 融合分數雖高，但在每個引擎都排在第 3 名之後而被剪掉；d0,d1 -> d2,d3 未改變 top-2，於第二段後停止 (d4 未被打分)
+    assert [d["page_content"] for d in ranked] == ["d0", "d1"]
+    scored = [doc for call in model.predict.call_args_list for _, doc in call[0][0]]
+    assert sorted(scored) == ["d0", "d1", "d2", "d3"]
+
+    # 不分段時會打分全部存活的候選
+    full = reranker.rerank("q", docs, top_k=2, max_pairs=6, max_rank=3)
+    assert [d["page_content"] for d in full] == ["d4", "d0"]
+
+@patch("src.db.reranker.CrossEncoder")
+def test_cascade_scores_in_one_batch_when_early_stop_cannot_help(mock_cross_encoder):
+    """測試候選只夠分成兩段時不分段 (提前停止無法省下打分)，以一次批次打分"""
+    model = mock_cross_encoder.return_value
+    model.predict.side_effect = lambda pairs, **kwargs: np.arange(len(pairs), dtype=np.float32)
+    docs = [{"page_content": f"d{i}", "metadata": {"fusion_score": 1.0 - i / 10, "best_rank": 1}} for i in range(8)]
+
+    reranker = BGEReranker(cache_size=100)
+    ranked = reranker.rerank("q", docs, top_k=3, max_pairs=8, max_rank=3, chunk_size=4)
+
+    assert model.predict.call_count == 1
+    assert len(model.predict.call_args[0][0]) == 8
+    assert [d["page_content"] for d in ranked] == ["d7", "d6", "d5"]
@@ -0,0 +1,73 @@
+import operator
+from typing import Annotated, List, TypedDict
+
+import pytest
+from langgraph.graph import StateGraph, START, END
+
+from src.orchestration.checkpointer import BoundedMemorySaver
+
+class _State(TypedDict):
+    items: Annotated[List[str], operator.add]
+
+def _graph(checkpointer):
+    workflow = StateGraph(_State)
+    workflow.add_node("step", lambda state: {"items": ["x" * 100]})
+    workflow.add_edge(START, "step")
+    workflow.add_edge("step", END)
+    return workflow.compile(checkpointer=checkpointer)
+
+def _config(thread_id):
+    return {"configurable": {"thread_id": thread_id}}
+
+def test_per_thread_checkpoint_cap_keeps_latest_state():
+    """測試每個 thread 只保留最新 N 個 checkpoint，且不影響最新狀態的正確性"""
+    saver = BoundedMemorySaver(max_checkpoints_per_thread=2)
+    graph = _graph(saver)
+    for _ in range(5):
+        graph.invoke({"items": ["q"]}, config=_config("t1"))
+
+    assert len(list(saver.list(_config("t1")))) == 2
+    assert len(graph.get_state(_config("t1")).values["items"]) == 10
+    # 舊 checkpoint 的 blobs 已被清除
+    versions = {key[3] for key in saver.blobs if key[2] == "items"}
+    assert len(versions) <= 2
+
+def test_lru_thread_eviction_and_memory_ceiling():
+    """測試 thread 數與總大小上限：淘汰最久未使用的 thread，最近讀取過的 thread 保留"""
+    saver = BoundedMemorySaver(max_threads=2)
+    graph = _graph(saver)
+    graph.invoke({"items": ["a"]}, config=_config("a"))
+    graph.invoke({"items": ["b"]}, config=_config("b"))
+    graph.get_state(_config("a"))                       # a 變為最近使用
+    graph.invoke({"items": ["c"]}, config=_config("c"))
+
+    assert set(saver.storage) == {"a", "c"}
+    assert graph.get_state(_config("b")).values == {}
+    assert "b" not in saver.storage                     # 查詢不存在的 thread 不會留下空項目
+
+    one_thread = saver.stats["bytes"] // 2
+    small = BoundedMemorySaver(max_bytes=int(one_thread * 1.5))
+    graph = _graph(small)
+    graph.invoke({"items": ["a"]}, config=_config("a"))
+    graph.invoke({"items": ["b"]}, config=_config("b"))
+    assert set(small.storage) == {"b"}
+    assert 0 < small.stats["bytes"] <= int(one_thread * 1.5)
+
+def test_sqlite_compaction(tmp_path):
+    """測試 SQLite 模式的壓縮：裁剪舊 checkpoint 與過期 thread"""
+    pytest.importorskip("langgraph.checkpoint.sqlite")
+    from src.orchestration.sqlite_checkpointer import CompactingSqliteSaver
+
+    saver = CompactingSqliteSaver.from_path(str(tmp_path / "cp.sqlite"), max_checkpoints_per_thread=2, thread_ttl=3600)
+    graph = _graph(saver)
+    for _ in range(3):
+        graph.invoke({"items": ["q"]}, config=_config("t1"))
+    graph.invoke({"items": ["q"]}, config=_config("old"))
+    saver.conn.execute("UPDATE thread_activity SET updated_at = 0 WHERE thread_id = 'old'")
+
+    removed = saver.compact()
+
+    assert removed["threads"] == 1
+    assert len(list(saver.list(_config("t1")))) == 2
+    assert list(saver.list(_config("old"))) == []
+    assert len(graph.get_state(_config("t1")).values["items"]) == 6
@@ -1,6 +1,7 @@
+import asyncio
 import unittest
 from langchain_core.messages import HumanMessage
-from unittest.mock import patch
+from unittest.mock import AsyncMock, patch
 
 from src.orchestration.graph import build_graph
 from langgraph.checkpoint.memory import MemorySaver
@@ -63,3 +64,29 @@ class TestLangGraph(unittest.TestCase):
         # 驗證每一輪迴圈加進去的內容
         self.assertIn("Attempt 1", final_state["retrieved_docs"][0]["page_content"])
         self.assertIn("Attempt 2", final_state["retrieved_docs"][1]["page_content"])
+
+    @patch('src.orchestration.graph.aplanner_node', new_callable=AsyncMock)
+    @patch('src.orchestration.graph.aresearcher_node', new_callable=AsyncMock)
+    @patch('src.orchestration.graph.agenerator_node', new_callable=AsyncMock)
+    def test_graph_ainvoke_uses_async_nodes(self, mock_generator, mock_researcher, mock_planner):
+        """測試 graph.ainvoke 會走 async 節點，路由與狀態合併邏輯與 sync 版本一致"""
+        mock_planner.return_value = {"current_plan": "Plan to research about: async"}
+        mock_researcher.side_effect = [
+            {"retrieved_docs": [{"page_content": "Attempt 1"}], "search_count": 1},
+            {"retrieved_docs": [{"page_content": "Attempt 2"}], "search_count": 2},
+        ]
+        mock_generator.return_value = {"messages": [HumanMessage(content="Mocked Answer")]}
+
+        test_graph = build_graph().compile(checkpointer=MemorySaver())
+        initial_state = {
+            "messages": [HumanMessage(content="async?")],
+            "current_plan": "",
+            "retrieved_docs": [],
+            "search_count": 0
+        }
+        final_state = asyncio.run(test_graph.ainvoke(initial_state, config={"configurable": {"thread_id": "test_async"}}))
+
+        self.assertEqual(final_state["search_count"], 2)
+        self.assertEqual(len(final_state["retrieved_docs"]), 2)
+        self.assertEqual(final_state["messages"][-1].content, "Mocked Answer")
+        self.assertEqual(mock_researcher.await_count, 2)
@@ -0,0 +1,49 @@
+import asyncio
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration
+
+from src.orchestration import llm as llm_module
+from src.orchestration.llm import OfflineChatModel, SQLiteResponseCache, get_llm
+
+
+def _reset_factory(monkeypatch):
+    monkeypatch.setattr(llm_module, "_llms", {})
+    monkeypatch.setattr(llm_module, "_response_cache", None)
+
+
+def test_fake_backend_is_shared_and_cached(tmp_path, monkeypatch):
+    """測試 LLM_BACKEND=fake 時回傳共用的離線模型，相同 prompt 第二次直接命中持久化快取"""
+    _reset_factory(monkeypatch)
+    monkeypatch.setenv("LLM_BACKEND", "fake")
+    monkeypatch.setenv("LLM_CACHE_PATH", str(tmp_path / "llm_cache.sqlite"))
+
+    llm = get_llm()
+    assert isinstance(llm, OfflineChatModel)
+    assert get_llm() is llm
+
+    prompt = [HumanMessage(content="沒戴安全帽罰多少?")]
+    assert llm.invoke(prompt).content == "沒戴安全帽罰多少?"
+    assert asyncio.run(llm.ainvoke(prompt)).content == "沒戴安全帽罰多少?"
+
+    stats = llm_module.get_response_cache().stats
+    assert stats["entries"] == 1
+    assert stats["hits"] == 1
+
+    # 快取存於硬碟，新的快取實例 (例如重啟後) 仍可命中
+    reopened = SQLiteResponseCache(str(tmp_path / "llm_cache.sqlite"))
+    assert reopened.stats["entries"] == 1
+
+
+def test_response_cache_size_eviction(tmp_path):
+    """測試總大小超過上限時淘汰最久未使用的回應"""
+    cache = SQLiteResponseCache(str(tmp_path / "cache.sqlite"), max_bytes=1000)
+    generation = [ChatGeneration(message=AIMessage(content="x" * 100))]
+
+    cache.update("p1", "llm", generation)
+    cache.update("p2", "llm", generation)
+    assert cache.lookup("p1", "llm")[0].message.content == "x" * 100   # p1 變為最近使用
+    cache.update("p3", "llm", generation)
+
+    assert cache.lookup("p2", "llm") is None
+    assert cache.lookup("p1", "llm") is not None
+    assert cache.stats["bytes"] <= 1000
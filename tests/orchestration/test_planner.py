@@ -0,0 +1,144 @@
+import asyncio
+from unittest.mock import MagicMock, patch
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from src.db.cache import LRUCache
+from src.orchestration.nodes import planner
+from src.orchestration.nodes.planner import aplanner_node, needs_rewrite, planner_node, rewrite_coverage
+
+HISTORY = ["User: 機車騎士沒戴安全帽罰多少?", "Assistant: 依道路交通管理處罰條例第31條，處500元罰鍰。"]
+
+
+def _conversation(question):
+    return [
+        HumanMessage(content="機車騎士沒戴安全帽罰多少?"),
+        AIMessage(content="依道路交通管理處罰條例第31條，處500元罰鍰。"),
+        HumanMessage(content=question),
+    ]
+
+
+def test_needs_rewrite_heuristics():
+    """測試本地判斷：指代詞、省略句與過短且無重疊的問題需要改寫，自足的問題不需要"""
+    assert needs_rewrite("那它的法源依據是什麼?", HISTORY)
+    assert needs_rewrite("那汽車呢?", HISTORY)
+    assert needs_rewrite("what about this one", HISTORY)
+    assert needs_rewrite("法源?", HISTORY)
+    # 只與上一個問題共用疑問詞 (主題詞被省略)
+    assert needs_rewrite("罰鍰多少?", HISTORY)
+
+    assert not needs_rewrite("酒駕第一次被抓會吊銷駕照嗎?", HISTORY)
+    assert not needs_rewrite("其他交通違規如何申訴?", HISTORY)
+    assert not needs_rewrite("機車沒戴安全帽會被吊扣駕照嗎?", HISTORY)
+    # 中文追問不論長度，只要省略了上一個問題的主題就需要改寫
+    red_light = ["User: 闖紅燈會被罰多少錢？", "Assistant: 汽車駕駛人闖紅燈處1800元以上5400元以下罰鍰。"]
+    assert needs_rewrite("罰款是多少錢", red_light)
+    assert needs_rewrite("騎機車的話要罰多少", red_light)
+    assert not needs_rewrite("闖紅燈會記點嗎", red_light)
+
+    # 第一輪對話沒有上下文
+    assert not needs_rewrite("它是什麼?", [])
+
+
+@patch.object(planner, "_rewrite_cache", LRUCache(max_entries=8))
+@patch.object(planner, "get_llm")
+def test_self_contained_follow_up_skips_llm(mock_get_llm):
+    """測試自足的追問直接使用原問題，不呼叫 LLM"""
+    result = planner_node({"messages": _conversation("酒駕第一次被抓會吊銷駕照嗎?")})
+
+    mock_get_llm.assert_not_called()
+    assert result["current_plan"] == "Plan to research about: 酒駕第一次被抓會吊銷駕照嗎?"
+    assert result["search_count"] == 0
+
+
+@patch.object(planner, "SPECULATIVE_RETRIEVAL", False)
+@patch.object(planner, "_rewrite_cache", LRUCache(max_entries=8))
+@patch.object(planner, "get_llm")
+def test_rewrite_result_is_cached(mock_get_llm):
+    """測試需要改寫時只呼叫一次 LLM，相同歷史與問題第二次 (含 async 版本) 直接命中快取"""
+    llm = MagicMock()
+    llm.invoke.return_value = AIMessage(content=" 汽車駕駛沒繫安全帶罰多少? ")
+    mock_get_llm.return_value = llm
+    state = {"messages": _conversation("那汽車呢?")}
+
+    first = planner_node(state)
+    second = asyncio.run(aplanner_node(state, {}))
+
+    llm.invoke.assert_called_once()
+    llm.ainvoke.assert_not_called()
+    assert first["current_plan"] == "Plan to research about: 汽車駕駛沒繫安全帶罰多少?"
+    assert second["current_plan"] == first["current_plan"]
+    assert planner.get_rewrite_cache_stats()["hits"] == 1
+
+
+SPECULATIVE = ({"bm25": [{"page_content": "第31條", "metadata": {"engine": "bm25"}}]}, [])
+
+
+def test_rewrite_coverage():
+    """測試改寫結果的詞彙被原問題涵蓋的比例"""
+    assert rewrite_coverage("它的罰則是什麼?", "它的罰則是什麼?") == 1.0
+    assert rewrite_coverage("那汽車呢?", "汽車駕駛沒繫安全帶罰多少?") < 0.3
+
+
+@patch.object(planner, "_rewrite_cache", LRUCache(max_entries=8))
+@patch.object(planner, "fan_out_search", return_value=SPECULATIVE)
+@patch.object(planner, "get_llm")
+def test_speculative_results_reused_when_rewrite_is_close(mock_get_llm, mock_search):
+    """測試改寫期間以原問題推測式檢索，改寫結果相近時交給 Researcher 沿用"""
+    llm = MagicMock()
+    llm.invoke.return_value = AIMessage(content="這個罰則的法源是什麼?")
+    mock_get_llm.return_value = llm
+
+    result = planner_node({"messages": _conversation("這個罰則的法源是什麼?")})
+
+    mock_search.assert_called_once_with("Plan to research about: 這個罰則的法源是什麼?", 5, speculative=True)
+    assert result["prefetched_results"] == {"engine_results": SPECULATIVE[0], "timed_out": SPECULATIVE[1]}
+
+
+@patch.object(planner, "_rewrite_cache", LRUCache(max_entries=8))
+@patch.object(planner, "fan_out_search", return_value=(SPECULATIVE[0], ["neo4j"]))
+@patch.object(planner, "get_llm")
+def test_speculative_results_with_timeouts_are_not_reused(mock_get_llm, mock_search):
+    """測試推測式檢索有引擎逾時時不沿用，由 Researcher 重新檢索"""
+    llm = MagicMock()
+    llm.invoke.return_value = AIMessage(content="這個罰則的法源是什麼?")
+    mock_get_llm.return_value = llm
+
+    result = planner_node({"messages": _conversation("這個罰則的法源是什麼?")})
+
+    assert result["prefetched_results"] is None
+
+
+@patch.object(planner, "_rewrite_cache", LRUCache(max_entries=8))
+@patch.object(planner, "get_llm")
+def test_speculative_task_cancelled_when_rewrite_diverges(mock_get_llm):
+    """測試 async 版本：改寫後的檢索詞與原問題差異大時取消推測式檢索"""
+    started, cancelled = asyncio.Event(), []
+
+    async def slow_search(query, k, speculative=False):
+        started.set()
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(query)
+            raise
+
+    async def rewrite(prompt, config=None):
+        await started.wait()
+        return AIMessage(content="汽車駕駛沒繫安全帶罰多少?")
+
+    llm = MagicMock()
+    llm.ainvoke.side_effect = rewrite
+    mock_get_llm.return_value = llm
+
+    async def run():
+        result = await aplanner_node({"messages": _conversation("那汽車呢?")}, {})
+        await asyncio.sleep(0)
+        return result
+
+    with patch.object(planner, "afan_out_search", side_effect=slow_search):
+        result = asyncio.run(run())
+
+    assert result["current_plan"] == "Plan to research about: 汽車駕駛沒繫安全帶罰多少?"
+    assert result["prefetched_results"] is None
+    assert cancelled == ["Plan to research about: 那汽車呢?"]
@@ -0,0 +1,137 @@
+import asyncio
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+from src.orchestration.nodes import researcher
+
+
+class TestFanOutSearch(unittest.TestCase):
+
+    def test_slow_engine_is_dropped(self):
+        """測試並行檢索：逾時的引擎結果被捨棄並記錄，其餘引擎結果正常回傳"""
+        def fast(query, k):
+            return [{"page_content": f"fast: {query}", "metadata": {}}]
+
+        def slow(query, k):
+            time.sleep(1.0)
+            return [{"page_content": "too late", "metadata": {}}]
+
+        engines = {"qdrant": fast, "neo4j": slow, "bm25": fast}
+        timeouts = {"qdrant": 0.5, "neo4j": 0.1, "bm25": 0.5}
+
+        with patch.dict(researcher._ENGINES, engines, clear=True), \
+             patch.dict(researcher.ENGINE_TIMEOUTS, timeouts, clear=True):
+            start = time.monotonic()
+            results, timed_out = researcher.fan_out_search("query", k=1)
+            elapsed = time.monotonic() - start
+
+        self.assertEqual(timed_out, ["neo4j"])
+        self.assertEqual(set(results), {"qdrant", "bm25"})
+        self.assertEqual(results["bm25"][0]["metadata"]["engine"], "bm25")
+        # 不等待慢速引擎
+        self.assertLess(elapsed, 0.8)
+
+    def test_engine_error_is_isolated(self):
+        """測試單一引擎拋出例外時不影響其他引擎"""
+        def broken(query, k):
+            raise ConnectionError("unreachable")
+
+        def ok(query, k):
+            return [{"page_content": "ok"}]
+
+        with patch.dict(researcher._ENGINES, {"qdrant": ok, "neo4j": broken}, clear=True), \
+             patch.dict(researcher.ENGINE_TIMEOUTS, {"qdrant": 1.0, "neo4j": 1.0}, clear=True):
+            results, timed_out = researcher.fan_out_search("query")
+
+        self.assertEqual(timed_out, [])
+        self.assertEqual(list(results), ["qdrant"])
+        self.assertEqual(results["qdrant"][0]["metadata"]["engine"], "qdrant")
+
+    def test_async_fan_out_does_not_block_event_loop(self):
+        """測試 async 版本：逾時與例外處理同 sync 版本，且檢索期間 event loop 仍可處理其他工作"""
+        def slow(query, k):
+            time.sleep(0.3)
+            return [{"page_content": "slow"}]
+
+        def broken(query, k):
+            raise ConnectionError("unreachable")
+
+        def too_slow(query, k):
+            time.sleep(1.0)
+            return []
+
+        async def scenario():
+            ticks = 0
+
+            async def heartbeat():
+                nonlocal ticks
+                while True:
+                    await asyncio.sleep(0.01)
+                    ticks += 1
+
+            beat = asyncio.ensure_future(heartbeat())
+            outcome = await researcher.afan_out_search("query", k=1)
+            beat.cancel()
+            return outcome, ticks
+
+        engines = {"qdrant": slow, "neo4j": broken, "bm25": too_slow}
+        timeouts = {"qdrant": 1.0, "neo4j": 1.0, "bm25": 0.5}
+        with patch.dict(researcher._ENGINES, engines, clear=True), \
+             patch.dict(researcher.ENGINE_TIMEOUTS, timeouts, clear=True):
+            (results, timed_out), ticks = asyncio.run(scenario())
+
+        self.assertEqual(timed_out, ["bm25"])
+        self.assertEqual(list(results), ["qdrant"])
+        self.assertEqual(results["qdrant"][0]["metadata"]["engine"], "qdrant")
+        self.assertGreater(ticks, 10)
+
+    def test_discarded_speculation_does_not_starve_real_search(self):
+        """測試推測式檢索在獨立的執行緒池執行：被捨棄後仍在跑的引擎查詢不會讓正式檢索排隊逾時"""
+        release, running = threading.Event(), threading.Semaphore(0)
+
+        def search(query, k):
+            if query == "speculative":
+                running.release()
+                release.wait(2.0)
+            return [{"page_content": query}]
+
+        engines = {"qdrant": search, "neo4j": search, "bm25": search}
+        timeouts = {"qdrant": 0.5, "neo4j": 0.5, "bm25": 0.5}
+        with patch.dict(researcher._ENGINES, engines, clear=True), \
+             patch.dict(researcher.ENGINE_TIMEOUTS, timeouts, clear=True), \
+             patch.object(researcher, "_search_executor", ThreadPoolExecutor(max_workers=3)), \
+             patch.object(researcher, "_speculative_executor", ThreadPoolExecutor(max_workers=3)):
+            speculation = ThreadPoolExecutor(max_workers=1).submit(researcher.fan_out_search, "speculative", 1, speculative=True)
+            for _ in engines:
+                running.acquire(timeout=1.0)
+            speculation.cancel()
+            try:
+                results, timed_out = researcher.fan_out_search("real", k=1)
+            finally:
+                release.set()
+
+        self.assertEqual(timed_out, [])
+        self.assertEqual(set(results), {"qdrant", "neo4j", "bm25"})
+
+    def test_first_hop_reuses_prefetched_results(self):
+        """測試第一次 hop 沿用 Planner 的推測式檢索結果 (不再查詢引擎)，使用後清空"""
+        prefetched = {"engine_results": {"bm25": [{"page_content": "第31條", "metadata": {}}]}, "timed_out": ["neo4j"]}
+        state = {"current_plan": "Plan to research about: 安全帽", "search_count": 0, "prefetched_results": prefetched}
+
+        with patch.object(researcher, "fan_out_search") as mock_search, \
+             patch.object(researcher, "_fuse_and_rerank", side_effect=lambda plan, results: results["bm25"]):
+            update = researcher.researcher_node(state)
+
+        mock_search.assert_not_called()
+        self.assertEqual(update["retrieved_docs"][0]["page_content"], "第31條")
+        self.assertEqual(update["timed_out_engines"], ["neo4j"])
+        self.assertIsNone(update["prefetched_results"])
+
+        # 之後的 hop 不沿用
+        with patch.object(researcher, "afan_out_search", return_value=({}, [])) as mock_asearch, \
+             patch.object(researcher, "_fuse_and_rerank", return_value=[]):
+            asyncio.run(researcher.aresearcher_node({**state, "search_count": 1}))
+        mock_asearch.assert_awaited_once()
@@ -0,0 +1,38 @@
+import unittest
+
+from src.orchestration.state import RESET_DOCS, bounded_merge_docs, merge_retrieved_docs, reset_docs
+
+
+def _doc(content, score=None):
+    metadata = {} if score is None else {"rerank_score": score}
+    return {"page_content": content, "metadata": metadata}
+
+
+class TestRetrievedDocsReducer(unittest.TestCase):
+
+    def test_accumulates_and_dedups_by_content(self):
+        """測試跨 hop 累積文件並以內容去重 (保留先出現者)"""
+        merged = merge_retrieved_docs([_doc("A", 1.0)], [_doc("B"), _doc("A", 9.0)])
+
+        self.assertEqual([d["page_content"] for d in merged], ["A", "B"])
+        self.assertEqual(merged[0]["metadata"]["rerank_score"], 1.0)
+
+    def test_reset_marker_clears_previous_turn(self):
+        """測試以 reset_docs() 開始新一輪對話時清空上一輪的文件"""
+        self.assertEqual(reset_docs()[0], RESET_DOCS)
+        self.assertEqual(merge_retrieved_docs([_doc("old")], reset_docs()), [])
+        self.assertEqual(merge_retrieved_docs([_doc("old")], reset_docs([_doc("new")])), [_doc("new")])
+
+    def test_caps_keep_highest_scoring_docs_in_order(self):
+        """測試筆數與 token 上限：保留 rerank_score 較高者並維持原本順序"""
+        docs = [_doc("一二三", 0.1), _doc("四五六", 0.9), _doc("七八九", 0.5)]
+
+        by_count = bounded_merge_docs([], docs, max_docs=2, max_tokens=100)
+        self.assertEqual([d["page_content"] for d in by_count], ["四五六", "七八九"])
+
+        by_tokens = bounded_merge_docs([], docs, max_docs=10, max_tokens=7)
+        self.assertEqual([d["page_content"] for d in by_tokens], ["四五六", "七八九"])
+
+        # 單一文件即超過預算時仍至少保留一筆
+        oversized = bounded_merge_docs([], [_doc("很長的文件內容", 0.3)], max_docs=10, max_tokens=2)
+        self.assertEqual(len(oversized), 1)